@@ -2,10 +2,11 @@
 import streamlit as st
 from export_to_excel import export_to_excel, export_to_excel_bytes
 from tester_agent import generate_test_cases
-from spec_processor import process_uploaded_spec
-from jira_sync import sync_test_cases_to_jira
+from spec_processor import process_uploaded_spec, select_relevant_content
+from jira_sync import sync_test_cases_to_jira, pull_test_case_changes_from_jira
 import os
 import json
+import hashlib
 import re
 from typing import Dict, Any, List
 
@@ -178,6 +179,58 @@ def convert_test_case_to_dict(test_case) -> Dict[str, Any]:
             else:
                 return {}
 
+# Export helpers: file export chỉ được tạo khi người dùng yêu cầu và được nhớ theo content hash
+EXPORT_MIME_TYPES = {
+    "Excel": "application/vnd.ms-excel.sheet.macroEnabled.12",
+    "CSV": "text/csv",
+    "JSON": "application/json",
+    "Xray JSON": "application/zip",
+    "Xray CSV": "application/zip",
+    "Release bundle (ZIP)": "application/zip",
+}
+
+# Định dạng export_pipeline tương ứng từng lựa chọn (Release bundle: mọi định dạng, tạo trong một lượt)
+PIPELINE_EXPORT_FORMATS = {"Excel": "xlsm", "CSV": "csv", "JSON": "json"}
+
+def export_cache_key(export_format: str, rows: List[Dict[str, Any]], settings: Dict[str, Any]) -> str:
+    """Content hash của test cases + settings + định dạng export"""
+    payload = json.dumps([export_format, rows, settings], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def export_file_name(export_format: str, settings: Dict[str, Any]) -> str:
+    """Tên file download theo định dạng export"""
+    if export_format == "Excel":
+        # Tạo tên file theo format: {tên project}_Testcase_v1.0.xlsm
+        # Làm sạch tên project (loại bỏ ký tự không hợp lệ cho tên file)
+        clean_project_name = re.sub(r'[<>:"/\\|?*]', '_', settings.get('name', 'Project'))
+        return f"{clean_project_name}_Testcase_v1.0.xlsm"
+    if export_format in ("Xray JSON", "Xray CSV"):
+        jira_project_key = settings.get('jira_project_key', '') or 'PROJECT'
+        return f"{jira_project_key}_xray_import{'' if export_format == 'Xray CSV' else '_json'}.zip"
+    if export_format == "Release bundle (ZIP)":
+        clean_project_name = re.sub(r'[<>:"/\\|?*]', '_', settings.get('name', 'Project'))
+        return f"{clean_project_name}_test_cases_release.zip"
+    return "test_cases.csv" if export_format == "CSV" else "test_cases.json"
+
+def build_export_data(export_format: str, rows: List[Dict[str, Any]], settings: Dict[str, Any]) -> bytes:
+    """Tạo nội dung file export"""
+    if export_format in PIPELINE_EXPORT_FORMATS:
+        # Excel: template điền bằng patch XML (lỗi thì openpyxl), xem export_pipeline.XlsmTemplateSink
+        from export_pipeline import export_formats
+        fmt = PIPELINE_EXPORT_FORMATS[export_format]
+        return export_formats(rows, [fmt], settings)[fmt]
+    if export_format == "Release bundle (ZIP)":
+        from export_pipeline import available_export_formats, export_bundle_zip
+        return export_bundle_zip(rows, available_export_formats(), settings)
+    if export_format in ("Xray JSON", "Xray CSV"):
+        # Bundle import hàng loạt của Xray (admin import bằng một job phía server)
+        from xray_import import export_xray_import_bundle, resolve_precondition_keys
+        jira_project_key = settings.get('jira_project_key', '') or 'PROJECT'
+        # Có kết nối Jira → tham chiếu Pre-Condition đã có bằng key thật; còn lại ghi dạng text
+        precondition_keys = resolve_precondition_keys(jira_project_key, settings) if settings.get('jira_project_key') else None
+        return export_xray_import_bundle(rows, jira_project_key, 'csv' if export_format == "Xray CSV" else 'json', precondition_keys)
+    return json.dumps(rows, ensure_ascii=False, indent=2).encode("utf-8")
+
 def render_test_case_editor(test_case_dict: Dict[str, Any], test_case_index: int, project_id: int = None):
     """Render test case editor form"""
     st.markdown(f"### ✏️ Chỉnh sửa Test Case {test_case_index + 1}")
@@ -200,6 +253,12 @@ def render_test_case_editor(test_case_dict: Dict[str, Any], test_case_index: int
                 value=test_case_dict.get('test_title', ''),
                 key=f"tc_title_{test_case_index}"
             )
+            module = st.text_input(
+                "🗂️ Module",
+                value=test_case_dict.get('module') or '',
+                help="Mỗi module được xuất ra một sheet riêng trong file Excel",
+                key=f"tc_module_{test_case_index}"
+            )
             description = st.text_area(
                 "📄 Mô tả",
                 value=test_case_dict.get('description', ''),
@@ -257,7 +316,9 @@ def render_test_case_editor(test_case_dict: Dict[str, Any], test_case_index: int
                 'test_steps': test_steps,
                 'test_data': test_data,
                 'expected_result': expected_result,
-                'comments': comments
+                'comments': comments,
+                'module': module.strip() or None,
+                'case_uid': test_case_dict.get('case_uid')
             }
             
             # Update in session state
@@ -445,6 +506,16 @@ def render_project_form(mode: str = "create", project: Dict[str, Any] | None = N
                     value=defaults.get('xray_test_steps_field', 'customfield_11203'),
                     help="Custom field ID cho Manual Test Steps (bao gồm cả Test Data)"
                 )
+                xray_test_plan_key = st.text_input(
+                    "Test Plan Key",
+                    value=defaults.get('xray_test_plan_key', ''),
+                    help="Test Plan để gắn các test sau khi đồng bộ (bỏ trống nếu không dùng)"
+                )
+                xray_test_execution_key = st.text_input(
+                    "Test Execution Key",
+                    value=defaults.get('xray_test_execution_key', ''),
+                    help="Test Execution để gắn các test sau khi đồng bộ (bỏ trống nếu không dùng)"
+                )
 
     st.markdown("---")
     # 2. Testing Configuration Section
@@ -541,6 +612,8 @@ def render_project_form(mode: str = "create", project: Dict[str, Any] | None = N
                     'jira_password': jira_password,
                     # Xray Field Mapping
                     'xray_test_steps_field': xray_test_steps_field,
+                    'xray_test_plan_key': xray_test_plan_key.strip(),
+                    'xray_test_execution_key': xray_test_execution_key.strip(),
                     'testing_types': testing_types,
                     'priority_levels': {
                         'critical': critical_priority,
@@ -765,7 +838,8 @@ def view_create_test_case(project_id: int | None):
                     file_type=file_type,
                     project_settings=settings,
                     image_files=image_payloads,
-                    file_name=file_name
+                    file_name=file_name,
+                    project_id=project_id
                 )
                 
                 # Store in session state for auto-fill
@@ -823,7 +897,7 @@ def view_create_test_case(project_id: int | None):
     with col_gen[1]:
         num_cases = st.number_input("Max Cases", min_value=1, max_value=100, value=10)
     with col_gen[2]:
-        export_format = st.selectbox("Export", ["Excel", "CSV", "JSON"])
+        export_format = st.selectbox("Export", ["Excel", "CSV", "JSON", "Xray JSON", "Xray CSV", "Release bundle (ZIP)"])
     with col_gen[3]:
         if st.button("🗑️ Clear Cache", type="secondary", use_container_width=True, help="Clear all cached data and restart"):
             st.session_state.clear()
@@ -850,24 +924,11 @@ def view_create_test_case(project_id: int | None):
                                 main_content.append(line)
                         cleaned_story = '\n'.join(main_content).strip()
                     
-                    # Extract key functionality from user story for better matching
-                    key_functionality = []
-                    lines = cleaned_story.split('\n')
-                    for line in lines:
-                        line = line.strip()
-                        if line and not line.startswith('#') and not line.startswith('**'):
-                            # Look for user actions and functionality
-                            if any(keyword in line.lower() for keyword in ['want', 'need', 'should', 'can', 'must', 'muốn', 'cần', 'có thể', 'phải', 'login', 'register', 'submit', 'click', 'enter', 'select']):
-                                key_functionality.append(line)
-                    
-                    # If we found key functionality, use it as context
-                    if key_functionality:
-                        cleaned_story = '\n'.join(key_functionality[:5])  # Take first 5 key points
-                    
-                    # Limit story length to prevent API issues
+                    # Limit story length to prevent API issues:
+                    # giữ lại các phần liên quan nhất (xếp hạng theo testing types của project)
                     if len(cleaned_story) > 2000:
-                        cleaned_story = cleaned_story[:2000] + "..."
-                        st.info("ℹ️ User story was truncated to prevent API issues.")
+                        cleaned_story = select_relevant_content(cleaned_story, settings, max_chars=2000)
+                        st.info("ℹ️ User story was shortened to its most relevant sections to prevent API issues.")
                     
                     # Generate test cases with cache busting
                     import time
@@ -940,21 +1001,73 @@ def view_create_test_case(project_id: int | None):
                     st.error("❌ Không thể tải: Project ID không hợp lệ")
         
         with col_save_load[2]:
-            if st.button("🔗 Đồng bộ Jira", help="Đồng bộ test cases lên Jira"):
+            jira_dry_run = st.checkbox("🧪 Xem trước", key="jira_dry_run", help="Chỉ xem test cases nào sẽ được tạo/cập nhật, không gọi Jira")
+            if st.button("🔗 Đồng bộ Jira", help="Đồng bộ test cases lên Jira (chỉ tạo mới / cập nhật test cases đã thay đổi)"):
                 jira_project_key = settings.get('jira_project_key', '')
                 if jira_project_key:
                     # Convert test cases to dict format for syncing
                     test_cases_dict = [convert_test_case_to_dict(tc) for tc in test_cases]
                     
                     with st.spinner("🔄 Đang đồng bộ test cases lên Jira..."):
-                        result = sync_test_cases_to_jira(test_cases_dict, jira_project_key, settings)
+                        sync_progress = st.progress(0.0, text="Đang chuẩn bị đồng bộ...")
+                        
+                        def on_sync_progress(completed, total, issue_result):
+                            status = issue_result['key'] or "❌"
+                            sync_progress.progress(completed / total, text=f"{completed}/{total} test cases - {status}")
+                        
+                        result = sync_test_cases_to_jira(
+                            test_cases_dict,
+                            jira_project_key,
+                            settings,
+                            progress_callback=on_sync_progress,
+                            dry_run=jira_dry_run,
+                            project_id=project_id
+                        )
                         
                         if result['success']:
                             st.success(result['message'])
+                            if jira_dry_run and result.get('plan'):
+                                st.table([
+                                    {'Test Case': test_cases_dict[item['index'] - 1].get('test_case_id', item['index']), 'Action': item['action'], 'Jira Key': item['jira_key'] or ''}
+                                    for item in result['plan']
+                                ])
                         else:
                             st.error(result['message'])
                 else:
                     st.error("❌ Jira Project Key chưa được cấu hình. Vui lòng cấu hình trong project settings.")
+            
+            if st.button("⬇️ Lấy thay đổi từ Jira", help="Cập nhật test cases đã sửa trên Jira kể từ lần lấy trước"):
+                jira_project_key = settings.get('jira_project_key', '')
+                if jira_project_key:
+                    test_cases_dict = [convert_test_case_to_dict(tc) for tc in test_cases]
+                    
+                    with st.spinner("🔄 Đang lấy thay đổi từ Jira..."):
+                        result = pull_test_case_changes_from_jira(test_cases_dict, jira_project_key, settings, project_id=project_id)
+                    
+                    if result['success']:
+                        st.success(result['message'])
+                        if result['conflicts']:
+                            st.warning("⚠️ Các test cases bị sửa ở cả local và Jira (giữ nguyên bản local):")
+                            st.table([
+                                {'Test Case': conflict['test_case_id'], 'Jira Key': conflict['jira_key'], 'Fields': ', '.join(conflict['fields'])}
+                                for conflict in result['conflicts']
+                            ])
+                        if result['changes']:
+                            from tester_agent import TestCase
+                            pulled_test_cases = []
+                            for case_dict in result['test_cases']:
+                                try:
+                                    pulled_test_cases.append(TestCase(**case_dict))
+                                except:
+                                    pulled_test_cases.append(case_dict)
+                            st.session_state.generated_test_cases = pulled_test_cases
+                            if project_id:
+                                save_test_cases(project_id, result['test_cases'])
+                            st.rerun()
+                    else:
+                        st.error(result['message'])
+                else:
+                    st.error("❌ Jira Project Key chưa được cấu hình. Vui lòng cấu hình trong project settings.")
         
         with col_save_load[3]:
             if st.button("🗑️ Xóa tất cả", help="Xóa tất cả test cases"):
@@ -1054,46 +1167,28 @@ def view_create_test_case(project_id: int | None):
         col_export = st.columns([1, 2, 1])
         with col_export[1]:
             try:
-                if export_format == "Excel":
-                    # Sử dụng template_updater thay vì export_to_excel_bytes
-                    from template_updater import update_template_with_values
-                    data = update_template_with_values(settings, test_cases)
-                    
-                    # Tạo tên file theo format: {tên project}_Testcase_v1.0.xlsm
-                    project_name = settings.get('name', 'Project')
-                    # Làm sạch tên project (loại bỏ ký tự không hợp lệ cho tên file)
-                    import re
-                    clean_project_name = re.sub(r'[<>:"/\\|?*]', '_', project_name)
-                    file_name = f"{clean_project_name}_Testcase_v1.0.xlsm"
-                    
-                    st.download_button(
-                        label="📥 Download Excel",
-                        data=data,
-                        file_name=file_name,
-                        mime="application/vnd.ms-excel.sheet.macroEnabled.12",
-                        use_container_width=True,
-                    )
-                elif export_format == "CSV":
-                    import pandas as pd
-                    rows = [convert_test_case_to_dict(tc) for tc in test_cases]
-                    csv_data = pd.DataFrame(rows).to_csv(index=False).encode("utf-8")
-                    st.download_button(
-                        label="📥 Download CSV",
-                        data=csv_data,
-                        file_name="test_cases.csv",
-                        mime="text/csv",
-                        use_container_width=True,
-                    )
-                else:
-                    rows = [convert_test_case_to_dict(tc) for tc in test_cases]
-                    json_data = json.dumps(rows, ensure_ascii=False, indent=2).encode("utf-8")
+                # Chỉ tạo file khi được yêu cầu; dùng lại bản đã tạo nếu test cases + settings không đổi
+                rows = [convert_test_case_to_dict(tc) for tc in test_cases]
+                cache_key = export_cache_key(export_format, rows, settings)
+                export_cache = st.session_state.setdefault('export_cache', {})
+                cached_export = export_cache.get(export_format)
+                
+                if cached_export and cached_export['key'] == cache_key:
                     st.download_button(
-                        label="📥 Download JSON",
-                        data=json_data,
-                        file_name="test_cases.json",
-                        mime="application/json",
+                        label=f"📥 Download {export_format}",
+                        data=cached_export['data'],
+                        file_name=cached_export['file_name'],
+                        mime=EXPORT_MIME_TYPES[export_format],
                         use_container_width=True,
                     )
+                elif st.button(f"⚙️ Tạo file {export_format}", use_container_width=True, help="Tạo file export từ test cases hiện tại"):
+                    with st.spinner(f"🔄 Đang tạo file {export_format}..."):
+                        export_cache[export_format] = {
+                            'key': cache_key,
+                            'data': build_export_data(export_format, rows, settings),
+                            'file_name': export_file_name(export_format, settings),
+                        }
+                    st.rerun()
             except Exception as e:
                 st.error(f"❌ Export failed: {e}")
 
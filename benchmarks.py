@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+# benchmarks.py - Script đo hiệu năng các bước xử lý (OCR, trích xuất spec, export, Jira sync)
+#
+# Cách dùng:
+#   python3 benchmarks.py ocr screenshots/*.png
+#   python3 benchmarks.py docx --paragraphs 20000 --tables 500
+#   python3 benchmarks.py export --rows 1000,10000,100000
+#   python3 benchmarks.py pipeline --rows 1000,10000 --formats xlsx,csv,json
+#   python3 benchmarks.py xlsm --cases 100,1000,5000 --environments 3
+#   python3 benchmarks.py jira --cases 500 --concurrency 1,4,8 --batch-sizes 1,50 --latency 0.02
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+
+def _word_set(text: str) -> set:
+    """Tách text thành tập từ (chữ thường) để tính recall"""
+    return {word for word in re.findall(r"\w+", text.lower()) if len(word) > 1}
+
+
+def benchmark_ocr(image_paths):
+    """
+    So sánh OCR trên ảnh gốc và ảnh đã qua preprocessing.
+
+    - Thời gian xử lý mỗi ảnh cho từng cách
+    - Text recall so với ground truth: file <tên ảnh>.txt đặt cạnh ảnh (nếu có)
+    """
+    from spec_processor import _ocr_image
+
+    print(f"{'Image':<40} {'raw (s)':>9} {'prep (s)':>9} {'raw recall':>11} {'prep recall':>12}")
+    totals = {"raw": 0.0, "prep": 0.0}
+    for path in image_paths:
+        with open(path, "rb") as f:
+            content = f.read()
+
+        timings = {}
+        texts = {}
+        for label, preprocess in (("raw", False), ("prep", True)):
+            started = time.perf_counter()
+            texts[label] = _ocr_image(content, preprocess=preprocess)
+            timings[label] = time.perf_counter() - started
+            totals[label] += timings[label]
+
+        truth_path = os.path.splitext(path)[0] + ".txt"
+        recalls = {"raw": "-", "prep": "-"}
+        if os.path.exists(truth_path):
+            with open(truth_path, "r", encoding="utf-8") as f:
+                truth_words = _word_set(f.read())
+            if truth_words:
+                for label in recalls:
+                    found = len(truth_words & _word_set(texts[label]))
+                    recalls[label] = f"{found / len(truth_words):.1%}"
+
+        print(f"{os.path.basename(path)[:40]:<40} {timings['raw']:>9.3f} {timings['prep']:>9.3f} "
+              f"{recalls['raw']:>11} {recalls['prep']:>12}")
+
+    if image_paths:
+        count = len(image_paths)
+        print(f"{'Average':<40} {totals['raw'] / count:>9.3f} {totals['prep'] / count:>9.3f}")
+
+
+def _measure(func, *args):
+    """Chạy func, trả về (kết quả, thời gian giây, peak memory MB)"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = func(*args)
+    finally:
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, elapsed, peak / (1024 * 1024)
+
+
+def _build_sample_docx(paragraphs: int, tables: int, rows_per_table: int = 10) -> bytes:
+    """Tạo file DOCX lớn (đoạn văn + bảng acceptance criteria) để benchmark"""
+    from docx import Document
+
+    doc = Document()
+    tables_every = max(1, paragraphs // max(1, tables)) if tables else 0
+    table_count = 0
+    for i in range(paragraphs):
+        if i % 50 == 0:
+            doc.add_heading(f"Section {i // 50 + 1}", level=1)
+        doc.add_paragraph(f"REQ-{i}: The system shall validate input field {i} and show an error message.")
+        if tables_every and i % tables_every == 0 and table_count < tables:
+            table = doc.add_table(rows=rows_per_table, cols=3)
+            for row_index, row in enumerate(table.rows):
+                row.cells[0].text = f"AC-{table_count}-{row_index}"
+                row.cells[1].text = "Given a logged in user"
+                row.cells[2].text = "Then the dashboard is displayed"
+            table_count += 1
+
+    buffer = BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def _legacy_docx_text(file_content: bytes) -> str:
+    """Cách đọc DOCX cũ: dựng toàn bộ python-docx Document, chỉ lấy paragraphs"""
+    from docx import Document
+
+    doc = Document(BytesIO(file_content))
+    text_content = ""
+    for paragraph in doc.paragraphs:
+        text_content += paragraph.text + "\n"
+    return text_content
+
+
+def benchmark_docx(paragraphs: int, tables: int, paths=None):
+    """
+    So sánh trích xuất DOCX bằng python-docx (cách cũ) với stream XML (iterparse).
+
+    Lưu ý: peak MB đo bằng tracemalloc nên không tính bộ nhớ C của lxml mà
+    python-docx dùng để giữ cây XML - con số của python-docx thấp hơn thực tế.
+    """
+    from spec_processor import _iter_docx_blocks
+
+    samples = []
+    for path in paths or []:
+        with open(path, "rb") as f:
+            samples.append((os.path.basename(path), f.read()))
+    if not samples:
+        samples.append((f"generated {paragraphs}p/{tables}t", _build_sample_docx(paragraphs, tables)))
+
+    print(f"{'Document':<30} {'method':<10} {'time (s)':>9} {'peak MB':>9} {'chars':>10}")
+    for name, content in samples:
+        for method, func in (
+            ("python-docx", _legacy_docx_text),
+            ("iterparse", lambda data: "\n".join(_iter_docx_blocks(data))),
+        ):
+            text, elapsed, peak_mb = _measure(func, content)
+            print(f"{name[:30]:<30} {method:<10} {elapsed:>9.3f} {peak_mb:>9.1f} {len(text):>10}")
+
+
+def _sample_test_cases(count: int):
+    """Test case mẫu cho benchmark Jira sync (Pre-Condition lặp lại như dữ liệu thật)"""
+    return [
+        {
+            'test_case_id': f"TC-{i:05d}",
+            'description': f"Verify input field {i} shows a validation error",
+            'preconditions': f"User is logged in as role {i % 10}",
+            'test_steps': "Open the form\nEnter an invalid value\nClick Save",
+            'test_data': f"value-{i}",
+            'expected_result': "A validation error is displayed",
+        }
+        for i in range(count)
+    ]
+
+
+def benchmark_jira_sync(cases: int, concurrency_levels, batch_sizes, latency: float,
+                        error_rate: float = 0.0, rate_limit=None, link: bool = False):
+    """
+    Đo throughput của sync_test_cases_to_jira trên fake_jira_server với từng
+    mức concurrency và batch size (mỗi lần chạy dùng server + sync store mới).
+    link: gắn test vào một Test Plan + Test Execution, thời gian gắn đo riêng (cột link).
+    """
+    import jira_sync
+    import jira_sync_store
+    from fake_jira_server import FakeJiraServer
+
+    test_cases = _sample_test_cases(cases)
+    print(f"{cases} test cases, latency {latency * 1000:.0f} ms/request, error rate {error_rate:.1%}, "
+          f"rate limit {rate_limit or '-'} req/s")
+    print(f"{'workers':>7} {'batch':>6} {'time (s)':>9} {'cases/s':>8} {'requests':>9} {'429':>5} {'500':>5} {'synced':>7} {'link (s)':>9}")
+    for batch_size in batch_sizes:
+        for max_workers in concurrency_levels:
+            with tempfile.TemporaryDirectory() as store_dir, \
+                    FakeJiraServer(latency=latency, error_rate=error_rate, rate_limit=rate_limit, seed=0) as server:
+                jira_sync_store.SYNC_STORE_FILE = os.path.join(store_dir, "jira_sync.db")
+                jira_sync.clear_jira_caches()
+                settings = {'jira_server': server.url, 'jira_username': 'bench', 'jira_password': 'bench'}
+                if link:
+                    for setting, issue_type in (('xray_test_plan_key', 'Test Plan'), ('xray_test_execution_key', 'Test Execution')):
+                        settings[setting] = server._create_issue({
+                            'project': {'key': 'BENCH'}, 'summary': f"Benchmark {issue_type}", 'issuetype': {'name': issue_type}
+                        })['key']
+
+                started = time.perf_counter()
+                result = jira_sync.sync_test_cases_to_jira(
+                    test_cases, "BENCH", settings, batch_size=batch_size, max_workers=max_workers
+                )
+                elapsed = time.perf_counter() - started
+
+                counts = dict(server.request_counts)
+                throttled = counts.pop("429", 0)
+                failed = counts.pop("500", 0)
+                synced = len(result.get('created_issues', []))
+                link_seconds = f"{result['link_seconds']:.2f}" if result.get('links') else "-"
+                print(f"{max_workers:>7} {batch_size:>6} {elapsed:>9.2f} {synced / elapsed:>8.1f} "
+                      f"{sum(counts.values()):>9} {throttled:>5} {failed:>5} {synced:>7} {link_seconds:>9}")
+    jira_sync.clear_jira_caches()
+
+
+def _legacy_export_bytes(test_cases) -> bytes:
+    """Cách export cũ: list dict → pandas DataFrame → ExcelWriter"""
+    import pandas as pd
+    from export_to_excel import iter_export_rows
+
+    rows = list(iter_export_rows(test_cases))
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        pd.DataFrame(rows).to_excel(writer, index=False)
+    return buffer.getvalue()
+
+
+def benchmark_export(row_counts, include_legacy: bool = True):
+    """
+    So sánh export_to_excel_bytes kiểu cũ (pandas) với bản stream write_only.
+    Test cases được sinh bằng generator để phần dữ liệu đầu vào không chiếm bộ nhớ.
+    """
+    from export_to_excel import export_to_excel_bytes
+
+    def generated(count):
+        for i in range(count):
+            yield {
+                'test_case_id': i,
+                'test_title': f"Validation {i}",
+                'description': f"Verify input field {i} shows a validation error",
+                'preconditions': f"User is logged in as role {i % 10}",
+                'test_steps': "Open the form; Enter an invalid value; Click Save",
+                'test_data': f"value-{i}",
+                'expected_result': "A validation error is displayed",
+                'comments': "",
+            }
+
+    columns = list(next(generated(1)))
+    methods = [("stream", lambda count: export_to_excel_bytes(generated(count), columns))]
+    if include_legacy:
+        methods.insert(0, ("pandas", lambda count: _legacy_export_bytes(generated(count))))
+
+    print(f"{'rows':>8} {'method':<8} {'time (s)':>9} {'peak MB':>9} {'size KB':>9}")
+    for count in row_counts:
+        for method, func in methods:
+            data, elapsed, peak_mb = _measure(func, count)
+            print(f"{count:>8} {method:<8} {elapsed:>9.2f} {peak_mb:>9.1f} {len(data) / 1024:>9.0f}")
+
+
+def _separate_exports(test_cases, formats):
+    """Cách export cũ: mỗi định dạng tự convert test cases lại từ đầu (CSV qua DataFrame)"""
+    import json
+    import pandas as pd
+    from export_to_excel import convert_test_case_to_dict, export_to_excel_bytes
+
+    results = {}
+    for fmt in formats:
+        if fmt == 'xlsx':
+            results[fmt] = export_to_excel_bytes(test_cases)
+        elif fmt == 'csv':
+            rows = [convert_test_case_to_dict(tc) for tc in test_cases]
+            results[fmt] = pd.DataFrame(rows).to_csv(index=False).encode("utf-8")
+        elif fmt == 'json':
+            rows = [convert_test_case_to_dict(tc) for tc in test_cases]
+            results[fmt] = json.dumps(rows, ensure_ascii=False, indent=2).encode("utf-8")
+        else:
+            raise ValueError(f"Không có bản export cũ cho định dạng {fmt}")
+    return results
+
+
+def benchmark_pipeline(row_counts, formats):
+    """Nhiều định dạng: export riêng từng định dạng vs export_pipeline (chuẩn hóa một lần, ghi trong một lượt)"""
+    from export_pipeline import export_formats
+
+    methods = [("pipeline", lambda cases: export_formats(cases, formats))]
+    if all(fmt in ('xlsx', 'csv', 'json') for fmt in formats):
+        methods.insert(0, ("separate", lambda cases: _separate_exports(cases, formats)))
+
+    print(f"formats: {', '.join(formats)}")
+    print(f"{'rows':>8} {'method':<9} {'time (s)':>9} {'peak MB':>9} {'size KB':>9}")
+    for count in row_counts:
+        test_cases = _sample_test_cases(count)
+        for method, func in methods:
+            results, elapsed, peak_mb = _measure(func, test_cases)
+            size_kb = sum(len(data) for data in results.values()) / 1024
+            print(f"{count:>8} {method:<9} {elapsed:>9.2f} {peak_mb:>9.1f} {size_kb:>9.0f}")
+
+
+_LONG_FLOAT = re.compile(r"-?\d+\.\d{12,}")
+
+
+def _style_repr(style) -> str:
+    """repr của style, số thực làm tròn 12 chữ số (openpyxl rút gọn tint khi ghi lại styles.xml)"""
+    return _LONG_FLOAT.sub(lambda match: f"{float(match.group(0)):.12g}", repr(style))
+
+
+def _xlsm_snapshot(data: bytes) -> dict:
+    """Nội dung nhìn thấy được của workbook: giá trị, style, merge, kích thước cột/dòng của từng sheet"""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(BytesIO(data))
+    snapshot = {"sheets": wb.sheetnames}
+    for ws in wb.worksheets:
+        snapshot[(ws.title, "merged")] = sorted(str(merged) for merged in ws.merged_cells.ranges)
+        snapshot[(ws.title, "columns")] = {key: dim.width for key, dim in ws.column_dimensions.items()}
+        snapshot[(ws.title, "rows")] = {key: dim.height for key, dim in ws.row_dimensions.items() if dim.height}
+        for row in ws.iter_rows():
+            for cell in row:
+                if cell.value is None and not cell.has_style:
+                    continue
+                # so sánh repr: style proxy của hai workbook khác nhau không so sánh bằng == được
+                snapshot[(ws.title, cell.coordinate)] = (
+                    cell.value, _style_repr(cell.font), _style_repr(cell.fill), _style_repr(cell.border),
+                    _style_repr(cell.alignment), cell.number_format, _style_repr(cell.protection)
+                )
+    return snapshot
+
+
+def verify_xlsm_roundtrip(project_settings: dict, test_cases) -> list:
+    """
+    Round-trip check: điền template bằng openpyxl và bằng xlsm_patcher, đọc lại cả hai
+    và so sánh nội dung nhìn thấy được; vbaProject.bin của bản patch phải giữ nguyên byte.
+    Trả về danh sách khác biệt (rỗng = giống nhau).
+    """
+    import zipfile
+    from template_updater import get_template_path, update_template_with_values
+    from xlsm_patcher import update_template_with_values_patched
+
+    expected = update_template_with_values(project_settings, test_cases)
+    patched = update_template_with_values_patched(project_settings, test_cases)
+
+    expected_snapshot = _xlsm_snapshot(expected)
+    patched_snapshot = _xlsm_snapshot(patched)
+    differences = [
+        f"{key}: openpyxl={expected_snapshot.get(key)!r} patched={patched_snapshot.get(key)!r}"
+        for key in set(expected_snapshot) | set(patched_snapshot)
+        if expected_snapshot.get(key) != patched_snapshot.get(key)
+    ]
+
+    with zipfile.ZipFile(get_template_path(project_settings, test_cases)) as template, zipfile.ZipFile(BytesIO(patched)) as output:
+        for name in template.namelist():
+            if name.startswith("xl/worksheets/") or name in ("xl/sharedStrings.xml",):
+                continue
+            if name in output.namelist() and template.read(name) != output.read(name):
+                differences.append(f"{name}: part changed")
+    return differences
+
+
+def benchmark_xlsm(case_counts, environments: int):
+    """So sánh điền template XLSM: openpyxl vs patch XML trực tiếp (thời gian, peak memory, round-trip)"""
+    from template_updater import update_template_with_values
+    from xlsm_patcher import update_template_with_values_patched
+
+    project_settings = {
+        "name": "Benchmark", "phase": "ST",
+        "environment": [f"Env {i + 1}" for i in range(environments)],
+    }
+    print(f"{'cases':>7} {'method':<9} {'time (s)':>9} {'peak MB':>9} {'size KB':>9}")
+    for count in case_counts:
+        test_cases = _sample_test_cases(count)
+        for method, func in (("openpyxl", update_template_with_values), ("patch", update_template_with_values_patched)):
+            data, elapsed, peak_mb = _measure(func, project_settings, test_cases)
+            print(f"{count:>7} {method:<9} {elapsed:>9.3f} {peak_mb:>9.1f} {len(data) / 1024:>9.0f}")
+        differences = verify_xlsm_roundtrip(project_settings, test_cases)
+        print(f"{count:>7} round-trip: {'OK' if not differences else f'{len(differences)} difference(s)'}")
+        for difference in differences[:10]:
+            print(f"        {difference}")
+
+
+def _int_list(value: str):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark các bước xử lý của AI Test Case Generator")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ocr_parser = subparsers.add_parser("ocr", help="OCR ảnh gốc vs ảnh đã preprocessing")
+    ocr_parser.add_argument("images", nargs="+", help="Đường dẫn ảnh screenshot")
+
+    docx_parser = subparsers.add_parser("docx", help="Trích xuất DOCX: python-docx vs stream XML")
+    docx_parser.add_argument("files", nargs="*", help="File DOCX (bỏ trống để tự tạo file mẫu)")
+    docx_parser.add_argument("--paragraphs", type=int, default=20000)
+    docx_parser.add_argument("--tables", type=int, default=500)
+
+    export_parser = subparsers.add_parser("export", help="export_to_excel_bytes: pandas vs write_only stream")
+    export_parser.add_argument("--rows", type=_int_list, default=[1000, 10000, 100000], help="VD: 1000,10000,100000")
+    export_parser.add_argument("--skip-legacy", action="store_true", help="Chỉ đo bản stream")
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="Export nhiều định dạng: riêng lẻ vs export_pipeline một lượt")
+    pipeline_parser.add_argument("--rows", type=_int_list, default=[1000, 10000], help="VD: 1000,10000")
+    pipeline_parser.add_argument("--formats", default="xlsx,csv,json",
+                                 help="VD: xlsx,csv,json (thêm xlsm,jsonl,parquet chỉ đo pipeline)")
+
+    xlsm_parser = subparsers.add_parser("xlsm", help="Điền template XLSM: openpyxl vs patch XML + round-trip check")
+    xlsm_parser.add_argument("--cases", type=_int_list, default=[100, 1000, 5000], help="VD: 100,1000,5000")
+    xlsm_parser.add_argument("--environments", type=int, default=3)
+
+    jira_parser = subparsers.add_parser("jira", help="Throughput Jira sync trên fake Jira server")
+    jira_parser.add_argument("--cases", type=int, default=500)
+    jira_parser.add_argument("--concurrency", type=_int_list, default=[1, 4, 8], help="VD: 1,4,8")
+    jira_parser.add_argument("--batch-sizes", type=_int_list, default=[1, 50], help="VD: 1,50 (1 = không bulk)")
+    jira_parser.add_argument("--latency", type=float, default=0.02, help="Giây chờ mỗi request")
+    jira_parser.add_argument("--error-rate", type=float, default=0.0)
+    jira_parser.add_argument("--rate-limit", type=float, default=None, help="Request/giây trước khi trả 429")
+    jira_parser.add_argument("--link", action="store_true", help="Gắn test vào Test Plan / Test Execution sau khi sync")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "ocr":
+        benchmark_ocr(args.images)
+    elif args.command == "docx":
+        benchmark_docx(args.paragraphs, args.tables, args.files)
+    elif args.command == "export":
+        benchmark_export(args.rows, not args.skip_legacy)
+    elif args.command == "pipeline":
+        benchmark_pipeline(args.rows, [fmt.strip() for fmt in args.formats.split(",") if fmt.strip()])
+    elif args.command == "xlsm":
+        benchmark_xlsm(args.cases, args.environments)
+    elif args.command == "jira":
+        benchmark_jira_sync(args.cases, args.concurrency, args.batch_sizes, args.latency,
+                            args.error_rate, args.rate_limit, args.link)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
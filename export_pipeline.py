@@ -0,0 +1,264 @@
+# export_pipeline.py - Export test cases ra nhiều định dạng trong một lượt
+#
+# Test cases được chuẩn hóa một lần vào ExportBuffer (lưu theo cột); mỗi sink (XLSM template, XLSX,
+# CSV, JSON, JSONL, Parquet) nhận từng dòng từ cùng một buffer, nên ghi nhiều định dạng cùng lúc
+# chỉ tốn một lượt convert_test_case_to_dict.
+import contextlib
+import csv
+import io
+import json
+import os
+import textwrap
+import zipfile
+from typing import Any, Callable, Dict, IO, Iterable, Iterator, List, Optional
+
+from export_to_excel import convert_test_case_to_dict, write_test_cases_workbook
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet là tùy chọn: pip install pyarrow
+    pyarrow = None
+
+
+class ExportBuffer:
+    """
+    Test cases đã chuẩn hóa, lưu theo cột: {field: [giá trị của từng test case]}.
+    Field theo thứ tự xuất hiện (giống DataFrame từ list dict); test case thiếu field → None.
+    Cột dẫn xuất (column(field, transform)) được tính một lần và dùng lại cho mọi sink.
+    """
+
+    def __init__(self):
+        self.fields: List[str] = []
+        self.columns: Dict[str, List[Any]] = {}
+        self.length = 0
+        self._derived: Dict[Any, List[Any]] = {}
+
+    @classmethod
+    def from_test_cases(cls, test_cases: Iterable[Any]) -> "ExportBuffer":
+        buffer = cls()
+        for test_case in test_cases:
+            buffer.append(test_case if isinstance(test_case, dict) else convert_test_case_to_dict(test_case))
+        return buffer
+
+    def append(self, row: Dict[str, Any]):
+        for field in row:
+            if field not in self.columns:
+                self.fields.append(field)
+                self.columns[field] = [None] * self.length
+        for field in self.fields:
+            self.columns[field].append(row.get(field))
+        self.length += 1
+        self._derived.clear()
+
+    def column(self, field: str, transform: Optional[Callable[[Any], Any]] = None) -> List[Any]:
+        """Cột field; có transform thì trả về cột đã biến đổi (cache theo field + transform)"""
+        values = self.columns.get(field, [None] * self.length)
+        if transform is None:
+            return values
+        key = (field, transform)
+        if key not in self._derived:
+            self._derived[key] = [transform(value) if value is not None else value for value in values]
+        return self._derived[key]
+
+    def iter_rows(self) -> Iterator[Dict[str, Any]]:
+        """Từng dòng dạng dict, chỉ tạo khi duyệt"""
+        columns = [self.columns[field] for field in self.fields]
+        for index in range(self.length):
+            yield {field: column[index] for field, column in zip(self.fields, columns)}
+
+    def rows(self) -> List[Dict[str, Any]]:
+        return list(self.iter_rows())
+
+
+class _Sink:
+    """
+    Sink nhận dòng từ ExportBuffer: start(buffer) → write_row(index, row) cho từng dòng → finish().
+    output: file object nhị phân; None → ghi vào bộ nhớ và finish() trả về bytes.
+    """
+    extension = ''
+
+    def __init__(self, output: Optional[IO[bytes]] = None):
+        self._owns_output = output is None
+        self.output = io.BytesIO() if output is None else output
+
+    def start(self, buffer: ExportBuffer):
+        self.buffer = buffer
+
+    def write_row(self, index: int, row: Dict[str, Any]):
+        pass
+
+    def close(self):
+        pass
+
+    def finish(self) -> Optional[bytes]:
+        self.close()
+        return self.output.getvalue() if self._owns_output else None
+
+
+class CsvSink(_Sink):
+    """CSV: header là tên field, giá trị None để trống (như DataFrame.to_csv(index=False))"""
+    extension = 'csv'
+
+    def start(self, buffer):
+        super().start(buffer)
+        self._text = io.TextIOWrapper(self.output, encoding='utf-8', newline='', write_through=True)
+        self._writer = csv.writer(self._text, lineterminator=os.linesep)
+        self._writer.writerow(buffer.fields)
+
+    def write_row(self, index, row):
+        self._writer.writerow(row.values())
+
+    def close(self):
+        self._text.flush()
+        self._text.detach()
+
+
+class JsonSink(_Sink):
+    """JSON array, cùng nội dung với json.dumps(rows, ensure_ascii=False, indent=2), ghi từng phần tử"""
+    extension = 'json'
+
+    def start(self, buffer):
+        super().start(buffer)
+        self.output.write(b'[' if buffer.length else b'[]')
+
+    def write_row(self, index, row):
+        item = textwrap.indent(json.dumps(row, ensure_ascii=False, indent=2), '  ')
+        self.output.write(((',\n' if index else '\n') + item).encode('utf-8'))
+
+    def close(self):
+        if self.buffer.length:
+            self.output.write(b'\n]')
+
+
+class JsonlSink(_Sink):
+    """JSON Lines: một test case trên một dòng"""
+    extension = 'jsonl'
+
+    def write_row(self, index, row):
+        self.output.write(json.dumps(row, ensure_ascii=False).encode('utf-8') + b'\n')
+
+
+class XlsxSink(_Sink):
+    """XLSX: ghi bằng write_test_cases_workbook của export_to_excel, cột theo thứ tự field của buffer"""
+    extension = 'xlsx'
+
+    def close(self):
+        write_test_cases_workbook(self.buffer.iter_rows(), self.output, columns=self.buffer.fields)
+
+
+class XlsmTemplateSink(_Sink):
+    """
+    Template TPL_TestResult (.xlsm) điền bằng xlsm_patcher; lỗi patch thì dùng template_updater (openpyxl).
+    Sheet Module cần toàn bộ test cases (chia theo module), nên sink đọc thẳng từ buffer khi finish.
+    """
+    extension = 'xlsm'
+
+    def __init__(self, project_settings: Dict[str, Any], output: Optional[IO[bytes]] = None):
+        super().__init__(output)
+        self.project_settings = project_settings
+
+    def close(self):
+        from template_updater import update_template_with_values
+        from xlsm_patcher import update_template_with_values_patched
+        rows = self.buffer.rows()
+        try:
+            data = update_template_with_values_patched(self.project_settings, rows)
+        except FileNotFoundError:
+            raise
+        except Exception as patch_error:
+            print(f"Patch XLSM lỗi, dùng openpyxl: {patch_error}")
+            data = update_template_with_values(self.project_settings, rows)
+        self.output.write(data)
+
+
+class ParquetSink(_Sink):
+    """Parquet (cần pyarrow): ghi thẳng các cột của buffer, không qua từng dòng"""
+    extension = 'parquet'
+
+    def __init__(self, output: Optional[IO[bytes]] = None):
+        if pyarrow is None:
+            raise RuntimeError("Export Parquet cần thư viện pyarrow (pip install pyarrow)")
+        super().__init__(output)
+
+    def close(self):
+        arrays = {}
+        for field in self.buffer.fields:
+            values = self.buffer.column(field)
+            try:
+                arrays[field] = pyarrow.array(values)
+            except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+                # Cột lẫn kiểu (VD số và chuỗi) → lưu dạng chuỗi
+                arrays[field] = pyarrow.array([None if value is None else str(value) for value in values])
+        pyarrow.parquet.write_table(pyarrow.table(arrays), self.output)
+
+
+# Tên định dạng → sink (XLSM cần project_settings)
+EXPORT_SINKS = {
+    'xlsm': XlsmTemplateSink,
+    'xlsx': XlsxSink,
+    'csv': CsvSink,
+    'json': JsonSink,
+    'jsonl': JsonlSink,
+    'parquet': ParquetSink,
+}
+
+
+def available_export_formats() -> List[str]:
+    """Các định dạng dùng được trong môi trường hiện tại (parquet chỉ khi có pyarrow)"""
+    return [fmt for fmt in EXPORT_SINKS if fmt != 'parquet' or pyarrow is not None]
+
+
+def create_sink(fmt: str, project_settings: Optional[Dict[str, Any]] = None,
+                output: Optional[IO[bytes]] = None) -> _Sink:
+    if fmt not in EXPORT_SINKS:
+        raise ValueError(f"Định dạng export không hỗ trợ: {fmt}")
+    if fmt == 'xlsm':
+        return XlsmTemplateSink(project_settings or {}, output)
+    return EXPORT_SINKS[fmt](output)
+
+
+def run_export_pipeline(test_cases: Iterable[Any], sinks: List[_Sink]) -> List[Optional[bytes]]:
+    """Chuẩn hóa test cases một lần rồi đẩy từng dòng qua mọi sink trong một lượt; trả về kết quả finish() theo thứ tự sink"""
+    buffer = test_cases if isinstance(test_cases, ExportBuffer) else ExportBuffer.from_test_cases(test_cases)
+    for sink in sinks:
+        sink.start(buffer)
+    row_sinks = [sink for sink in sinks if type(sink).write_row is not _Sink.write_row]
+    if row_sinks:
+        for index, row in enumerate(buffer.iter_rows()):
+            for sink in row_sinks:
+                # Mỗi sink nhận bản copy nông: sink có thể thay giá trị (VD test_steps đã đánh số)
+                sink.write_row(index, dict(row) if len(row_sinks) > 1 else row)
+    return [sink.finish() for sink in sinks]
+
+
+def export_formats(test_cases: Iterable[Any], formats: List[str],
+                   project_settings: Optional[Dict[str, Any]] = None) -> Dict[str, bytes]:
+    """Export nhiều định dạng trong bộ nhớ: {fmt: bytes}"""
+    formats = list(dict.fromkeys(formats))
+    sinks = [create_sink(fmt, project_settings) for fmt in formats]
+    return dict(zip(formats, run_export_pipeline(test_cases, sinks)))
+
+
+def write_export_files(test_cases: Iterable[Any], output_dir: str, formats: List[str],
+                       project_settings: Optional[Dict[str, Any]] = None,
+                       base_name: str = "test_cases") -> Dict[str, str]:
+    """Ghi nhiều định dạng ra thư mục (stream thẳng vào file): {fmt: đường dẫn}; định dạng lặp lại chỉ ghi một lần"""
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {fmt: os.path.join(output_dir, f"{base_name}.{EXPORT_SINKS[fmt].extension}") for fmt in dict.fromkeys(formats)}
+    with contextlib.ExitStack() as files:
+        run_export_pipeline(test_cases, [create_sink(fmt, project_settings, files.enter_context(open(path, 'wb')))
+                                         for fmt, path in paths.items()])
+    return paths
+
+
+def export_bundle_zip(test_cases: Iterable[Any], formats: List[str],
+                      project_settings: Optional[Dict[str, Any]] = None,
+                      base_name: str = "test_cases") -> bytes:
+    """ZIP chứa mọi định dạng yêu cầu, tạo trong một lượt (dùng cho đóng gói release)"""
+    results = export_formats(test_cases, formats, project_settings)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        for fmt, data in results.items():
+            bundle.writestr(f"{base_name}.{EXPORT_SINKS[fmt].extension}", data)
+    return buffer.getvalue()
@@ -1,6 +1,7 @@
 # export_to_excel.py - Excel export helper
-import pandas as pd
 from io import BytesIO
+import itertools
+from openpyxl import Workbook
 import re
 
 def convert_test_case_to_dict(test_case) -> dict:
@@ -92,53 +93,100 @@ def format_test_steps(test_steps: str) -> str:
     
     return '\n'.join(formatted_steps)
 
-def export_to_excel(test_cases, path: str = "test_cases.xlsx"):
-    """
-    Export test cases to an Excel file.
-    
-    Args:
-        test_cases: list of Pydantic models (or dicts)
-        path: Output file path (default: "test_cases.xlsx")
-    """
-    # Convert test cases to dictionaries if they are Pydantic models
-    rows = []
+# Tên sheet giống pandas.DataFrame.to_excel mặc định
+EXPORT_SHEET_NAME = "Sheet1"
+
+def iter_export_rows(test_cases):
+    """Yield one export row (dict) per test case, with test_steps formatted as a numbered list."""
     for tc in test_cases:
         if hasattr(tc, "dict"):
             row = convert_test_case_to_dict(tc)
         else:
             row = dict(tc)
         
-        # Format test_steps with numbered list
-        if 'test_steps' in row:
-            row['test_steps'] = format_test_steps(row['test_steps'])
+        # Format test_steps with numbered list (missing / non-text steps are written as they are)
+        if isinstance(row.get('test_steps'), str):
+            row = {**row, 'test_steps': format_test_steps(row['test_steps'])}
         
-        rows.append(row)
-    
-    df = pd.DataFrame(rows)
-    df.to_excel(path, index=False)
+        yield row
+
+def _excel_value(value):
+    """Cell value as pandas would write it (None → empty cell, containers as text)"""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
 
+def export_columns(rows) -> list:
+    """Union of the fields of all rows, in order of first appearance (like a DataFrame built from a list of dicts)"""
+    columns = {}
+    for row in rows:
+        columns.update(dict.fromkeys(row))
+    return list(columns)
 
-def export_to_excel_bytes(test_cases) -> bytes:
+def write_test_cases_workbook(test_cases, output, columns=None):
     """
-    Create an Excel file in-memory and return bytes for download.
+    Write test cases into an .xlsx with openpyxl write_only (no DataFrame), same layout as
+    DataFrame.to_excel: one header row with the field names, one row per test case.
+    
+    Args:
+        test_cases: iterable of Pydantic models (or dicts)
+        output: file path or binary file object
+        columns: column order. Given → rows are streamed as they are produced. None (fallback for
+                 dicts with unknown fields): every field of every test case (export_columns), which
+                 needs all rows read first.
+                 Fields missing from a test case are left empty.
     """
-    # Convert test cases to dictionaries if they are Pydantic models
-    rows = []
-    for tc in test_cases:
-        if hasattr(tc, "dict"):
-            row = convert_test_case_to_dict(tc)
-        else:
-            row = dict(tc)
-        
-        # Format test_steps with numbered list
-        if 'test_steps' in row:
-            row['test_steps'] = format_test_steps(row['test_steps'])
-        
-        rows.append(row)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(EXPORT_SHEET_NAME)
+    
+    rows = iter_export_rows(test_cases)
+    if columns is None:
+        rows = list(rows)
+        columns = export_columns(rows)
+    columns = list(columns)
+    if columns:
+        ws.append(columns)
+    
+    for row in rows:
+        ws.append([_excel_value(row.get(column)) for column in columns])
     
-    df = pd.DataFrame(rows)
+    wb.save(output)
+
+def model_export_columns(test_cases):
+    """
+    Known column order for streaming: the fields of the Pydantic model (TestCase) of the first test case.
+    Returns (columns, test_cases) with test_cases as an iterator that still yields the first item;
+    columns is None for dicts (their fields are only known after reading every row).
+    """
+    test_cases = iter(test_cases)
+    first = next(test_cases, None)
+    if first is None:
+        return None, iter(())
+    fields = getattr(type(first), 'model_fields', None)
+    return (list(fields) if fields else None), itertools.chain([first], test_cases)
+
+def export_to_excel(test_cases, path: str = "test_cases.xlsx", columns=None):
+    """
+    Export test cases to an Excel file.
+    
+    Args:
+        test_cases: iterable of Pydantic models (or dicts)
+        path: Output file path (default: "test_cases.xlsx")
+        columns: column order; default is the TestCase field order (rows stream through),
+                 or the union of all fields for dicts
+    """
+    if columns is None:
+        columns, test_cases = model_export_columns(test_cases)
+    write_test_cases_workbook(test_cases, path, columns)
+
+
+def export_to_excel_bytes(test_cases, columns=None) -> bytes:
+    """
+    Create an Excel file in-memory and return bytes for download (columns: as in export_to_excel).
+    """
+    if columns is None:
+        columns, test_cases = model_export_columns(test_cases)
     buffer = BytesIO()
-    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False)
+    write_test_cases_workbook(test_cases, buffer, columns)
     buffer.seek(0)
     return buffer.read()
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# fake_jira_server.py - Jira/Xray REST server giả lập (in-memory) để test và benchmark jira_sync.py
+#
+# Chỉ cài các endpoint mà jira_sync.py dùng:
+#   GET  /rest/api/2/serverInfo, /rest/api/2/myself, /rest/api/2/field, /rest/api/2/priority
+#   GET  /rest/api/2/project/{key}, /rest/api/2/issue/createmeta/{key}/issuetypes
+#   GET  /rest/api/2/search            (JQL: project, issuetype, labels =/in, key in, updated >=; các điều kiện khác bị bỏ qua)
+#   POST /rest/api/2/issue, /rest/api/2/issue/bulk
+#   GET/PUT /rest/api/2/issue/{key}
+#   POST /rest/raven/1.0/api/testplan/{key}/test, /rest/raven/1.0/api/testexec/{key}/test
+#
+# Cách dùng:
+#   python3 fake_jira_server.py --port 8089 --latency 0.05 --error-rate 0.01 --rate-limit 50
+#   (đăng nhập với user/password bất kỳ)
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, tzinfo
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+API_PREFIX = "/rest/api/2/"
+_XRAY_CONTAINER_PATH = re.compile(r"/rest/raven/1\.0/api/(testplan|testexec)/([^/]+)/test/?")
+
+FAKE_FIELDS = [
+    {"id": "summary", "name": "Summary", "custom": False, "schema": {"type": "string"}},
+    {"id": "labels", "name": "Labels", "custom": False, "schema": {"type": "array"}},
+    {"id": "priority", "name": "Priority", "custom": False, "schema": {"type": "priority"}},
+    {"id": "customfield_11203", "name": "Manual Test Steps", "custom": True, "schema": {"type": "any"}},
+    {"id": "customfield_11206", "name": "Pre-Conditions association with a Test", "custom": True, "schema": {"type": "array"}},
+]
+FAKE_ISSUE_TYPES = ["Test", "Pre-Condition", "Test Plan", "Test Execution"]
+FAKE_PRIORITIES = ["Highest", "High", "Medium", "Low", "Lowest"]
+
+_JQL_EQUALS = re.compile(r'\b(project|issuetype|labels)\s*=\s*"((?:[^"\\]|\\.)*)"', re.IGNORECASE)
+_JQL_IN = re.compile(r'\b(labels|issuekey|key)\s+in\s*\(([^)]*)\)', re.IGNORECASE)
+_ENDPOINT_ID = re.compile(r'/[A-Z][A-Z0-9]*-\d+(?=/test/?$|$)|/\d+$')
+_JQL_UPDATED_SINCE = re.compile(r'\bupdated\s*>=\s*"(\d{4}/\d{2}/\d{2} \d{2}:\d{2})"', re.IGNORECASE)
+_JQL_VALUE = re.compile(r'"((?:[^"\\]|\\.)*)"|([\w-]+)')
+
+
+class FakeJiraServer:
+    """
+    In-memory Jira server chạy trên thread nền.
+
+    - latency: giây chờ thêm cho mỗi request (mô phỏng mạng / server chậm)
+    - error_rate: tỉ lệ request trả 500 ngẫu nhiên
+    - rate_limit: số request tối đa mỗi giây; vượt quá trả 429 kèm Retry-After
+    - bulk_max: số issue tối đa mỗi request bulk create (Jira mặc định 50)
+    - timezone: múi giờ của server (created/updated và ngày giờ trong JQL); mặc định múi giờ máy
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, error_rate: float = 0.0,
+                 rate_limit: Optional[float] = None, bulk_max: int = 50, seed: Optional[int] = None,
+                 timezone: Optional[tzinfo] = None):
+        self.timezone = timezone
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.bulk_max = bulk_max
+        self.issues: Dict[str, Dict[str, Any]] = {}
+        self.request_counts: Dict[str, int] = {}
+        self.container_tests: Dict[str, set] = {}
+        self._next_id = 10000
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeJiraServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_stats(self):
+        with self._lock:
+            self.request_counts = {}
+
+    # ----- mô phỏng latency / lỗi / rate limit -----
+
+    def _admit(self, endpoint: str) -> Optional[tuple]:
+        """Đếm request; trả (status, headers, body) nếu request bị từ chối"""
+        with self._lock:
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+            if self.rate_limit:
+                now = time.monotonic()
+                if now - self._window_start >= 1.0:
+                    self._window_start = now
+                    self._window_count = 0
+                self._window_count += 1
+                if self._window_count > self.rate_limit:
+                    retry_after = max(1, int(round(1.0 - (now - self._window_start))))
+                    self.request_counts["429"] = self.request_counts.get("429", 0) + 1
+                    return 429, {"Retry-After": str(retry_after)}, {"errorMessages": ["Rate limit exceeded"]}
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.request_counts["500"] = self.request_counts.get("500", 0) + 1
+                return 500, {}, {"errorMessages": ["Simulated server error"]}
+        return None
+
+    # ----- dữ liệu -----
+
+    def _now(self) -> datetime:
+        return datetime.now(self.timezone) if self.timezone else datetime.now().astimezone()
+
+    def _timestamp(self) -> str:
+        """Giờ hiện tại theo định dạng Jira: 2024-05-01T10:15:30.000+0700"""
+        now = self._now()
+        return now.strftime("%Y-%m-%dT%H:%M:%S.") + f"{now.microsecond // 1000:03d}" + now.strftime("%z")
+
+    def _create_issue(self, fields: Dict[str, Any]) -> Dict[str, Any]:
+        project = (fields.get("project") or {}).get("key")
+        issuetype = (fields.get("issuetype") or {}).get("name")
+        if not project or not fields.get("summary") or issuetype not in FAKE_ISSUE_TYPES:
+            raise ValueError("project, summary and a known issuetype are required")
+        with self._lock:
+            self._next_id += 1
+            issue_id = str(self._next_id)
+            key = f"{project}-{self._next_id - 10000}"
+            now = self._timestamp()
+            self.issues[key] = {
+                "id": issue_id,
+                "key": key,
+                "fields": {**fields, "issuetype": {"name": issuetype}, "created": now, "updated": now},
+            }
+        return {"id": issue_id, "key": key, "self": f"{self.url}{API_PREFIX}issue/{issue_id}"}
+
+    def _update_issue(self, key: str, fields: Dict[str, Any], update: Optional[Dict[str, Any]] = None) -> bool:
+        """fields: thay giá trị; update: các thao tác {field: [{"add"/"remove"/"set": value}]} (chỉ field dạng list)"""
+        with self._lock:
+            issue = self.issues.get(key) or next((issue for issue in self.issues.values() if issue["id"] == key), None)
+            if not issue:
+                return False
+            issue["fields"].update(fields)
+            for field, operations in (update or {}).items():
+                values = list(issue["fields"].get(field) or [])
+                for operation in operations:
+                    if "set" in operation:
+                        values = list(operation["set"])
+                    if "add" in operation and operation["add"] not in values:
+                        values.append(operation["add"])
+                    if "remove" in operation and operation["remove"] in values:
+                        values.remove(operation["remove"])
+                issue["fields"][field] = values
+            issue["fields"]["updated"] = self._timestamp()
+        return True
+
+    def _issue_json(self, issue: Dict[str, Any], fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        issue_fields = issue["fields"]
+        if fields and "*all" not in fields:
+            issue_fields = {name: value for name, value in issue_fields.items() if name in fields}
+        return {
+            "id": issue["id"],
+            "key": issue["key"],
+            "self": f"{self.url}{API_PREFIX}issue/{issue['id']}",
+            "fields": issue_fields,
+        }
+
+    def _search(self, jql: str) -> List[Dict[str, Any]]:
+        conditions = [(name.lower(), value.replace('\\"', '"')) for name, value in _JQL_EQUALS.findall(jql)]
+        in_conditions = [
+            (name.lower(), {quoted or bare for quoted, bare in _JQL_VALUE.findall(values)})
+            for name, values in _JQL_IN.findall(jql)
+        ]
+        # JQL so sánh ngày giờ (đến phút) theo múi giờ của server
+        since = [datetime.strptime(value, "%Y/%m/%d %H:%M") for value in _JQL_UPDATED_SINCE.findall(jql)]
+        tz = self._now().tzinfo
+        with self._lock:
+            issues = list(self.issues.values())
+        matched = []
+        for issue in issues:
+            fields = issue["fields"]
+            updated = datetime.strptime(fields["updated"], "%Y-%m-%dT%H:%M:%S.%f%z").astimezone(tz).replace(tzinfo=None)
+            if any(updated < value for value in since):
+                continue
+            values = {
+                "project": {(fields.get("project") or {}).get("key")},
+                "issuetype": {fields["issuetype"]["name"]},
+                "labels": set(fields.get("labels") or []),
+                "issuekey": {issue["key"]},
+                "key": {issue["key"]},
+            }
+            if all(value in values[name] for name, value in conditions) and \
+                    all(values[name] & wanted for name, wanted in in_conditions):
+                matched.append(issue)
+        return matched
+
+
+def _make_handler(server: FakeJiraServer):
+    class FakeJiraHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body: Any = None, headers: Optional[Dict[str, str]] = None):
+            payload = b"" if body is None else json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json;charset=UTF-8")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _read_json(self) -> Any:
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+        def _handle(self, method: str):
+            parsed = urlparse(self.path)
+            path = parsed.path
+            query = {name: values[-1] for name, values in parse_qs(parsed.query).items()}
+            # fields có thể lặp lại (?fields=a&fields=b) hoặc ngăn cách bằng dấu phẩy
+            query_fields = ",".join(parse_qs(parsed.query).get("fields", []))
+            if query_fields:
+                query["fields"] = query_fields
+            body = self._read_json() if method in ("POST", "PUT") else None
+            endpoint = f"{method} {_ENDPOINT_ID.sub('/{id}', path)}"
+
+            if server.latency:
+                time.sleep(server.latency)
+            rejected = server._admit(endpoint)
+            if rejected:
+                status, headers, error = rejected
+                return self._send(status, error, headers)
+
+            match = _XRAY_CONTAINER_PATH.fullmatch(path)
+            if method == "POST" and match:
+                container_key = match.group(2)
+                with server._lock:
+                    if container_key not in server.issues:
+                        return self._send(404, {"error": f"Test Plan / Test Execution {container_key} not found"})
+                    tests = server.container_tests.setdefault(container_key, set())
+                    tests.update((body or {}).get("add") or [])
+                    tests.difference_update((body or {}).get("remove") or [])
+                return self._send(200, [])
+
+            if not path.startswith(API_PREFIX):
+                return self._send(404, {"errorMessages": [f"Unknown path {path}"]})
+            resource = path[len(API_PREFIX):].rstrip("/")
+
+            if method == "GET" and resource == "serverInfo":
+                return self._send(200, {
+                    "baseUrl": server.url, "version": "9.4.0", "versionNumbers": [9, 4, 0],
+                    "deploymentType": "Server", "serverTitle": "Fake Jira",
+                })
+            if method == "GET" and resource == "myself":
+                return self._send(200, {"name": "fake", "key": "fake", "displayName": "Fake User",
+                                        "emailAddress": "fake@example.com", "active": True})
+            if method == "GET" and resource == "field":
+                return self._send(200, FAKE_FIELDS)
+            if method == "GET" and resource == "priority":
+                return self._send(200, [
+                    {"id": str(i), "name": name, "self": f"{server.url}{API_PREFIX}priority/{i}"}
+                    for i, name in enumerate(FAKE_PRIORITIES, 1)
+                ])
+            match = re.fullmatch(r"project/([^/]+)", resource)
+            if method == "GET" and match:
+                return self._send(200, {"id": "10000", "key": match.group(1), "name": match.group(1)})
+            match = re.fullmatch(r"issue/createmeta/([^/]+)/issuetypes", resource)
+            if method == "GET" and match:
+                values = [
+                    {"id": str(i), "name": name, "subtask": False, "self": f"{server.url}{API_PREFIX}issuetype/{i}"}
+                    for i, name in enumerate(FAKE_ISSUE_TYPES, 1)
+                ]
+                return self._send(200, {"startAt": 0, "maxResults": len(values), "total": len(values),
+                                        "isLast": True, "values": values})
+            if method in ("GET", "POST") and resource == "search":
+                params = body if method == "POST" else query
+                start_at = int(params.get("startAt") or 0)
+                max_results = int(params.get("maxResults") or 50)
+                fields = params.get("fields") or ["*all"]
+                if isinstance(fields, str):
+                    fields = fields.split(",")
+                matched = server._search(params.get("jql", ""))
+                page = matched[start_at:start_at + max_results]
+                return self._send(200, {
+                    "startAt": start_at, "maxResults": max_results, "total": len(matched),
+                    "issues": [server._issue_json(issue, fields) for issue in page],
+                })
+            if method == "POST" and resource == "issue":
+                try:
+                    return self._send(201, server._create_issue(body.get("fields") or {}))
+                except ValueError as e:
+                    return self._send(400, {"errorMessages": [], "errors": {"fields": str(e)}})
+            if method == "POST" and resource == "issue/bulk":
+                updates = body.get("issueUpdates") or []
+                if len(updates) > server.bulk_max:
+                    return self._send(400, {"errorMessages": [f"Bulk limit is {server.bulk_max} issues"]})
+                created, errors = [], []
+                for index, update in enumerate(updates):
+                    try:
+                        created.append(server._create_issue(update.get("fields") or {}))
+                    except ValueError as e:
+                        errors.append({"status": 400, "failedElementNumber": index,
+                                       "elementErrors": {"errorMessages": [], "errors": {"fields": str(e)}}})
+                return self._send(400 if errors and not created else 201, {"issues": created, "errors": errors})
+            match = re.fullmatch(r"issue/([^/]+)", resource)
+            if match:
+                key = match.group(1)
+                if method == "PUT":
+                    if server._update_issue(key, (body or {}).get("fields") or {}, (body or {}).get("update")):
+                        return self._send(204)
+                    return self._send(404, {"errorMessages": ["Issue does not exist"]})
+                if method == "GET":
+                    with server._lock:
+                        issue = server.issues.get(key) or next(
+                            (issue for issue in server.issues.values() if issue["id"] == key), None
+                        )
+                    if issue:
+                        return self._send(200, server._issue_json(issue))
+                    return self._send(404, {"errorMessages": ["Issue does not exist"]})
+            return self._send(404, {"errorMessages": [f"Unsupported {method} {path}"]})
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def do_PUT(self):
+            self._handle("PUT")
+
+    return FakeJiraHandler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake Jira/Xray REST server cho test và benchmark jira_sync.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="Giây chờ thêm cho mỗi request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Tỉ lệ request trả 500")
+    parser.add_argument("--rate-limit", type=float, default=None, help="Số request tối đa mỗi giây (vượt quá trả 429)")
+    parser.add_argument("--bulk-max", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    server = FakeJiraServer(args.host, args.port, args.latency, args.error_rate, args.rate_limit, args.bulk_max)
+    print(f"Fake Jira đang chạy tại {server.url} (Ctrl+C để dừng)")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
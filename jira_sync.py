@@ -1,8 +1,22 @@
 # jira_sync.py - Jira synchronization functionality
 import streamlit as st
 from jira import JIRA
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.utils import parsedate_to_datetime
+import hashlib
+from datetime import datetime, timedelta
 import json
+import random
+import threading
+import time
+import requests
+from jira_sync_store import (
+    plan_sync, load_mappings, save_mappings, get_case_key, compute_content_hash,
+    get_last_pull_time, set_last_pull_time, load_pull_conflicts, save_pull_conflicts, get_idempotency_label, start_sync_run, record_outcome, finish_sync_run,
+    load_sync_runs, load_journal, load_abandoned_sync_runs, RUN_RUNNING, RUN_COMPLETED, RUN_INTERRUPTED, RUN_RECOVERED,
+    IDEMPOTENCY_LABEL_PREFIX
+)
 
 def get_jira_credentials(project_settings: dict = None) -> Dict[str, str]:
     """Get Jira credentials from project settings or session state"""
@@ -67,8 +81,510 @@ def test_jira_connection(server: str, username: str, password: str) -> bool:
         
         return False
 
-def sync_test_cases_to_jira(test_cases: List[Dict[str, Any]], project_key: str, project_settings: dict = None) -> Dict[str, Any]:
-    """Sync test cases to Jira as Test Execution issues"""
+# Cache Jira client (theo server + user) và metadata project
+JIRA_CLIENT_IDLE_TTL_SECONDS = 600
+JIRA_CLIENT_HEALTH_CHECK_SECONDS = 60
+JIRA_METADATA_TTL_SECONDS = 900
+# Custom field mặc định của Xray (dùng khi không tìm thấy theo tên trên server)
+XRAY_TEST_STEPS_FIELD_DEFAULT = 'customfield_11203'
+XRAY_PRECONDITION_FIELD_DEFAULT = 'customfield_11206'
+XRAY_TEST_STEPS_FIELD_NAMES = ('manual test steps', 'test steps')
+XRAY_PRECONDITION_FIELD_NAMES = ('pre-conditions association with a test', 'pre-conditions')
+
+_jira_clients: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+_jira_clients_lock = threading.Lock()
+_project_metadata_cache: Dict[Tuple[str, str], Tuple[float, Dict[str, Any]]] = {}
+_project_metadata_lock = threading.Lock()
+
+def get_jira_client(server: str, username: str, password: str) -> JIRA:
+    """
+    Return a cached JIRA client for server + user, creating it on first use.
+    
+    Clients idle for more than JIRA_CLIENT_IDLE_TTL_SECONDS are closed; a cached client
+    that has not been used for JIRA_CLIENT_HEALTH_CHECK_SECONDS is checked with serverInfo
+    and rebuilt if the check fails.
+    """
+    server = server.strip()
+    if not server.startswith('http'):
+        server = f"https://{server}"
+    
+    cache_key = (server.rstrip('/'), username, hashlib.sha256(password.encode('utf-8')).hexdigest())
+    now = time.time()
+    
+    with _jira_clients_lock:
+        # Đóng các client không dùng quá lâu
+        for key, entry in list(_jira_clients.items()):
+            if now - entry['last_used'] > JIRA_CLIENT_IDLE_TTL_SECONDS:
+                _jira_clients.pop(key, None)
+                try:
+                    entry['client'].close()
+                except Exception:
+                    pass
+        entry = _jira_clients.get(cache_key)
+    
+    if entry and now - entry['last_used'] > JIRA_CLIENT_HEALTH_CHECK_SECONDS:
+        try:
+            entry['client'].server_info()
+        except Exception:
+            with _jira_clients_lock:
+                _jira_clients.pop(cache_key, None)
+            entry = None
+    
+    if not entry:
+        client = JIRA(
+            server=server, 
+            basic_auth=(username, password),
+            options={'timeout': 30}
+        )
+        entry = {'client': client, 'last_used': now}
+        with _jira_clients_lock:
+            _jira_clients[cache_key] = entry
+    
+    entry['last_used'] = now
+    return entry['client']
+
+def get_project_metadata(jira_instance, project_key: str, refresh: bool = False) -> Dict[str, Any]:
+    """
+    Project metadata cached for JIRA_METADATA_TTL_SECONDS per server + project:
+    - issue_types: lowercase name → IssueType
+    - field_ids: lowercase field name → field id (custom field IDs such as Xray test steps)
+    - priorities: priority names available on the server
+    """
+    cache_key = (jira_instance.server_url.rstrip('/'), project_key)
+    now = time.time()
+    if not refresh:
+        with _project_metadata_lock:
+            cached = _project_metadata_cache.get(cache_key)
+        if cached and cached[0] > now:
+            return cached[1]
+    
+    metadata = {
+        'issue_types': {it.name.lower(): it for it in jira_instance.project_issue_types(project_key)},
+        'field_ids': {field['name'].lower(): field['id'] for field in jira_instance.fields()},
+        'priorities': [priority.name for priority in jira_instance.priorities()],
+    }
+    with _project_metadata_lock:
+        _project_metadata_cache[cache_key] = (now + JIRA_METADATA_TTL_SECONDS, metadata)
+    return metadata
+
+def clear_jira_caches():
+    """Drop cached Jira clients and project metadata"""
+    with _jira_clients_lock:
+        _jira_clients.clear()
+    with _project_metadata_lock:
+        _project_metadata_cache.clear()
+
+def _resolve_field_id(metadata: Optional[Dict[str, Any]], names: Tuple[str, ...], default: str) -> str:
+    """Find a custom field ID by name in the cached metadata"""
+    field_ids = (metadata or {}).get('field_ids', {})
+    for name in names:
+        if name in field_ids:
+            return field_ids[name]
+    return default
+
+# Số issue tối đa trong một request bulk create (POST /rest/api/2/issue/bulk)
+JIRA_BULK_BATCH_SIZE = 50
+# Số request tạo issue chạy song song khi không dùng được bulk create
+JIRA_SYNC_CONCURRENCY = 4
+# Số issue mỗi trang khi đọc danh sách Pre-Condition của project
+JIRA_SEARCH_PAGE_SIZE = 100
+# Retry với exponential backoff + jitter cho lỗi 429/5xx/timeout
+JIRA_MAX_RETRIES = 4
+JIRA_BACKOFF_BASE_SECONDS = 1.0
+JIRA_BACKOFF_MAX_SECONDS = 30.0
+# Số test mỗi request gắn vào Test Plan / Test Execution (Xray REST)
+XRAY_LINK_BATCH_SIZE = 100
+# Lùi thời điểm pull lại vài phút: JQL chỉ so sánh đến phút
+JIRA_PULL_OVERLAP_MINUTES = 5
+JIRA_RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+def build_test_issue_fields(
+    test_case: Dict[str, Any],
+    index: int,
+    project_key: str,
+    project_settings: dict = None,
+    precondition_key: Optional[str] = None,
+    metadata: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Convert a test case to Xray Test issue fields.
+    With project metadata, custom field IDs are resolved by name and unknown priorities are left out.
+    """
+    issue_dict = {
+        'project': {'key': project_key},
+        'summary': test_case.get('description', f'Test Case {index}'),  # Summary = Description
+        'issuetype': {'name': 'Test'},
+        'labels': ['test-case', 'automated-sync', 'xray']
+    }
+    
+    priority = get_jira_priority(test_case)
+    if not metadata or not metadata.get('priorities') or priority in metadata['priorities']:
+        issue_dict['priority'] = {'name': priority}
+    
+    # Add Pre-Condition link if exists
+    if precondition_key:
+        precondition_field = _resolve_field_id(metadata, XRAY_PRECONDITION_FIELD_NAMES, XRAY_PRECONDITION_FIELD_DEFAULT)
+        issue_dict[precondition_field] = [precondition_key]  # Pre-Conditions association with a Test
+    
+    if metadata and project_settings is not None and not project_settings.get('xray_test_steps_field'):
+        project_settings = {
+            **project_settings,
+            'xray_test_steps_field': _resolve_field_id(metadata, XRAY_TEST_STEPS_FIELD_NAMES, XRAY_TEST_STEPS_FIELD_DEFAULT)
+        }
+    
+    # Add Xray custom fields
+    try:
+        xray_fields = get_xray_fields(test_case, project_settings)
+        issue_dict.update(xray_fields)
+    except Exception as field_error:
+        st.warning(f"⚠️ Warning: Could not add custom fields for test case {index}: {str(field_error)}")
+        # Continue without custom fields
+    
+    return issue_dict
+
+def _is_retryable_jira_error(error: Exception) -> bool:
+    """Rate limits, server errors and connection problems are worth retrying"""
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        response = getattr(error, 'response', None)
+        status_code = getattr(response, 'status_code', None)
+    if status_code is None:
+        # Không có HTTP status → lỗi kết nối / timeout
+        return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+    return status_code in JIRA_RETRYABLE_STATUS_CODES
+
+def _retry_delay_seconds(error: Exception, attempt: int) -> float:
+    """Delay before the next attempt: Jira's Retry-After if present, else exponential backoff with jitter"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    retry_after = headers.get('Retry-After')
+    if retry_after:
+        try:
+            return min(JIRA_BACKOFF_MAX_SECONDS, max(0.0, float(retry_after)))
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+                return min(JIRA_BACKOFF_MAX_SECONDS, max(0.0, retry_at.timestamp() - time.time()))
+            except (TypeError, ValueError):
+                pass
+    
+    backoff = min(JIRA_BACKOFF_MAX_SECONDS, JIRA_BACKOFF_BASE_SECONDS * (2 ** attempt))
+    # "Equal jitter": một nửa cố định, một nửa ngẫu nhiên để các worker không retry cùng lúc
+    return backoff / 2 + random.uniform(0, backoff / 2)
+
+def _call_with_backoff(func: Callable[[], Any], max_retries: int = JIRA_MAX_RETRIES) -> Any:
+    """Call func, retrying retryable Jira errors with backoff"""
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except Exception as e:
+            if attempt >= max_retries or not _is_retryable_jira_error(e):
+                raise
+            time.sleep(_retry_delay_seconds(e, attempt))
+            attempt += 1
+
+def create_issue_with_backoff(jira_instance, fields: Dict[str, Any], max_retries: int = JIRA_MAX_RETRIES) -> str:
+    """
+    Create a single issue, retrying retryable errors. Returns the new issue key.
+    A 5xx or timeout may come after Jira created the issue, so before each retry an issue
+    carrying the same idempotency label is looked up and returned instead of creating another.
+    """
+    label = _get_idempotency_label(fields)
+    attempted = False
+    
+    def create():
+        nonlocal attempted
+        if attempted and label:
+            existing = find_issues_by_labels(jira_instance, fields['project']['key'], [label]).get(label)
+            if existing:
+                return existing
+        attempted = True
+        return jira_instance.create_issue(fields=fields, prefetch=False).key
+    
+    return _call_with_backoff(create, max_retries)
+
+def update_issue_fields(jira_instance, issue_key: str, fields: Dict[str, Any]) -> str:
+    """
+    Update issue fields through issue.update (the issue is fetched with only its labels).
+    labels are sent as "add" operations, so labels testers added in Jira are kept.
+    """
+    fields = dict(fields)
+    labels = fields.pop('labels', None) or []
+    issue = jira_instance.issue(issue_key, fields='labels')
+    issue.update(fields=fields, update={'labels': [{'add': label} for label in labels]} if labels else None)
+    return issue_key
+
+def update_issue_with_backoff(jira_instance, issue_key: str, fields: Dict[str, Any], max_retries: int = JIRA_MAX_RETRIES) -> str:
+    """Update a single issue, retrying retryable errors. Returns the issue key."""
+    return _call_with_backoff(lambda: update_issue_fields(jira_instance, issue_key, fields), max_retries)
+
+def _run_concurrently(
+    worker: Callable[[Any], str],
+    items: List[Any],
+    max_workers: int = JIRA_SYNC_CONCURRENCY,
+    progress_callback: Optional[Callable[[int, int, Dict[str, Any]], None]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Run worker(item) → issue key on a bounded thread pool.
+    
+    Returns one result per item, in input order: {'index': ..., 'key': ..., 'error': ...}.
+    progress_callback(completed, total, result) is called from the calling thread as items finish.
+    """
+    total = len(items)
+    results: List[Optional[Dict[str, Any]]] = [None] * total
+    if not total:
+        return []
+    
+    with ThreadPoolExecutor(max_workers=max(1, int(max_workers or 1))) as executor:
+        futures = {executor.submit(worker, item): index for index, item in enumerate(items)}
+        for completed, future in enumerate(as_completed(futures), 1):
+            index = futures[future]
+            try:
+                result = {'index': index, 'key': future.result(), 'error': None}
+            except Exception as e:
+                result = {'index': index, 'key': None, 'error': str(e)}
+            results[index] = result
+            if progress_callback:
+                progress_callback(completed, total, result)
+    
+    return results
+
+def create_issues_concurrently(
+    jira_instance,
+    field_list: List[Dict[str, Any]],
+    max_workers: int = JIRA_SYNC_CONCURRENCY,
+    progress_callback: Optional[Callable[[int, int, Dict[str, Any]], None]] = None
+) -> List[Dict[str, Any]]:
+    """Create issues one by one on a bounded thread pool (results in input order)."""
+    return _run_concurrently(
+        lambda fields: create_issue_with_backoff(jira_instance, fields),
+        field_list,
+        max_workers,
+        progress_callback
+    )
+
+def update_issues_concurrently(
+    jira_instance,
+    updates: List[Tuple[str, Dict[str, Any]]],
+    max_workers: int = JIRA_SYNC_CONCURRENCY,
+    progress_callback: Optional[Callable[[int, int, Dict[str, Any]], None]] = None
+) -> List[Dict[str, Any]]:
+    """Update (issue_key, fields) pairs on a bounded thread pool (results in input order)."""
+    return _run_concurrently(
+        lambda update: update_issue_with_backoff(jira_instance, update[0], update[1]),
+        updates,
+        max_workers,
+        progress_callback
+    )
+
+def _get_idempotency_label(fields: Dict[str, Any]) -> Optional[str]:
+    """Idempotency label carried by the create fields (None if the issue has none)"""
+    return next((label for label in fields.get('labels') or [] if label.startswith(IDEMPOTENCY_LABEL_PREFIX)), None)
+
+def find_created_issue_keys(jira_instance, field_list: List[Dict[str, Any]]) -> List[Optional[str]]:
+    """
+    Issue key already created for each create request, looked up by idempotency label
+    (None for items without a label or not found). Used before retrying a create whose
+    outcome is unknown, e.g. a timeout after Jira committed the request.
+    """
+    labels_by_project: Dict[str, List[str]] = {}
+    for fields in field_list:
+        label = _get_idempotency_label(fields)
+        if label:
+            labels_by_project.setdefault(fields['project']['key'], []).append(label)
+    found = {}
+    for project_key, labels in labels_by_project.items():
+        found.update(find_issues_by_labels(jira_instance, project_key, labels))
+    return [found.get(_get_idempotency_label(fields)) for fields in field_list]
+
+def create_issues_in_batches(
+    jira_instance,
+    field_list: List[Dict[str, Any]],
+    batch_size: int = JIRA_BULK_BATCH_SIZE,
+    max_workers: int = JIRA_SYNC_CONCURRENCY,
+    progress_callback: Optional[Callable[[int, int, Dict[str, Any]], None]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Create issues through the Jira bulk-create endpoint in batches.
+    
+    Returns one result per input item, in input order: {'index': ..., 'key': ..., 'error': ...}.
+    Items rejected by the bulk call (e.g. Xray custom fields not accepted in bulk) are
+    retried individually on the concurrent engine. batch_size <= 1 skips bulk create.
+    If the whole bulk call fails, Jira may still have created the batch (timeout after commit),
+    so items are first looked up by idempotency label and only the missing ones are retried.
+    """
+    total = len(field_list)
+    results: List[Optional[Dict[str, Any]]] = [None] * total
+    pending_indexes = []
+    completed = 0
+    batch_size = max(1, int(batch_size or 1))
+    
+    if batch_size > 1:
+        for start in range(0, total, batch_size):
+            batch = field_list[start:start + batch_size]
+            try:
+                bulk_results = jira_instance.create_issues(field_list=batch, prefetch=False)
+                keys = [
+                    bulk_result['issue'].key
+                    if bulk_result.get('status') == 'Success' and bulk_result.get('issue') is not None else None
+                    for bulk_result in bulk_results
+                ]
+            except Exception as e:
+                # Cả request bulk lỗi: server có thể đã tạo xong rồi mới timeout → tìm theo label trước khi thử lại từng issue
+                try:
+                    keys = find_created_issue_keys(jira_instance, batch)
+                except Exception as lookup_error:
+                    # Không kiểm tra được → không thử lại (tránh tạo trùng)
+                    for offset in range(len(batch)):
+                        index = start + offset
+                        results[index] = {'index': index, 'key': None, 'error': f"{str(e)} (could not check for created issues: {str(lookup_error)})"}
+                        completed += 1
+                        if progress_callback:
+                            progress_callback(completed, total, results[index])
+                    continue
+            
+            for offset, key in enumerate(keys):
+                index = start + offset
+                if key:
+                    results[index] = {'index': index, 'key': key, 'error': None}
+                    completed += 1
+                    if progress_callback:
+                        progress_callback(completed, total, results[index])
+                else:
+                    pending_indexes.append(index)
+    else:
+        pending_indexes = list(range(total))
+    
+    def on_retry_progress(_, __, result):
+        nonlocal completed
+        completed += 1
+        # Đổi index trong danh sách retry về index của danh sách gốc
+        result['index'] = pending_indexes[result['index']]
+        if progress_callback:
+            progress_callback(completed, total, result)
+    
+    retry_results = create_issues_concurrently(
+        jira_instance,
+        [field_list[index] for index in pending_indexes],
+        max_workers,
+        on_retry_progress
+    )
+    for index, result in zip(pending_indexes, retry_results):
+        results[index] = result
+    
+    return results
+
+def link_tests_to_xray_container(
+    jira_instance,
+    container_type: str,
+    container_key: str,
+    test_keys: List[str],
+    batch_size: int = XRAY_LINK_BATCH_SIZE
+) -> Dict[str, Any]:
+    """
+    Add tests to a Test Plan (container_type 'testplan') or Test Execution ('testexec')
+    with batched POST /rest/raven/1.0/api/{container_type}/{key}/test calls.
+    
+    Returns {'linked': count, 'errors': [...], 'seconds': elapsed}.
+    """
+    started = time.perf_counter()
+    url = f"{jira_instance.server_url.rstrip('/')}/rest/raven/1.0/api/{container_type}/{container_key}/test"
+    linked = 0
+    errors = []
+    batch_size = max(1, int(batch_size or 1))
+    for start in range(0, len(test_keys), batch_size):
+        batch = test_keys[start:start + batch_size]
+        try:
+            _call_with_backoff(lambda: jira_instance._session.post(url, data=json.dumps({'add': batch, 'remove': []})))
+            linked += len(batch)
+        except Exception as e:
+            errors.append(f"{container_key} ({batch[0]}…{batch[-1]}): {str(e)}")
+    return {'linked': linked, 'errors': errors, 'seconds': time.perf_counter() - started}
+
+def find_issues_by_labels(jira_instance, project_key: str, labels: List[str], page_size: int = JIRA_SEARCH_PAGE_SIZE) -> Dict[str, str]:
+    """Map idempotency label → issue key for issues of the project carrying one of the labels"""
+    found = {}
+    wanted = set(labels)
+    for start in range(0, len(labels), page_size):
+        chunk = labels[start:start + page_size]
+        label_list = ', '.join(f'"{_escape_jql_string(label)}"' for label in chunk)
+        jql = f'project = "{_escape_jql_string(project_key)}" AND labels in ({label_list})'
+        start_at = 0
+        while True:
+            issues = _call_with_backoff(lambda: jira_instance.search_issues(
+                jql, startAt=start_at, maxResults=page_size, fields='labels'
+            ))
+            for issue in issues:
+                for label in getattr(issue.fields, 'labels', None) or []:
+                    if label in wanted:
+                        found.setdefault(label, issue.key)
+            if len(issues) < page_size:
+                break
+            start_at += len(issues)
+    return found
+
+def recover_interrupted_syncs(jira_instance, server: str, project_key: str) -> Dict[str, int]:
+    """
+    Replay the journal of sync runs that never finished (e.g. the Streamlit session died).
+    Only abandoned runs are replayed (see is_sync_run_abandoned); a run another session is
+    still working on is left alone.
+    
+    Creates whose outcome was never recorded are looked up in Jira by idempotency label:
+    issues found are recorded as done (and mapped), so the next plan skips them instead of
+    creating duplicates. Cases still pending stay unmapped and are planned again.
+    """
+    recovered = {'runs': 0, 'recovered': 0, 'pending': 0}
+    for run in load_abandoned_sync_runs(server, project_key):
+        pending = load_journal(run['run_id'], pending_only=True)
+        creates = [entry for entry in pending if entry['action'] == 'create']
+        found = find_issues_by_labels(jira_instance, project_key, [entry['idempotency_label'] for entry in creates]) if creates else {}
+        for entry in creates:
+            jira_key = found.get(entry['idempotency_label'])
+            if jira_key:
+                record_outcome(run['run_id'], server, project_key, entry['case_key'], jira_key, entry['content_hash'])
+                recovered['recovered'] += 1
+        recovered['pending'] += len(pending) - sum(1 for entry in creates if entry['idempotency_label'] in found)
+        finish_sync_run(run['run_id'], RUN_RECOVERED)
+        recovered['runs'] += 1
+    return recovered
+
+def sync_test_cases_to_jira(
+    test_cases: List[Dict[str, Any]],
+    project_key: str,
+    project_settings: dict = None,
+    batch_size: Optional[int] = None,
+    max_workers: Optional[int] = None,
+    progress_callback: Optional[Callable[[int, int, Dict[str, Any]], None]] = None,
+    dry_run: bool = False,
+    test_plan_key: Optional[str] = None,
+    test_execution_key: Optional[str] = None,
+    project_id: Any = None
+) -> Dict[str, Any]:
+    """
+    Sync test cases to Jira as Xray Test issues.
+    
+    Sync is incremental: a local store (jira_sync_store) maps each test case to its Jira key
+    and content hash, so only new cases are created, changed cases are updated and unchanged
+    cases are skipped. dry_run returns the plan without calling Jira.
+    
+    Each run is written ahead to a journal (intent per case before any Jira call, outcome as
+    each issue finishes). If a previous run was interrupted, its journal is replayed first
+    (see recover_interrupted_syncs) so the sync resumes where it stopped.
+    
+    Issues are created through the bulk-create endpoint in batches of batch_size
+    (project setting 'jira_bulk_batch_size', default JIRA_BULK_BATCH_SIZE; 1 disables bulk).
+    Items bulk create cannot handle, and updates, run on a thread pool of max_workers
+    (project setting 'jira_sync_concurrency', default JIRA_SYNC_CONCURRENCY) with backoff.
+    progress_callback(completed, total, result) reports per-issue progress.
+    
+    After the create phase, created and updated tests are attached in batches to the Test Plan
+    and Test Execution given (or project settings 'xray_test_plan_key' /
+    'xray_test_execution_key'); linking time is reported separately in 'link_seconds'.
+    
+    project_id is the local project the test cases belong to; it is part of each case's sync
+    identity, so projects sharing a Jira project never overwrite each other's issues.
+    """
     credentials = get_jira_credentials(project_settings)
     
     if not all([credentials.get('server'), credentials.get('username'), credentials.get('password')]):
@@ -78,18 +594,71 @@ def sync_test_cases_to_jira(test_cases: List[Dict[str, Any]], project_key: str,
             'created_issues': []
         }
     
+    if batch_size is None:
+        batch_size = (project_settings or {}).get('jira_bulk_batch_size', JIRA_BULK_BATCH_SIZE)
+    if max_workers is None:
+        max_workers = (project_settings or {}).get('jira_sync_concurrency', JIRA_SYNC_CONCURRENCY)
+    if test_plan_key is None:
+        test_plan_key = (project_settings or {}).get('xray_test_plan_key', '')
+    if test_execution_key is None:
+        test_execution_key = (project_settings or {}).get('xray_test_execution_key', '')
+    
+    run_id = None
+    run_open = False
     try:
         # Clean server URL
         server = credentials['server'].strip()
         if not server.startswith('http'):
             server = f"https://{server}"
         
-        # Initialize Jira connection with timeout
-        jira = JIRA(
-            server=server, 
-            basic_auth=(credentials['username'], credentials['password']),
-            options={'timeout': 30}
-        )
+        jira = None
+        recovery = None
+        if not dry_run and load_abandoned_sync_runs(server, project_key):
+            # Lần sync trước bị ngắt giữa chừng → đọc lại journal trước khi lập plan
+            jira = get_jira_client(server, credentials['username'], credentials['password'])
+            recovery = recover_interrupted_syncs(jira, server, project_key)
+            if recovery['recovered']:
+                st.info(f"♻️ Recovered {recovery['recovered']} test case(s) created by an interrupted sync")
+        if not dry_run and load_sync_runs(server, project_key, status=RUN_RUNNING):
+            # Session khác đang sync cùng Jira project → chạy song song sẽ tạo trùng issue
+            return {
+                'success': False,
+                'message': f"❌ Another sync of Jira project {project_key} is still running. Please try again when it finishes.",
+                'created_issues': []
+            }
+        
+        # So sánh với lần đồng bộ trước: create / update / skip
+        plan = plan_sync(test_cases, server, project_key, project_settings, project_id)
+        counts = {action: sum(1 for item in plan if item['action'] == action) for action in ('create', 'update', 'skip', 'duplicate')}
+        for item in plan:
+            if item['action'] == 'duplicate':
+                st.warning(f"⚠️ Test case {item['index']} has the same identity as test case {item['duplicate_of']} and was not synced")
+        
+        if dry_run:
+            return {
+                'success': True,
+                'message': f"🧪 Dry run: {counts['create']} to create, {counts['update']} to update, {counts['skip']} unchanged in Jira project {project_key}",
+                'created_issues': [],
+                'plan': plan
+            }
+        
+        pending = [item for item in plan if item['action'] in ('create', 'update')]
+        if not pending:
+            return {
+                'success': True,
+                'message': f"✅ All {counts['skip']} test cases are already up to date in Jira project {project_key}",
+                'created_issues': [],
+                'updated_issues': [],
+                'plan': plan
+            }
+        
+        # Reuse cached Jira connection and project metadata
+        jira = jira or get_jira_client(server, credentials['username'], credentials['password'])
+        try:
+            metadata = get_project_metadata(jira, project_key)
+        except Exception as metadata_error:
+            st.warning(f"⚠️ Không lấy được metadata project, dùng field mặc định: {str(metadata_error)}")
+            metadata = None
         
         # Check project info
         test_issue_type, precondition_issue_type = debug_jira_info(jira, project_key)
@@ -101,54 +670,127 @@ def sync_test_cases_to_jira(test_cases: List[Dict[str, Any]], project_key: str,
                 'created_issues': []
             }
         
-        created_issues = []
+        # Phase 1: đọc index Pre-Condition của project một lần, tạo bulk các Pre-Condition còn thiếu
+        precondition_index = {}
+        if precondition_issue_type:
+            try:
+                precondition_index = build_precondition_index(jira, project_key)
+                ensure_preconditions(
+                    jira,
+                    project_key,
+                    [test_cases[item['index'] - 1].get('preconditions', '') for item in pending],
+                    precondition_index,
+                    batch_size,
+                    max_workers
+                )
+            except Exception as e:
+                st.warning(f"⚠️ Warning: Could not prepare Pre-Conditions: {str(e)}")
         
-        for i, test_case in enumerate(test_cases, 1):
+        # Phase 2: chuẩn bị fields cho từng test case cần tạo / cập nhật
+        to_create = []
+        to_update = []
+        for item in pending:
+            i = item['index']
+            test_case = test_cases[i - 1]
             try:
-                # Find or create Pre-Condition
-                precondition_key = None
-                precondition_summary = test_case.get('preconditions', '')
-                if precondition_summary and precondition_issue_type:
-                    precondition_key = find_or_create_precondition(jira, project_key, precondition_summary, precondition_issue_type)
+                precondition_key = precondition_index.get(normalize_precondition_summary(test_case.get('preconditions', '')))
                 
-                # Convert test case to Xray Test format
-                issue_dict = {
-                    'project': {'key': project_key},
-                    'summary': test_case.get('description', f'Test Case {i}'),  # Summary = Description
-                    'issuetype': {'name': 'Test'},
-                    'priority': {'name': get_jira_priority(test_case)},
-                    'labels': ['test-case', 'automated-sync', 'xray']
-                }
-                
-                # Add Pre-Condition link if exists
-                if precondition_key:
-                    issue_dict['customfield_11206'] = [precondition_key]  # Pre-Conditions association with a Test
-                
-                # Add Xray custom fields
-                try:
-                    xray_fields = get_xray_fields(test_case, project_settings)
-                    issue_dict.update(xray_fields)
-                except Exception as field_error:
-                    st.warning(f"⚠️ Warning: Could not add custom fields for test case {i}: {str(field_error)}")
-                    # Continue without custom fields
-                
-                # Create issue
-                new_issue = jira.create_issue(fields=issue_dict)
-                created_issues.append({
-                    'key': new_issue.key,
-                    'summary': new_issue.fields.summary,
-                    'url': f"{server}/browse/{new_issue.key}",
-                    'precondition': precondition_key
-                })
+                issue_dict = build_test_issue_fields(test_case, i, project_key, project_settings, precondition_key, metadata)
+                issue_dict['labels'] = issue_dict['labels'] + [get_idempotency_label(project_key, item['case_key'])]
+                if item['action'] == 'create':
+                    to_create.append((item, issue_dict, precondition_key))
+                else:
+                    to_update.append((item, issue_dict, precondition_key))
                 
             except Exception as e:
                 st.error(f"❌ Failed to create test case {i}: {str(e)}")
                 continue
         
+        total = len(to_create) + len(to_update)
+        completed = 0
+        
+        # Write-ahead journal: ghi intent của mọi case trước khi gọi Jira
+        run_id = start_sync_run(server, project_key, [item for item, _, _ in to_create + to_update])
+        run_open = True
+        
+        def journal_progress(entries):
+            def on_progress(_, __, result):
+                nonlocal completed
+                completed += 1
+                item = entries[result['index']][0]
+                record_outcome(run_id, server, project_key, item['case_key'], result['key'], item['content_hash'], result['error'])
+                if progress_callback:
+                    progress_callback(completed, total, result)
+            return on_progress
+        
+        # Phase 3: tạo issue theo batch (bulk create), cập nhật issue đã có song song
+        create_results = create_issues_in_batches(
+            jira,
+            [issue_dict for _, issue_dict, _ in to_create],
+            batch_size,
+            max_workers,
+            journal_progress(to_create)
+        )
+        update_results = update_issues_concurrently(
+            jira,
+            [
+                (item['jira_key'], {field: value for field, value in issue_dict.items() if field not in ('project', 'issuetype')})
+                for item, issue_dict, _ in to_update
+            ],
+            max_workers,
+            journal_progress(to_update)
+        )
+        finish_sync_run(run_id, RUN_COMPLETED)
+        run_open = False
+        
+        created_issues = []
+        updated_issues = []
+        for (item, issue_dict, precondition_key), result in zip(to_create, create_results):
+            if result['key']:
+                created_issues.append({
+                    'key': result['key'],
+                    'summary': issue_dict['summary'],
+                    'url': f"{server}/browse/{result['key']}",
+                    'precondition': precondition_key
+                })
+            else:
+                st.error(f"❌ Failed to create test case {item['index']}: {result['error']}")
+        
+        for (item, issue_dict, precondition_key), result in zip(to_update, update_results):
+            if result['key']:
+                updated_issues.append({
+                    'key': result['key'],
+                    'summary': issue_dict['summary'],
+                    'url': f"{server}/browse/{result['key']}",
+                    'precondition': precondition_key
+                })
+            else:
+                st.error(f"❌ Failed to update test case {item['index']} ({item['jira_key']}): {result['error']}")
+        
+        # Phase 4: gắn toàn bộ test vừa tạo / cập nhật vào Test Plan / Test Execution theo batch
+        synced_keys = [issue['key'] for issue in created_issues + updated_issues]
+        links = {}
+        for container_type, container_key in (('testplan', test_plan_key), ('testexec', test_execution_key)):
+            container_key = (container_key or '').strip()
+            if container_key and synced_keys:
+                links[container_key] = link_tests_to_xray_container(jira, container_type, container_key, synced_keys)
+                for error in links[container_key]['errors']:
+                    st.error(f"❌ Failed to link tests to {error}")
+        link_seconds = sum(link['seconds'] for link in links.values())
+        
+        message = f"✅ Successfully synced test cases to Jira project {project_key}: {len(created_issues)} created, {len(updated_issues)} updated, {counts['skip']} unchanged"
+        if links:
+            message += "; linked " + ", ".join(f"{link['linked']} to {key}" for key, link in links.items()) + f" in {link_seconds:.1f}s"
+        
         return {
             'success': True,
-            'message': f"✅ Successfully synced {len(created_issues)} test cases to Jira project {project_key}",
-            'created_issues': created_issues
+            'message': message,
+            'created_issues': created_issues,
+            'updated_issues': updated_issues,
+            'plan': plan,
+            'run_id': run_id,
+            'links': links,
+            'link_seconds': link_seconds
         }
         
     except Exception as e:
@@ -157,6 +799,214 @@ def sync_test_cases_to_jira(test_cases: List[Dict[str, Any]], project_key: str,
             'message': f"❌ Failed to sync test cases: {str(e)}",
             'created_issues': []
         }
+    finally:
+        if run_open:
+            # Lỗi hoặc bị ngắt (kể cả BaseException như rerun/stop của Streamlit từ progress_callback):
+            # journal còn case chưa có kết quả → lần sync sau đọc lại ngay
+            finish_sync_run(run_id, RUN_INTERRUPTED)
+
+def _resolve_steps_field(jira_instance, project_key: str, project_settings: dict = None) -> str:
+    """Xray test steps field ID: project setting, else resolved by name from the project metadata"""
+    steps_field = (project_settings or {}).get('xray_test_steps_field')
+    if steps_field:
+        return steps_field
+    try:
+        metadata = get_project_metadata(jira_instance, project_key)
+    except Exception:
+        metadata = None
+    return _resolve_field_id(metadata, XRAY_TEST_STEPS_FIELD_NAMES, XRAY_TEST_STEPS_FIELD_DEFAULT)
+
+def parse_xray_steps_field(value: Any) -> Dict[str, str]:
+    """Read an Xray Manual Test Steps value back into test_steps / test_data / expected_result"""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return {'test_steps': value.strip(), 'test_data': '', 'expected_result': ''}
+    if isinstance(value, dict):
+        steps = value.get('steps') or []
+    else:
+        steps = value or []
+    
+    columns = {'test_steps': [], 'test_data': [], 'expected_result': []}
+    for step in sorted((step for step in steps if isinstance(step, dict)), key=lambda step: step.get('index', 0)):
+        fields = step.get('fields') or {}
+        for column, name in (('test_steps', 'Action'), ('test_data', 'Data'), ('expected_result', 'Expected Result')):
+            text = str(fields.get(name) or '').strip()
+            if text:
+                columns[column].append(text)
+    return {column: '\n'.join(texts) for column, texts in columns.items()}
+
+def _remote_projection(issue, steps_field: str) -> Dict[str, str]:
+    """Local test case fields carried by a Jira Test issue"""
+    projection = {'description': (getattr(issue.fields, 'summary', None) or '').strip()}
+    # Đọc JSON gốc: thư viện jira đổi giá trị dict thành PropertyHolder
+    raw_fields = (getattr(issue, 'raw', None) or {}).get('fields') or {}
+    projection.update(parse_xray_steps_field(raw_fields.get(steps_field)))
+    return projection
+
+def _parse_jira_datetime(value: Optional[str]) -> Optional[datetime]:
+    """Parse a Jira timestamp such as 2024-05-01T10:15:30.000+0700 (keeps Jira's UTC offset)"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f%z')
+    except ValueError:
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return None
+
+def _iter_search_issues(jira_instance, jql: str, fields: str, page_size: int = JIRA_SEARCH_PAGE_SIZE):
+    """Yield every issue matching jql, one page at a time"""
+    start_at = 0
+    while True:
+        issues = _call_with_backoff(lambda: jira_instance.search_issues(
+            jql, startAt=start_at, maxResults=page_size, fields=fields
+        ))
+        yield from issues
+        if len(issues) < page_size:
+            break
+        start_at += len(issues)
+
+def _local_projection(test_case: Dict[str, Any]) -> Dict[str, str]:
+    """Local test case fields as they look after a push/pull round trip (steps numbered like Xray)"""
+    steps = format_test_steps_with_expected_result_and_data_for_xray(
+        test_case.get('test_steps', '') or '', test_case.get('expected_result', '') or '', test_case.get('test_data', '') or ''
+    )
+    projection = {'description': str(test_case.get('description', '') or '').strip()}
+    projection.update(parse_xray_steps_field(steps))
+    return projection
+
+def pull_test_case_changes_from_jira(
+    test_cases: List[Dict[str, Any]],
+    project_key: str,
+    project_settings: dict = None,
+    page_size: int = JIRA_SEARCH_PAGE_SIZE,
+    project_id: Any = None
+) -> Dict[str, Any]:
+    """
+    Pull edits made on mapped Test issues in Jira back into local test cases.
+    
+    Only issues with `updated >= lastPullTime` are searched (paginated, summary + steps field
+    only), so a pull costs time in proportion to what changed. The cursor is the latest
+    `updated` value Jira returned (Jira's clock and time zone, not the local one). Remote edits
+    are merged through the sync mapping: a case unchanged locally since its last sync takes the
+    Jira values (and its mapping hash is refreshed, so the next push skips it); a case edited on
+    both sides is left as is and reported in 'conflicts'. Conflicting issues are remembered and
+    checked again on every pull until they no longer conflict, even once the cursor passed them.
+    """
+    credentials = get_jira_credentials(project_settings)
+    if not all([credentials.get('server'), credentials.get('username'), credentials.get('password')]):
+        return {
+            'success': False,
+            'message': '❌ Jira credentials not configured. Please configure in project settings.',
+            'test_cases': test_cases
+        }
+    
+    try:
+        server = credentials['server'].strip()
+        if not server.startswith('http'):
+            server = f"https://{server}"
+        
+        mappings = load_mappings(server, project_key)
+        cases_by_jira_key = {mapping['jira_key']: case_key for case_key, mapping in mappings.items()}
+        local_indexes = {get_case_key(test_case, index, project_id): index - 1 for index, test_case in enumerate(test_cases, 1)}
+        if not cases_by_jira_key:
+            return {
+                'success': True,
+                'message': f"ℹ️ No test cases of project {project_key} have been synced to Jira yet",
+                'test_cases': test_cases,
+                'changes': [],
+                'conflicts': []
+            }
+        
+        jira = get_jira_client(server, credentials['username'], credentials['password'])
+        steps_field = _resolve_steps_field(jira, project_key, project_settings)
+        fields = f'summary,updated,{steps_field}'
+        
+        last_pull = get_last_pull_time(server, project_key)
+        jql = f'project = "{_escape_jql_string(project_key)}" AND labels = "automated-sync"'
+        if last_pull:
+            # Giờ theo múi giờ của Jira (lấy từ trường updated), lùi vài phút vì JQL chỉ so đến phút
+            since = last_pull - timedelta(minutes=JIRA_PULL_OVERLAP_MINUTES)
+            jql += f' AND updated >= "{since.strftime("%Y/%m/%d %H:%M")}"'
+        jql += ' ORDER BY updated ASC'
+        searches = [jql]
+        # Conflict chưa giải quyết được kiểm tra lại dù cursor đã vượt qua
+        open_conflicts = [key for key in load_pull_conflicts(server, project_key) if key in cases_by_jira_key]
+        for start in range(0, len(open_conflicts), page_size):
+            key_list = ', '.join(f'"{_escape_jql_string(key)}"' for key in open_conflicts[start:start + page_size])
+            searches.append(f'project = "{_escape_jql_string(project_key)}" AND key in ({key_list})')
+        
+        merged = list(test_cases)
+        changes = []
+        conflicts = []
+        refreshed_mappings = []
+        scanned = 0
+        seen = set()
+        cursor = None
+        for search_jql in searches:
+            for issue in _iter_search_issues(jira, search_jql, fields, page_size):
+                if issue.key in seen:
+                    continue
+                seen.add(issue.key)
+                scanned += 1
+                if search_jql is jql:
+                    updated = _parse_jira_datetime(((getattr(issue, 'raw', None) or {}).get('fields') or {}).get('updated'))
+                    if updated and (cursor is None or updated > cursor):
+                        cursor = updated
+                
+                case_key = cases_by_jira_key.get(issue.key)
+                local_index = local_indexes.get(case_key)
+                if local_index is None:
+                    continue
+                
+                local_case = merged[local_index]
+                remote = _remote_projection(issue, steps_field)
+                local = _local_projection(local_case)
+                changed_fields = [field for field in remote if remote[field] != local[field]]
+                if not changed_fields:
+                    continue
+                
+                if compute_content_hash(local_case, project_settings) != mappings[case_key]['content_hash']:
+                    # Sửa ở cả local và Jira → không ghi đè, báo conflict
+                    conflicts.append({
+                        'case_key': case_key,
+                        'test_case_id': local_case.get('test_case_id'),
+                        'jira_key': issue.key,
+                        'fields': changed_fields,
+                        'local': {field: local[field] for field in changed_fields},
+                        'remote': {field: remote[field] for field in changed_fields}
+                    })
+                    continue
+                
+                updated_case = dict(local_case)
+                for field in changed_fields:
+                    updated_case[field] = remote[field]
+                merged[local_index] = updated_case
+                refreshed_mappings.append((case_key, issue.key, compute_content_hash(updated_case, project_settings)))
+                changes.append({'case_key': case_key, 'jira_key': issue.key, 'fields': changed_fields})
+        
+        save_mappings(server, project_key, refreshed_mappings)
+        save_pull_conflicts(server, project_key, [conflict['jira_key'] for conflict in conflicts])
+        if cursor is not None:
+            set_last_pull_time(server, project_key, cursor)
+        
+        return {
+            'success': True,
+            'message': f"✅ Pulled from Jira project {project_key}: {scanned} issue(s) checked, {len(changes)} test case(s) updated, {len(conflicts)} conflict(s)",
+            'test_cases': merged,
+            'changes': changes,
+            'conflicts': conflicts
+        }
+    
+    except Exception as e:
+        return {
+            'success': False,
+            'message': f"❌ Failed to pull changes from Jira: {str(e)}",
+            'test_cases': test_cases
+        }
 
 def create_jira_description(test_case: Dict[str, Any]) -> str:
     """Create Jira issue description from test case"""
@@ -202,28 +1052,83 @@ def get_jira_priority(test_case: Dict[str, Any]) -> str:
         return 'Medium'
 
 def debug_jira_info(jira_instance, project_key: str):
-    """Check Jira project and field information"""
+    """Check Jira project and field information (issue types come from the metadata cache)"""
     try:
-        # Get project info
-        project = jira_instance.project(project_key)
-        
         # Get issue types for this project
-        issue_types = jira_instance.project_issue_types(project_key)
+        issue_types = get_project_metadata(jira_instance, project_key)['issue_types']
         
         # Check if Test issue type exists
-        test_issue_type = None
-        precondition_issue_type = None
-        for it in issue_types:
-            if it.name.lower() == 'test':
-                test_issue_type = it
-            elif it.name.lower() == 'pre-condition':
-                precondition_issue_type = it
+        test_issue_type = issue_types.get('test')
+        precondition_issue_type = issue_types.get('pre-condition')
             
         return test_issue_type, precondition_issue_type
         
     except Exception as e:
         return None, None
 
+def normalize_precondition_summary(summary: Optional[str]) -> str:
+    """Normalize a Pre-Condition summary for index lookups (case and whitespace insensitive)"""
+    return " ".join((summary or "").split()).lower()
+
+def _escape_jql_string(value: str) -> str:
+    """Escape a value for use inside a double-quoted JQL string"""
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+def build_precondition_index(jira_instance, project_key: str, page_size: int = JIRA_SEARCH_PAGE_SIZE) -> Dict[str, str]:
+    """
+    Fetch all Pre-Condition issues of the project once (paginated JQL, summary only)
+    and index them by normalized summary → issue key.
+    """
+    jql = f'project = "{_escape_jql_string(project_key)}" AND issuetype = "Pre-Condition" ORDER BY created ASC'
+    precondition_index = {}
+    start_at = 0
+    while True:
+        page = jira_instance.search_issues(jql, startAt=start_at, maxResults=page_size, fields='summary')
+        for issue in page:
+            # Giữ Pre-Condition tạo sớm nhất nếu có nhiều issue trùng summary
+            precondition_index.setdefault(normalize_precondition_summary(issue.fields.summary), issue.key)
+        start_at += len(page)
+        total = getattr(page, 'total', None)
+        if not page or (total is not None and start_at >= total):
+            break
+    return precondition_index
+
+def ensure_preconditions(
+    jira_instance,
+    project_key: str,
+    precondition_summaries: List[str],
+    precondition_index: Dict[str, str],
+    batch_size: int = JIRA_BULK_BATCH_SIZE,
+    max_workers: int = JIRA_SYNC_CONCURRENCY
+) -> Dict[str, str]:
+    """Create (in bulk) the Pre-Conditions missing from the index and add them to it"""
+    missing = {}
+    for summary in precondition_summaries:
+        normalized = normalize_precondition_summary(summary)
+        if normalized and normalized not in precondition_index and normalized not in missing:
+            missing[normalized] = summary.strip()
+    
+    if not missing:
+        return precondition_index
+    
+    field_list = [
+        {
+            'project': {'key': project_key},
+            'summary': summary,
+            'issuetype': {'name': 'Pre-Condition'},
+            'labels': ['precondition', 'automated-sync', get_idempotency_label(project_key, f"precondition:{normalized}")]
+        }
+        for normalized, summary in missing.items()
+    ]
+    results = create_issues_in_batches(jira_instance, field_list, batch_size, max_workers)
+    for normalized, result in zip(missing.keys(), results):
+        if result['key']:
+            precondition_index[normalized] = result['key']
+        else:
+            st.warning(f"⚠️ Warning: Could not create Pre-Condition '{missing[normalized]}': {result['error']}")
+    
+    return precondition_index
+
 def find_or_create_precondition(jira_instance, project_key: str, precondition_summary: str, precondition_issue_type):
     """Find existing Pre-Condition or create new one"""
     if not precondition_summary or not precondition_summary.strip():
@@ -231,7 +1136,7 @@ def find_or_create_precondition(jira_instance, project_key: str, precondition_su
     
     try:
         # Search for existing Pre-Condition with same summary
-        jql = f'project = "{project_key}" AND issuetype = "Pre-Condition" AND summary ~ "{precondition_summary.strip()}"'
+        jql = f'project = "{_escape_jql_string(project_key)}" AND issuetype = "Pre-Condition" AND summary ~ "{_escape_jql_string(precondition_summary.strip())}"'
         existing_issues = jira_instance.search_issues(jql, maxResults=1)
         
         if existing_issues:
@@ -508,11 +1413,7 @@ def render_jira_credentials_form():
                 if project_key:
                     with st.spinner("Debugging Jira project..."):
                         try:
-                            jira = JIRA(
-                                server=server, 
-                                basic_auth=(username, password),
-                                options={'timeout': 30}
-                            )
+                            jira = get_jira_client(server, username, password)
                             debug_jira_info(jira, project_key)
                         except Exception as e:
                             st.error(f"❌ Debug failed: {str(e)}")
@@ -0,0 +1,407 @@
+# jira_sync_store.py - Local SQLite store for Jira sync state (test case → Jira issue mapping)
+import sqlite3
+import hashlib
+import json
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple
+
+SYNC_STORE_FILE = os.path.join(os.getcwd(), "jira_sync.db")
+
+# Các trường của test case được đẩy lên Jira (dùng để tính content hash)
+SYNCED_TEST_CASE_FIELDS = ['test_case_id', 'description', 'preconditions', 'test_steps', 'test_data', 'expected_result']
+
+_store_lock = threading.Lock()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sync_mapping (
+    server TEXT NOT NULL,
+    project_key TEXT NOT NULL,
+    case_key TEXT NOT NULL,
+    jira_key TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    synced_at TEXT NOT NULL,
+    PRIMARY KEY (server, project_key, case_key)
+);
+CREATE TABLE IF NOT EXISTS pull_state (
+    server TEXT NOT NULL,
+    project_key TEXT NOT NULL,
+    last_pull_at TEXT NOT NULL,
+    PRIMARY KEY (server, project_key)
+);
+CREATE TABLE IF NOT EXISTS pull_conflict (
+    server TEXT NOT NULL,
+    project_key TEXT NOT NULL,
+    jira_key TEXT NOT NULL,
+    PRIMARY KEY (server, project_key, jira_key)
+);
+CREATE TABLE IF NOT EXISTS sync_run (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    server TEXT NOT NULL,
+    project_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    owner_host TEXT,
+    owner_pid INTEGER,
+    heartbeat_at TEXT
+);
+CREATE TABLE IF NOT EXISTS sync_journal (
+    run_id INTEGER NOT NULL,
+    case_key TEXT NOT NULL,
+    action TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    idempotency_label TEXT NOT NULL,
+    jira_key TEXT,
+    outcome TEXT,
+    error TEXT,
+    intent_at TEXT NOT NULL,
+    outcome_at TEXT,
+    PRIMARY KEY (run_id, case_key)
+);
+"""
+
+# Tiền tố label idempotency gắn trên issue do sync tạo (tìm lại issue khi không biết create đã thành công chưa)
+IDEMPOTENCY_LABEL_PREFIX = 'tcsync-'
+
+# Trạng thái của một lần sync trong journal
+RUN_RUNNING = 'running'
+RUN_COMPLETED = 'completed'
+RUN_INTERRUPTED = 'interrupted'  # dừng giữa chừng vì lỗi, journal cần được đọc lại
+RUN_RECOVERED = 'recovered'
+
+# Lần sync 'running' không cập nhật heartbeat quá lâu được coi là đã chết (session bị ngắt)
+SYNC_RUN_STALE_SECONDS = 15 * 60
+
+# Cột thêm vào sync_run sau phiên bản đầu (ALTER TABLE cho DB cũ)
+_SYNC_RUN_MIGRATIONS = {
+    'owner_host': "ALTER TABLE sync_run ADD COLUMN owner_host TEXT",
+    'owner_pid': "ALTER TABLE sync_run ADD COLUMN owner_pid INTEGER",
+    'heartbeat_at': "ALTER TABLE sync_run ADD COLUMN heartbeat_at TEXT",
+}
+
+_SYNC_RUN_COLUMNS = ('run_id', 'server', 'project_key', 'status', 'started_at', 'finished_at',
+                     'owner_host', 'owner_pid', 'heartbeat_at')
+
+
+def _connect(db_path: Optional[str] = None) -> sqlite3.Connection:
+    """Open the store and make sure the schema exists"""
+    connection = sqlite3.connect(db_path or SYNC_STORE_FILE, timeout=30)
+    connection.executescript(_SCHEMA)
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(sync_run)")}
+    for column, statement in _SYNC_RUN_MIGRATIONS.items():
+        if column not in columns:
+            connection.execute(statement)
+    connection.commit()
+    return connection
+
+
+def get_case_key(test_case: Dict[str, Any], index: int, project_id: Any = None) -> str:
+    """
+    Local identity of a test case: local project + the case_uid assigned when the case was created.
+    Cases saved before case_uid existed keep their old key (test_case_id, falling back to the position)
+    so their existing mappings still match.
+    """
+    case_uid = test_case.get('case_uid')
+    if case_uid:
+        return f"{project_id}:{case_uid}" if project_id is not None else str(case_uid)
+    test_case_id = test_case.get('test_case_id')
+    if test_case_id in (None, ''):
+        return f"#{index}"
+    return str(test_case_id)
+
+
+def compute_content_hash(test_case: Dict[str, Any], project_settings: dict = None) -> str:
+    """Hash of the test case content that is synced to Jira (plus the Xray steps field it maps to)"""
+    payload = {field: test_case.get(field, '') for field in SYNCED_TEST_CASE_FIELDS}
+    payload['xray_test_steps_field'] = (project_settings or {}).get('xray_test_steps_field', '')
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def load_mappings(server: str, project_key: str, db_path: Optional[str] = None) -> Dict[str, Dict[str, str]]:
+    """Load case_key → {'jira_key', 'content_hash', 'synced_at'} for a Jira project"""
+    with _store_lock:
+        connection = _connect(db_path)
+        try:
+            rows = connection.execute(
+                "SELECT case_key, jira_key, content_hash, synced_at FROM sync_mapping WHERE server = ? AND project_key = ?",
+                (server, project_key)
+            ).fetchall()
+        finally:
+            connection.close()
+    return {
+        case_key: {'jira_key': jira_key, 'content_hash': content_hash, 'synced_at': synced_at}
+        for case_key, jira_key, content_hash, synced_at in rows
+    }
+
+
+def save_mappings(server: str, project_key: str, entries: List[Tuple[str, str, str]], db_path: Optional[str] = None):
+    """Insert or update (case_key, jira_key, content_hash) mappings in one transaction"""
+    if not entries:
+        return
+
+    synced_at = datetime.now().isoformat(timespec='seconds')
+    with _store_lock:
+        connection = _connect(db_path)
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO sync_mapping (server, project_key, case_key, jira_key, content_hash, synced_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(server, project_key, case_key, jira_key, content_hash, synced_at) for case_key, jira_key, content_hash in entries]
+                )
+        finally:
+            connection.close()
+
+
+def get_last_pull_time(server: str, project_key: str, db_path: Optional[str] = None) -> Optional[datetime]:
+    """Latest Jira 'updated' time seen by the last pull, in Jira's time zone (None if the project was never pulled)"""
+    with _store_lock:
+        connection = _connect(db_path)
+        try:
+            row = connection.execute(
+                "SELECT last_pull_at FROM pull_state WHERE server = ? AND project_key = ?",
+                (server, project_key)
+            ).fetchone()
+        finally:
+            connection.close()
+    return datetime.fromisoformat(row[0]) if row else None
+
+
+def set_last_pull_time(server: str, project_key: str, pulled_at: datetime, db_path: Optional[str] = None):
+    """Remember the latest Jira 'updated' time seen, for the next incremental pull"""
+    with _store_lock:
+        connection = _connect(db_path)
+        try:
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO pull_state (server, project_key, last_pull_at) VALUES (?, ?, ?)",
+                    (server, project_key, pulled_at.isoformat(timespec='seconds'))
+                )
+        finally:
+            connection.close()
+
+
+def load_pull_conflicts(server: str, project_key: str, db_path: Optional[str] = None) -> List[str]:
+    """Jira keys whose remote edits conflicted with local edits and were not merged yet"""
+    with _store_lock:
+        connection = _connect(db_path)
+        try:
+            rows = connection.execute(
+                "SELECT jira_key FROM pull_conflict WHERE server = ? AND project_key = ? ORDER BY jira_key",
+                (server, project_key)
+            ).fetchall()
+        finally:
+            connection.close()
+    return [jira_key for jira_key, in rows]
+
+
+def save_pull_conflicts(server: str, project_key: str, jira_keys: List[str], db_path: Optional[str] = None):
+    """Replace the unresolved pull conflicts of a project (re-checked on every pull until resolved)"""
+    with _store_lock:
+        connection = _connect(db_path)
+        try:
+            with connection:
+                connection.execute("DELETE FROM pull_conflict WHERE server = ? AND project_key = ?", (server, project_key))
+                connection.executemany(
+                    "INSERT OR IGNORE INTO pull_conflict (server, project_key, jira_key) VALUES (?, ?, ?)",
+                    [(server, project_key, jira_key) for jira_key in jira_keys]
+                )
+        finally:
+            connection.close()
+
+
+def plan_sync(test_cases: List[Dict[str, Any]], server: str, project_key: str, project_settings: dict = None,
+              project_id: Any = None, db_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Diff test cases against the stored mapping.
+
+    Returns one entry per test case (input order):
+    {'index', 'case_key', 'content_hash', 'action': 'create' | 'update' | 'skip' | 'duplicate', 'jira_key'}
+    A case whose key was already planned earlier in the list is marked 'duplicate' (with
+    'duplicate_of': index of the first case) and is not synced.
+    """
+    mappings = load_mappings(server, project_key, db_path)
+    plan = []
+    first_index = {}
+    for index, test_case in enumerate(test_cases, 1):
+        case_key = get_case_key(test_case, index, project_id)
+        content_hash = compute_content_hash(test_case, project_settings)
+        mapping = mappings.get(case_key)
+        if case_key in first_index:
+            plan.append({
+                'index': index,
+                'case_key': case_key,
+                'content_hash': content_hash,
+                'action': 'duplicate',
+                'jira_key': mapping['jira_key'] if mapping else None,
+                'duplicate_of': first_index[case_key],
+            })
+            continue
+        first_index[case_key] = index
+        if not mapping:
+            action = 'create'
+        elif mapping['content_hash'] != content_hash:
+            action = 'update'
+        else:
+            action = 'skip'
+        plan.append({
+            'index': index,
+            'case_key': case_key,
+            'content_hash': content_hash,
+            'action': action,
+            'jira_key': mapping['jira_key'] if mapping else None,
+        })
+    return plan
+
+
+def get_idempotency_label(project_key: str, case_key: str) -> str:
+    """Stable Jira label identifying the issue created for a test case (used to detect creates lost in a crash)"""
+    digest = hashlib.sha1(f"{project_key}:{case_key}".encode('utf-8')).hexdigest()[:16]
+    return f"{IDEMPOTENCY_LABEL_PREFIX}{digest}"
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec='milliseconds')
+
+
+def start_sync_run(server: str, project_key: str, intents: List[Dict[str, Any]], db_path: Optional[str] = None) -> int:
+    """
+    Write-ahead: record a new sync run and one intent per case before any Jira call.
+
+    intents: [{'case_key', 'action', 'content_hash', 'jira_key'}] ('jira_key' is the existing issue for updates)
+    """
+    started_at = _now()
+    with _store_lock:
+        connection = _connect(db_path)
+        try:
+            with connection:
+                run_id = connection.execute(
+                    "INSERT INTO sync_run (server, project_key, status, started_at, owner_host, owner_pid, heartbeat_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (server, project_key, RUN_RUNNING, started_at, socket.gethostname(), os.getpid(), started_at)
+                ).lastrowid
+                connection.executemany(
+                    "INSERT INTO sync_journal (run_id, case_key, action, content_hash, idempotency_label, jira_key, intent_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (run_id, intent['case_key'], intent['action'], intent['content_hash'],
+                         get_idempotency_label(project_key, intent['case_key']), intent.get('jira_key'), started_at)
+                        for intent in intents
+                    ]
+                )
+        finally:
+            connection.close()
+    return run_id
+
+
+def record_outcome(run_id: int, server: str, project_key: str, case_key: str, jira_key: Optional[str],
+                   content_hash: str, error: Optional[str] = None, db_path: Optional[str] = None):
+    """Record the outcome of one case (also the run's heartbeat); on success the sync mapping is updated in the same transaction"""
+    outcome_at = _now()
+    with _store_lock:
+        connection = _connect(db_path)
+        try:
+            with connection:
+                connection.execute("UPDATE sync_run SET heartbeat_at = ? WHERE run_id = ?", (outcome_at, run_id))
+                connection.execute(
+                    "UPDATE sync_journal SET outcome = ?, jira_key = COALESCE(?, jira_key), error = ?, outcome_at = ? "
+                    "WHERE run_id = ? AND case_key = ?",
+                    ('done' if jira_key else 'failed', jira_key, error, outcome_at, run_id, case_key)
+                )
+                if jira_key:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO sync_mapping (server, project_key, case_key, jira_key, content_hash, synced_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (server, project_key, case_key, jira_key, content_hash, outcome_at[:19])
+                    )
+        finally:
+            connection.close()
+
+
+def finish_sync_run(run_id: int, status: str = RUN_COMPLETED, db_path: Optional[str] = None):
+    """Mark a sync run as finished"""
+    with _store_lock:
+        connection = _connect(db_path)
+        try:
+            with connection:
+                connection.execute(
+                    "UPDATE sync_run SET status = ?, finished_at = ? WHERE run_id = ?",
+                    (status, _now(), run_id)
+                )
+        finally:
+            connection.close()
+
+
+def load_sync_runs(server: Optional[str] = None, project_key: Optional[str] = None, status: Optional[str] = None,
+                   db_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """List sync runs (newest first), optionally filtered by server / project / status"""
+    query = f"SELECT {', '.join(_SYNC_RUN_COLUMNS)} FROM sync_run WHERE 1 = 1"
+    params = []
+    for column, value in (('server', server), ('project_key', project_key), ('status', status)):
+        if value is not None:
+            query += f" AND {column} = ?"
+            params.append(value)
+    query += " ORDER BY run_id DESC"
+    with _store_lock:
+        connection = _connect(db_path)
+        try:
+            rows = connection.execute(query, params).fetchall()
+        finally:
+            connection.close()
+    return [dict(zip(_SYNC_RUN_COLUMNS, row)) for row in rows]
+
+
+def _process_is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def is_sync_run_abandoned(run: Dict[str, Any], now: Optional[datetime] = None) -> bool:
+    """
+    Whether a run still marked 'running' has no live owner: its process on this host is gone,
+    or it has not recorded an outcome for SYNC_RUN_STALE_SECONDS. Runs of live sessions are not touched.
+    """
+    if run['status'] == RUN_INTERRUPTED:
+        return True
+    if run['status'] != RUN_RUNNING:
+        return False
+    # os.kill(pid, 0) chỉ là phép kiểm tra trên POSIX (trên Windows nó kết thúc process)
+    if (os.name == 'posix' and run.get('owner_pid') and run.get('owner_host') == socket.gethostname()
+            and run['owner_pid'] != os.getpid() and not _process_is_alive(run['owner_pid'])):
+        return True
+    heartbeat_at = datetime.fromisoformat(run.get('heartbeat_at') or run['started_at'])
+    return (now or datetime.now()) - heartbeat_at > timedelta(seconds=SYNC_RUN_STALE_SECONDS)
+
+
+def load_abandoned_sync_runs(server: str, project_key: str, db_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Runs of the project that stopped without finishing (interrupted, dead owner or stale heartbeat)"""
+    runs = load_sync_runs(server, project_key, RUN_RUNNING, db_path) + load_sync_runs(server, project_key, RUN_INTERRUPTED, db_path)
+    return [run for run in runs if is_sync_run_abandoned(run)]
+
+
+def load_journal(run_id: int, pending_only: bool = False, db_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Journal entries of a run in intent order (pending_only: cases without a recorded outcome)"""
+    query = (
+        "SELECT case_key, action, content_hash, idempotency_label, jira_key, outcome, error, intent_at, outcome_at "
+        "FROM sync_journal WHERE run_id = ?"
+    )
+    if pending_only:
+        query += " AND outcome IS NULL"
+    query += " ORDER BY rowid"
+    with _store_lock:
+        connection = _connect(db_path)
+        try:
+            rows = connection.execute(query, (run_id,)).fetchall()
+        finally:
+            connection.close()
+    columns = ('case_key', 'action', 'content_hash', 'idempotency_label', 'jira_key', 'outcome', 'error', 'intent_at', 'outcome_at')
+    return [dict(zip(columns, row)) for row in rows]
@@ -1,18 +1,57 @@
 # spec_processor.py - File spec processing and AI analysis
 import streamlit as st
-import pandas as pd
 import PyPDF2
 import pypdf
-from docx import Document
 import io
+import json
+import math
+import hashlib
 import tempfile
 import os
+import re
 import shutil
+import threading
+import zipfile
+from xml.etree.ElementTree import iterparse
 import mimetypes
-from typing import Optional, Dict, Any, List
-from PIL import Image
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple, Iterable, Iterator
+from PIL import Image, ImageChops
 from tester_agent import generate_test_cases
-def _truncate_text_for_model(text: str, max_tokens: int = 5900, approx_chars_per_token: int = 4) -> str:
+
+# Giới hạn input cho model phân tích spec (xấp xỉ theo số ký tự)
+MODEL_MAX_TOKENS = 5900
+APPROX_CHARS_PER_TOKEN = 4
+# Trích xuất nhiều hơn budget của model để có đủ ứng viên cho bước xếp hạng các phần của spec
+SPEC_CANDIDATE_FACTOR = 4
+
+# Từ khóa theo loại kiểm thử của project, dùng để xếp hạng (BM25) các phần của spec
+TESTING_TYPE_KEYWORDS = {
+    "UI Testing": ["ui", "screen", "page", "button", "field", "form", "label", "display", "hiển thị", "màn hình", "nút", "trường"],
+    "Functional Testing": ["function", "feature", "workflow", "flow", "process", "chức năng", "luồng", "quy trình"],
+    "Data Validation Testing": ["validation", "validate", "required", "format", "length", "invalid", "error", "hợp lệ", "bắt buộc", "định dạng", "lỗi"],
+    "Security Testing": ["security", "login", "password", "permission", "role", "authentication", "token", "bảo mật", "mật khẩu", "phân quyền", "đăng nhập"],
+    "Performance Testing": ["performance", "response", "time", "load", "concurrent", "seconds", "hiệu năng", "thời gian", "tải"],
+    "Accessibility Testing": ["accessibility", "keyboard", "screen reader", "contrast", "aria", "khả năng truy cập"],
+    "API/Integration Testing": ["api", "endpoint", "request", "response", "integration", "service", "tích hợp"],
+    "Responsive Testing": ["responsive", "mobile", "tablet", "desktop", "resolution", "di động"],
+}
+# Từ khóa mô tả yêu cầu / hành động của người dùng (áp dụng cho mọi project)
+REQUIREMENT_KEYWORDS = [
+    "want", "need", "should", "shall", "can", "must", "muốn", "cần", "có thể", "phải",
+    "login", "register", "submit", "click", "enter", "select", "acceptance", "criteria",
+]
+# Kích thước tối đa của một phần (chunk) và số dòng bảng gộp vào một chunk
+SPEC_CHUNK_MAX_CHARS = 1500
+SPEC_TABLE_ROWS_PER_CHUNK = 20
+
+_SPEC_HEADING_PATTERN = re.compile(r"^\s*#{1,6}\s+\S")
+_SPEC_NUMBERED_PATTERN = re.compile(r"^\s*(?:\d+(?:\.\d+)*[.)]?|(?:REQ|FR|NFR|US|AC|BR|UC)[-_ ]?\d+[.:)]?)\s+\S", re.IGNORECASE)
+_SPEC_TABLE_PATTERN = re.compile(r"^\s*\||^[^|]+:\s.*\s\|\s")
+
+
+def _truncate_text_for_model(text: str, max_tokens: int = MODEL_MAX_TOKENS, approx_chars_per_token: int = APPROX_CHARS_PER_TOKEN) -> str:
     """
     Truncate text to fit within model token limits (approximation-based).
     Keeps both the beginning and end context.
@@ -30,6 +69,314 @@ def _truncate_text_for_model(text: str, max_tokens: int = 5900, approx_chars_per
     tail = text[-half:]
     return head + indicator + tail
 
+
+def _tokenize_for_ranking(text: str) -> List[str]:
+    """Lowercase word tokens (Unicode aware, works for Vietnamese)."""
+    return re.findall(r"\w+", text.lower())
+
+
+def _split_spec_into_sections(text: str) -> List[Dict[str, str]]:
+    """
+    Split spec text into chunks on headings, numbered requirements and table blocks.
+    Each chunk keeps the nearest heading so it can be re-emitted when packing.
+    """
+    sections = []
+    current_heading = ""
+    current_lines = []
+    current_kind = "text"
+    
+    def flush():
+        chunk_text = "\n".join(current_lines).strip()
+        if chunk_text:
+            sections.append({"heading": current_heading, "text": chunk_text})
+    
+    for line in text.splitlines():
+        if _SPEC_HEADING_PATTERN.match(line):
+            flush()
+            current_heading = line.strip()
+            current_lines = []
+            current_kind = "text"
+            continue
+        
+        kind = "table" if _SPEC_TABLE_PATTERN.match(line) else "text"
+        current_size = sum(len(existing) + 1 for existing in current_lines)
+        starts_new_chunk = (
+            (kind != current_kind and current_lines)
+            or (kind == "text" and _SPEC_NUMBERED_PATTERN.match(line))
+            or (kind == "table" and len(current_lines) >= SPEC_TABLE_ROWS_PER_CHUNK)
+            or (kind == "text" and not line.strip() and current_size >= SPEC_CHUNK_MAX_CHARS)
+            or current_size + len(line) > SPEC_CHUNK_MAX_CHARS * 2
+        )
+        if starts_new_chunk:
+            flush()
+            current_lines = []
+        current_kind = kind
+        current_lines.append(line)
+    
+    flush()
+    return sections
+
+
+def _bm25_scores(documents: List[List[str]], query_terms: List[str], k1: float = 1.5, b: float = 0.75) -> List[float]:
+    """
+    Okapi BM25 score of each tokenized document against the query terms.
+    """
+    if not documents:
+        return []
+    
+    document_count = len(documents)
+    average_length = sum(len(tokens) for tokens in documents) / document_count or 1.0
+    document_frequency = {}
+    term_counts = []
+    for tokens in documents:
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        term_counts.append(counts)
+        for token in counts:
+            document_frequency[token] = document_frequency.get(token, 0) + 1
+    
+    unique_terms = set(query_terms)
+    scores = []
+    for tokens, counts in zip(documents, term_counts):
+        score = 0.0
+        length_norm = k1 * (1 - b + b * len(tokens) / average_length)
+        for term in unique_terms:
+            frequency = counts.get(term)
+            if not frequency:
+                continue
+            df = document_frequency[term]
+            idf = math.log(1 + (document_count - df + 0.5) / (df + 0.5))
+            score += idf * frequency * (k1 + 1) / (frequency + length_norm)
+        scores.append(score)
+    return scores
+
+
+def _ranking_query_terms(project_settings: Optional[Dict[str, Any]]) -> List[str]:
+    """Build ranking query terms from the project's testing types."""
+    keywords = list(REQUIREMENT_KEYWORDS)
+    for testing_type in (project_settings or {}).get("testing_types", []) or []:
+        keywords.extend(TESTING_TYPE_KEYWORDS.get(testing_type, [testing_type]))
+    
+    terms = []
+    for keyword in keywords:
+        terms.extend(_tokenize_for_ranking(keyword))
+    return terms
+
+
+def select_relevant_content(text: str, project_settings: Optional[Dict[str, Any]] = None, max_chars: Optional[int] = None) -> str:
+    """
+    Fit text into max_chars by keeping the highest-value sections instead of head/tail truncation.
+    
+    Sections (headings, numbered requirements, tables) are ranked locally with BM25 against
+    the project's testing types, packed greedily into the budget and emitted in document order.
+    """
+    if max_chars is None:
+        max_chars = MODEL_MAX_TOKENS * APPROX_CHARS_PER_TOKEN
+    if not text or len(text) <= max_chars:
+        return text
+    
+    sections = _split_spec_into_sections(text)
+    if len(sections) < 2:
+        return _truncate_text_for_model(text, max_tokens=max_chars // APPROX_CHARS_PER_TOKEN)
+    
+    indicator = "...[Đã chọn các phần liên quan nhất để phù hợp giới hạn mô hình]...\n\n"
+    scores = _bm25_scores(
+        [_tokenize_for_ranking(section["heading"] + "\n" + section["text"]) for section in sections],
+        _ranking_query_terms(project_settings)
+    )
+    # Điểm bằng nhau thì ưu tiên phần xuất hiện trước trong tài liệu
+    ranked_indexes = sorted(range(len(sections)), key=lambda index: -scores[index])
+    
+    remaining = max_chars - len(indicator)
+    selected = set()
+    for index in ranked_indexes:
+        cost = len(sections[index]["text"]) + len(sections[index]["heading"]) + 2
+        if cost <= remaining:
+            selected.add(index)
+            remaining -= cost
+    
+    if not selected:
+        return _truncate_text_for_model(text, max_tokens=max_chars // APPROX_CHARS_PER_TOKEN)
+    
+    output_lines = []
+    last_heading = None
+    for index in sorted(selected):
+        section = sections[index]
+        if section["heading"] and section["heading"] != last_heading:
+            output_lines.append(section["heading"])
+        last_heading = section["heading"]
+        output_lines.append(section["text"])
+    return indicator + "\n".join(output_lines)
+
+
+def _join_within_budget(pieces: Iterable[str], max_chars: Optional[int] = None, separator: str = "\n") -> str:
+    """
+    Join text pieces from a (lazy) iterable, stop pulling once max_chars is reached.
+    """
+    collected = []
+    total_chars = 0
+    for piece in pieces:
+        collected.append(piece)
+        total_chars += len(piece) + len(separator)
+        if max_chars is not None and total_chars >= max_chars:
+            break
+    return separator.join(collected)
+
+
+def _iter_pdf_pages(file_content: bytes) -> Iterator[str]:
+    """
+    Yield PDF page text lazily. Uses pypdf and falls back to PyPDF2 per page
+    (instead of re-parsing the whole document) when a page fails.
+    """
+    fallback_reader = None
+    try:
+        pdf_reader = pypdf.PdfReader(io.BytesIO(file_content))
+        page_count = len(pdf_reader.pages)
+    except Exception:
+        # pypdf không đọc được cả tài liệu → dùng PyPDF2 cho tất cả các trang
+        pdf_reader = None
+        fallback_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
+        page_count = len(fallback_reader.pages)
+    
+    for index in range(page_count):
+        page_text = None
+        if pdf_reader is not None:
+            try:
+                page_text = pdf_reader.pages[index].extract_text()
+            except Exception:
+                page_text = None
+        
+        if page_text is None:
+            try:
+                if fallback_reader is None:
+                    fallback_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
+                page_text = fallback_reader.pages[index].extract_text()
+            except Exception:
+                # Bỏ qua trang không đọc được bằng cả hai thư viện
+                continue
+        
+        yield page_text or ""
+
+
+def _iter_excel_rows(file_content: bytes) -> Iterator[str]:
+    """
+    Yield spreadsheet content row by row from every sheet using openpyxl read_only mode.
+    The first non-empty row of a sheet is its header; each data row is emitted as
+    "Header: value | Header: value" so the table structure is kept.
+    """
+    from openpyxl import load_workbook
+    
+    workbook = load_workbook(io.BytesIO(file_content), read_only=True, data_only=True)
+    try:
+        for worksheet in workbook.worksheets:
+            headers = None
+            for row in worksheet.iter_rows(values_only=True):
+                values = ["" if value is None else str(value).strip() for value in row]
+                if not any(values):
+                    continue
+                
+                if headers is None:
+                    headers = values
+                    yield f"\n## Sheet: {worksheet.title}"
+                    continue
+                
+                pairs = []
+                for index, value in enumerate(values):
+                    if not value:
+                        continue
+                    header = headers[index] if index < len(headers) and headers[index] else f"Column {index + 1}"
+                    pairs.append(f"{header}: {value}")
+                yield " | ".join(pairs)
+    finally:
+        workbook.close()
+
+
+WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def _docx_paragraph_prefix(style_id: Optional[str], is_list_item: bool) -> str:
+    """
+    Map a Word paragraph style to a Markdown-like prefix (headings and list items).
+    """
+    if style_id:
+        heading_match = re.match(r"(?i)heading\s*(\d)", style_id)
+        if heading_match:
+            return "#" * int(heading_match.group(1)) + " "
+        if style_id.lower() == "title":
+            return "# "
+    if is_list_item:
+        return "- "
+    return ""
+
+
+def _iter_docx_blocks(file_content: bytes) -> Iterator[str]:
+    """
+    Stream-parse word/document.xml and yield paragraphs, headings and table rows
+    in document order without building the python-docx object model.
+    """
+    tag_text = WORD_NAMESPACE + "t"
+    tag_tab = WORD_NAMESPACE + "tab"
+    tag_breaks = (WORD_NAMESPACE + "br", WORD_NAMESPACE + "cr")
+    tag_style = WORD_NAMESPACE + "pStyle"
+    tag_numbering = WORD_NAMESPACE + "numPr"
+    tag_paragraph = WORD_NAMESPACE + "p"
+    tag_cell = WORD_NAMESPACE + "tc"
+    tag_row = WORD_NAMESPACE + "tr"
+    tag_table = WORD_NAMESPACE + "tbl"
+    style_value = WORD_NAMESPACE + "val"
+    
+    with zipfile.ZipFile(io.BytesIO(file_content)) as archive:
+        with archive.open("word/document.xml") as document_xml:
+            text_parts = []
+            style_id = None
+            is_list_item = False
+            # Stack cho bảng lồng nhau: mỗi cấp giữ các ô của dòng hiện tại và các đoạn của ô hiện tại
+            row_stack = []
+            cell_stack = []
+            
+            for event, element in iterparse(document_xml, events=("start", "end")):
+                tag = element.tag
+                if event == "start":
+                    if tag == tag_row:
+                        row_stack.append([])
+                    elif tag == tag_cell:
+                        cell_stack.append([])
+                elif tag == tag_text:
+                    text_parts.append(element.text or "")
+                elif tag == tag_paragraph:
+                    text = "".join(text_parts).strip()
+                    if text:
+                        if cell_stack:
+                            cell_stack[-1].append(" ".join(text.split()))
+                        else:
+                            yield _docx_paragraph_prefix(style_id, is_list_item) + text
+                    text_parts = []
+                    style_id = None
+                    is_list_item = False
+                    element.clear()
+                elif tag == tag_tab:
+                    text_parts.append("\t")
+                elif tag in tag_breaks:
+                    text_parts.append("\n")
+                elif tag == tag_style:
+                    style_id = element.get(style_value)
+                elif tag == tag_numbering:
+                    is_list_item = True
+                elif tag == tag_cell:
+                    cell_text = " / ".join(cell_stack.pop())
+                    if row_stack:
+                        row_stack[-1].append(cell_text)
+                    element.clear()
+                elif tag == tag_row:
+                    row_cells = row_stack.pop()
+                    if any(row_cells):
+                        yield "| " + " | ".join(row_cells) + " |"
+                    element.clear()
+                elif tag == tag_table:
+                    element.clear()
+
+
 def _normalize_file_type(file_type: Optional[str], file_name: Optional[str]) -> Optional[str]:
     """
     Attempt to determine the correct MIME type using provided type or filename.
@@ -53,9 +400,15 @@ def _normalize_file_type(file_type: Optional[str], file_name: Optional[str]) ->
     return file_type
 
 
-def extract_text_from_file(file_content: Optional[bytes], file_type: Optional[str], file_name: Optional[str] = None) -> str:
+def extract_text_from_file(
+    file_content: Optional[bytes],
+    file_type: Optional[str],
+    file_name: Optional[str] = None,
+    max_chars: Optional[int] = None
+) -> str:
     """
-    Extract text content from uploaded file based on file type
+    Extract text content from uploaded file based on file type.
+    If max_chars is given, streaming extractors stop once the budget is full.
     """
     if not file_content:
         return ""
@@ -65,37 +418,16 @@ def extract_text_from_file(file_content: Optional[bytes], file_type: Optional[st
         return ""
     try:
         if effective_type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet":
-            # Excel file
-            df = pd.read_excel(io.BytesIO(file_content))
-            # Convert all columns to string and join
-            text_content = ""
-            for column in df.columns:
-                text_content += f"\n{column}:\n"
-                text_content += df[column].astype(str).str.cat(sep="\n")
-            return text_content
+            # Excel file - đọc tất cả các sheet theo từng dòng, dừng khi đủ budget
+            return _join_within_budget(_iter_excel_rows(file_content), max_chars)
             
         elif effective_type == "application/pdf":
-            # PDF file
-            text_content = ""
-            try:
-                # Try with pypdf first (newer)
-                pdf_reader = pypdf.PdfReader(io.BytesIO(file_content))
-                for page in pdf_reader.pages:
-                    text_content += page.extract_text() + "\n"
-            except Exception:
-                # Fallback to PyPDF2
-                pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-                for page in pdf_reader.pages:
-                    text_content += page.extract_text() + "\n"
-            return text_content
+            # PDF file - đọc từng trang, dừng khi đủ budget
+            return _join_within_budget(_iter_pdf_pages(file_content), max_chars)
             
         elif effective_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            # Word document
-            doc = Document(io.BytesIO(file_content))
-            text_content = ""
-            for paragraph in doc.paragraphs:
-                text_content += paragraph.text + "\n"
-            return text_content
+            # Word document - stream XML: đoạn văn, heading và dòng bảng theo thứ tự tài liệu
+            return _join_within_budget(_iter_docx_blocks(file_content), max_chars)
         
         elif effective_type in ("text/markdown", "text/plain"):
             # Markdown or plain text document
@@ -111,10 +443,62 @@ def extract_text_from_file(file_content: Optional[bytes], file_type: Optional[st
         st.error(f"Error extracting text from file: {str(e)}")
         return ""
 
+# Model và cache cho bước phân tích spec
+ANALYSIS_MODEL = "llama-3.1-8b-instant"
+# Tăng version khi thay đổi prompt phân tích để các kết quả cache cũ không còn được dùng
+ANALYSIS_PROMPT_VERSION = 1
+ANALYSIS_CACHE_MAX_ENTRIES = 128
+
+# Cache dùng chung cho mọi session trong process Streamlit (LRU, có lock vì các session chạy trên nhiều thread)
+_analysis_cache: "OrderedDict[str, str]" = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+
+def _analysis_settings_payload(project_settings: Dict[str, Any]) -> Dict[str, Any]:
+    """Everything besides the spec text that changes the analysis: prompt settings, model and prompt version"""
+    # Giữ nguyên thứ tự list: prompt ghép languages / testing_types theo đúng thứ tự này
+    return {
+        "languages": list(project_settings.get('languages', []) or []),
+        "testing_types": list(project_settings.get('testing_types', []) or []),
+        "writing_style": project_settings.get('writing_style', ''),
+        "model": ANALYSIS_MODEL,
+        "prompt_version": ANALYSIS_PROMPT_VERSION,
+    }
+
+
+def analysis_settings_fingerprint(project_settings: Dict[str, Any]) -> str:
+    """Hash of _analysis_settings_payload (stored with each spec version)"""
+    payload = json.dumps(_analysis_settings_payload(project_settings), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _analysis_cache_key(spec_text: str, project_settings: Dict[str, Any]) -> str:
+    """Cache key from the content hash, the settings used by the prompt, the model and prompt version"""
+    key_payload = json.dumps({
+        "content": hashlib.sha256(spec_text.encode("utf-8")).hexdigest(),
+        **_analysis_settings_payload(project_settings),
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(key_payload.encode("utf-8")).hexdigest()
+
+
+def clear_analysis_cache():
+    """Invalidate all cached spec analyses (e.g. after changing the analysis prompt)"""
+    with _analysis_cache_lock:
+        _analysis_cache.clear()
+
+
 def analyze_spec_with_ai(spec_text: str, project_settings: Dict[str, Any]) -> str:
     """
-    Use AI to analyze spec text and generate user story
+    Use AI to analyze spec text and generate user story.
+    Results are memoized per content/settings/model so repeated analysis costs no LLM call.
     """
+    cache_key = _analysis_cache_key(spec_text, project_settings)
+    with _analysis_cache_lock:
+        cached_story = _analysis_cache.get(cache_key)
+        if cached_story is not None:
+            _analysis_cache.move_to_end(cache_key)
+            return cached_story
+    
     try:
         from langchain_groq import ChatGroq
         from dotenv import load_dotenv
@@ -130,7 +514,7 @@ def analyze_spec_with_ai(spec_text: str, project_settings: Dict[str, Any]) -> st
         
         # Initialize Groq LLM for spec analysis
         analysis_llm = ChatGroq(
-            model="llama-3.1-8b-instant",
+            model=ANALYSIS_MODEL,
             temperature=0.3,  # Lower temperature for more focused analysis
             max_tokens=2000,
             timeout=None,
@@ -223,6 +607,13 @@ Focus on creating actionable, testable requirements that cover both positive and
 
 **Note:** This user story was automatically generated from your specification document. Please review and modify as needed before generating test cases."""
         
+        # Chỉ cache kết quả thành công (không cache nội dung dự phòng khi lỗi)
+        with _analysis_cache_lock:
+            _analysis_cache[cache_key] = formatted_story
+            _analysis_cache.move_to_end(cache_key)
+            while len(_analysis_cache) > ANALYSIS_CACHE_MAX_ENTRIES:
+                _analysis_cache.popitem(last=False)
+        
         return formatted_story
         
     except Exception as e:
@@ -251,6 +642,265 @@ Focus on creating actionable, testable requirements that cover both positive and
 
 **Manual Review Required:** Please review the specification content above and manually create a user story for test case generation."""
 
+# OCR preprocessing settings
+OCR_TARGET_DPI = 300
+OCR_MAX_DIMENSION = 2000
+OCR_CROP_MARGIN = 12
+# Đoạn mực thẳng dài từ chừng này pixel (sau downscale) là border / divider / kẻ bảng, không phải chữ
+OCR_RULE_MIN_LENGTH = 120
+# Dò vùng chữ theo lưới ô vuông OCR_TEXT_CELL px; khối nhỏ hơn OCR_MIN_TEXT_CELLS ô (chấm nhiễu, icon nhỏ) bị bỏ
+OCR_TEXT_CELL = 8
+OCR_MIN_TEXT_CELLS = 3
+# Mảng tô đặc (button, badge, thanh tiêu đề): mật độ mực trung bình trong bán kính OCR_FILLED_RADIUS px
+# từ OCR_FILLED_MIN_DENSITY trở lên (chữ, kể cả tiêu đề đậm, dưới 0.55); chữ sáng bên trong được đảo thành chữ tối
+OCR_FILLED_RADIUS = 10
+OCR_FILLED_MIN_DENSITY = 0.65
+# Phân loại ảnh trên bản thu nhỏ (NEAREST, không sinh màu trung gian):
+# - photo: ít pixel trùng màu pixel bên cạnh (nhiễu, gradient)
+# - screenshot: có màu nhấn (button, badge, link) hoặc nhiều đường viền khung thẳng
+IMAGE_CLASS_SAMPLE_SIZE = 512
+PHOTO_MAX_FLAT_RATIO = 0.5
+SCREENSHOT_MIN_CHROMATIC_RATIO = 0.005
+SCREENSHOT_MIN_RULES = 4
+# Page segmentation mode theo từng loại ảnh:
+# - screenshot: text rời rạc (button, label, menu) → psm 11 (sparse text)
+# - document: ảnh chụp/scan trang tài liệu → psm 6 (uniform block of text)
+# - photo: ảnh nhiều màu, bố cục không rõ → psm 3 (fully automatic)
+OCR_PSM_BY_CLASS = {
+    "screenshot": 11,
+    "document": 6,
+    "photo": 3,
+}
+
+
+def _otsu_threshold(histogram: List[int]) -> int:
+    """
+    Compute Otsu binarization threshold from a 256-bin grayscale histogram.
+    """
+    total = sum(histogram)
+    if not total:
+        return 128
+    
+    sum_all = sum(i * count for i, count in enumerate(histogram))
+    sum_background = 0.0
+    weight_background = 0
+    best_threshold = 128
+    best_variance = 0.0
+    for i, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += i * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_variance = variance
+            best_threshold = i
+    return best_threshold
+
+
+def _shift(image: Image.Image, dx: int, dy: int) -> Image.Image:
+    """Pixel (x, y) lấy giá trị tại (x + dx, y + dy); ngoài biên là 0"""
+    return image.crop((dx, dy, image.width + dx, image.height + dy))
+
+
+def _horizontal_runs(mask: Image.Image, length: int) -> Image.Image:
+    """Pixel của mask (L, 255 = bật) nằm trên một đoạn ngang liên tục dài ít nhất length pixel bật"""
+    # Co (erosion) theo cấp số nhân: starts(x) bật khi cả x..x+length-1 đều bật
+    starts, span = mask, 1
+    while span * 2 <= length:
+        starts = ImageChops.darker(starts, _shift(starts, span, 0))
+        span *= 2
+    if span < length:
+        starts = ImageChops.darker(starts, _shift(starts, length - span, 0))
+    # Giãn lại để phủ toàn bộ đoạn
+    runs, span = starts, 1
+    while span * 2 <= length:
+        runs = ImageChops.lighter(runs, _shift(runs, -span, 0))
+        span *= 2
+    if span < length:
+        runs = ImageChops.lighter(runs, _shift(runs, -(length - span), 0))
+    return runs
+
+
+def _rules(mask: Image.Image, length: int) -> Tuple[Image.Image, Image.Image]:
+    """(đoạn ngang, đoạn dọc) dài ít nhất length pixel của mask"""
+    vertical = _horizontal_runs(mask.transpose(Image.TRANSPOSE), length).transpose(Image.TRANSPOSE)
+    return _horizontal_runs(mask, length), vertical
+
+
+def _count_lit_rows(mask: Image.Image) -> int:
+    """Số dòng của mask có ít nhất một pixel bật"""
+    rows = mask.resize((1, mask.height), Image.BOX)
+    return mask.height - rows.histogram()[0]
+
+
+def _classify_image(image: Image.Image) -> str:
+    """
+    Roughly classify an image as "screenshot", "document" or "photo" to pick OCR settings.
+    """
+    sample = image.convert("RGB")
+    sample.thumbnail((IMAGE_CLASS_SAMPLE_SIZE, IMAGE_CLASS_SAMPLE_SIZE), Image.NEAREST)
+    pixel_count = sample.width * sample.height or 1
+    
+    def same_color(shifted):
+        return ImageChops.difference(sample, shifted).convert("L").point(lambda level: 255 if level == 0 else 0)
+    
+    # Ảnh chụp thực tế: nhiễu, gradient → hiếm pixel trùng màu pixel bên cạnh; screenshot / tài liệu có mảng phẳng lớn
+    same_as_right = same_color(_shift(sample, 1, 0))
+    if same_as_right.histogram()[255] / pixel_count < PHOTO_MAX_FLAT_RATIO:
+        return "photo"
+    
+    # Screenshot: có màu nhấn (button, badge, link); trang tài liệu gần như chỉ đen trắng
+    _, saturation, value = sample.convert("HSV").split()
+    chromatic = ImageChops.darker(saturation.point(lambda level: 255 if level > 64 else 0),
+                                  value.point(lambda level: 255 if level > 64 else 0))
+    if chromatic.histogram()[255] / pixel_count >= SCREENSHOT_MIN_CHROMATIC_RATIO:
+        return "screenshot"
+    
+    # ... hoặc nhiều đường viền khung: đoạn thẳng dài cùng một màu khác màu nền
+    background = max(sample.getcolors(pixel_count))[1]
+    foreground = ImageChops.difference(sample, Image.new("RGB", sample.size, background)).convert("L")
+    foreground = foreground.point(lambda level: 255 if level else 0)
+    rule_length = max(sample.size) // 8
+    horizontal = _horizontal_runs(ImageChops.darker(same_as_right, foreground), rule_length)
+    same_as_below = same_color(_shift(sample, 0, 1))
+    vertical = _horizontal_runs(ImageChops.darker(same_as_below, foreground).transpose(Image.TRANSPOSE), rule_length)
+    if _count_lit_rows(horizontal) + _count_lit_rows(vertical) >= SCREENSHOT_MIN_RULES:
+        return "screenshot"
+    return "document"
+
+
+def _isolate_text_regions(binary: Image.Image) -> Tuple[Image.Image, Optional[Tuple[int, int, int, int]]]:
+    """
+    Giữ lại vùng chữ của ảnh đã nhị phân hóa (chữ đen 0 trên nền trắng 255):
+    - mảng tô đặc (button, badge, khung / bóng đổ cửa sổ): chỉ giữ chữ sáng bên trong, đảo thành chữ tối
+    - bỏ đoạn kẻ thẳng dài (border, divider, kẻ bảng)
+    - gom pixel mực thành khối trên lưới OCR_TEXT_CELL px (nối các ký tự kề nhau thành từ / dòng),
+      bỏ khối nhỏ (chấm nhiễu, icon nhỏ)
+    Trả về ảnh chỉ còn các khối chữ và bbox của chúng (None nếu không tìm thấy chữ).
+    """
+    from PIL import ImageFilter, ImageOps
+    
+    ink = ImageOps.invert(binary)
+    
+    # Mảng tô đặc: vùng mật độ mực cao (giãn ra OCR_FILLED_RADIUS), trong hình dạng mực đã lấp lỗ chữ (closing)
+    dense = ink.filter(ImageFilter.BoxBlur(OCR_FILLED_RADIUS))
+    dense = dense.point(lambda level: 255 if level >= OCR_FILLED_MIN_DENSITY * 255 else 0)
+    if dense.getbbox():
+        region, shape = dense, ink
+        for _ in range(OCR_FILLED_RADIUS):
+            region = region.filter(ImageFilter.MaxFilter(3))
+        for size_filter in (ImageFilter.MaxFilter, ImageFilter.MaxFilter, ImageFilter.MinFilter, ImageFilter.MinFilter):
+            shape = shape.filter(size_filter(3))
+        filled = ImageChops.darker(region, shape)
+        labels = ImageChops.subtract(filled, ink)
+        ink = ImageChops.lighter(ImageChops.subtract(ink, filled), labels)
+    
+    horizontal, vertical = _rules(ink, OCR_RULE_MIN_LENGTH)
+    ink = ImageChops.subtract(ink, ImageChops.lighter(horizontal, vertical))
+    
+    cell = OCR_TEXT_CELL
+    columns, rows = -(-ink.width // cell), -(-ink.height // cell)
+    padded = Image.new("L", (columns * cell, rows * cell), 0)
+    padded.paste(ink, (0, 0))
+    grid = padded.resize((columns, rows), Image.BOX).point(lambda level: 255 if level else 0)
+    grid = grid.filter(ImageFilter.MaxFilter(3))
+    
+    cells = grid.load()
+    keep = Image.new("L", grid.size, 0)
+    kept = keep.load()
+    seen = set()
+    for start_y in range(rows):
+        for start_x in range(columns):
+            if not cells[start_x, start_y] or (start_x, start_y) in seen:
+                continue
+            # Khối liên thông (4 hướng) chứa ô này
+            component = [(start_x, start_y)]
+            seen.add((start_x, start_y))
+            for x, y in component:
+                for neighbor in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                    nx, ny = neighbor
+                    if 0 <= nx < columns and 0 <= ny < rows and cells[nx, ny] and neighbor not in seen:
+                        seen.add(neighbor)
+                        component.append(neighbor)
+            if len(component) >= OCR_MIN_TEXT_CELLS:
+                for x, y in component:
+                    kept[x, y] = 255
+    
+    keep = keep.resize(padded.size, Image.NEAREST).crop((0, 0, ink.width, ink.height))
+    text = ImageChops.darker(ink, keep)
+    return ImageOps.invert(text), text.getbbox()
+
+
+def _preprocess_image_for_ocr(image: Image.Image) -> Tuple[Image.Image, str]:
+    """
+    Prepare an image for Tesseract: grayscale, DPI-aware downscaling, binarization
+    and cropping to the detected text region.
+    
+    Returns the processed image and the Tesseract config string for its image class.
+    """
+    from PIL import ImageOps
+    
+    image_class = _classify_image(image)
+    
+    dpi_info = image.info.get("dpi")
+    source_dpi = float(dpi_info[0]) if dpi_info and dpi_info[0] else 0.0
+    
+    processed = ImageOps.exif_transpose(image).convert("L")
+    
+    # Downscale: giới hạn cạnh dài nhất và không vượt quá OCR_TARGET_DPI (ảnh Retina 144+ DPI)
+    scale = min(1.0, OCR_MAX_DIMENSION / max(processed.size))
+    if source_dpi > OCR_TARGET_DPI:
+        scale = min(scale, OCR_TARGET_DPI / source_dpi)
+    if scale < 1.0:
+        new_size = (max(1, int(processed.width * scale)), max(1, int(processed.height * scale)))
+        processed = processed.resize(new_size, Image.LANCZOS)
+    effective_dpi = int(source_dpi * scale) if source_dpi else OCR_TARGET_DPI
+    
+    if image_class != "photo":
+        histogram = processed.histogram()
+        # Giao diện dark mode: đảo màu để chữ tối trên nền sáng
+        pixel_count = sum(histogram) or 1
+        mean_level = sum(i * count for i, count in enumerate(histogram)) / pixel_count
+        if mean_level < 128:
+            processed = ImageOps.invert(processed)
+            histogram = processed.histogram()
+        threshold = _otsu_threshold(histogram)
+        processed = processed.point(lambda level: 255 if level > threshold else 0)
+        
+        # Chỉ giữ vùng chữ (bỏ border, icon, chấm nhiễu) rồi cắt theo vùng đó
+        processed, text_box = _isolate_text_regions(processed)
+        if text_box:
+            left, top, right, bottom = text_box
+            processed = processed.crop((
+                max(0, left - OCR_CROP_MARGIN),
+                max(0, top - OCR_CROP_MARGIN),
+                min(processed.width, right + OCR_CROP_MARGIN),
+                min(processed.height, bottom + OCR_CROP_MARGIN),
+            ))
+    
+    config = f"--oem 3 --psm {OCR_PSM_BY_CLASS[image_class]} --dpi {max(70, effective_dpi)}"
+    return processed, config
+
+
+def _ocr_image(image_content: bytes, preprocess: bool = True) -> str:
+    """
+    Run Tesseract on raw image bytes, optionally through the preprocessing stage.
+    """
+    import pytesseract
+    
+    with Image.open(io.BytesIO(image_content)) as image_data:
+        if not preprocess:
+            return pytesseract.image_to_string(image_data)
+        processed, config = _preprocess_image_for_ocr(image_data)
+        return pytesseract.image_to_string(processed, config=config)
+
+
 def extract_text_from_images(image_files: Optional[List[Dict[str, Any]]]) -> str:
     """
     Extract text content from uploaded screenshots using OCR
@@ -290,9 +940,7 @@ def extract_text_from_images(image_files: Optional[List[Dict[str, Any]]]) -> str
     
     for image in image_files:
         try:
-            image_data = Image.open(io.BytesIO(image["content"]))
-            ocr_text = pytesseract.image_to_string(image_data)
-            image_data.close()
+            ocr_text = _ocr_image(image["content"])
             cleaned_text = ocr_text.strip()
             if cleaned_text:
                 extracted_segments.append(f"Screenshot ({image.get('name', 'Unnamed')}):\n{cleaned_text}")
@@ -304,19 +952,108 @@ def extract_text_from_images(image_files: Optional[List[Dict[str, Any]]]) -> str
     return "\n\n".join(extracted_segments)
 
 
+# Spec version storage (fingerprint từng phần của spec theo project)
+SPEC_VERSIONS_FILE = os.path.join(os.getcwd(), "spec_versions.json")
+SPEC_VERSION_HISTORY_LIMIT = 10
+# Nếu phần thay đổi chiếm hơn tỉ lệ này của spec thì phân tích lại toàn bộ thay vì merge
+SPEC_FULL_REANALYSIS_RATIO = 0.5
+
+
+def load_spec_versions(project_id: int) -> List[Dict[str, Any]]:
+    """Load stored spec versions (oldest first) for a project"""
+    try:
+        if not os.path.exists(SPEC_VERSIONS_FILE):
+            return []
+        with open(SPEC_VERSIONS_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+            if isinstance(data, dict):
+                return data.get(str(project_id), [])
+            return []
+    except Exception:
+        return []
+
+
+def save_spec_version(project_id: int, version: Dict[str, Any]):
+    """Append a spec version for a project, keeping the last SPEC_VERSION_HISTORY_LIMIT versions"""
+    try:
+        existing_data = {}
+        if os.path.exists(SPEC_VERSIONS_FILE):
+            with open(SPEC_VERSIONS_FILE, "r", encoding="utf-8") as f:
+                existing_data = json.load(f)
+        
+        versions = existing_data.get(str(project_id), [])
+        versions.append(version)
+        existing_data[str(project_id)] = versions[-SPEC_VERSION_HISTORY_LIMIT:]
+        
+        with open(SPEC_VERSIONS_FILE, "w", encoding="utf-8") as f:
+            json.dump(existing_data, f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        st.error(f"Lỗi khi lưu phiên bản spec: {e}")
+
+
+def _section_fingerprint(section: Dict[str, str]) -> str:
+    """Stable fingerprint of a spec section (case and whitespace insensitive)"""
+    normalized = " ".join((section["heading"] + "\n" + section["text"]).lower().split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def _is_fallback_analysis(user_story: str) -> bool:
+    """True if analyze_spec_with_ai returned its error fallback instead of an AI analysis"""
+    return user_story.startswith(("# Phân Tích Đặc Tả (Dự phòng)", "# Specification Analysis (Fallback)"))
+
+
+def _merge_user_story(previous_story: str, delta_story: str, removed_headings: List[str], version_number: int, is_vietnamese: bool) -> str:
+    """
+    Merge the analysis of changed sections into the previous user story.
+    The update block is inserted before the footer ("---") so the UI keeps it.
+    """
+    # Chỉ lấy phần nội dung phân tích (bỏ tiêu đề và footer) của lần phân tích phần thay đổi
+    delta_body = delta_story.split("\n---", 1)[0]
+    delta_lines = delta_body.strip().split("\n")
+    if delta_lines and delta_lines[0].startswith("# "):
+        delta_lines = delta_lines[1:]
+    delta_body = "\n".join(delta_lines).strip()
+    
+    if is_vietnamese:
+        update_block = f"## Cập Nhật Từ Phiên Bản Đặc Tả Mới (v{version_number})\n\n{delta_body}"
+        if removed_headings:
+            update_block += "\n\n**Các phần đã bị xóa khỏi đặc tả:**\n" + "\n".join(f"- {heading}" for heading in removed_headings)
+    else:
+        update_block = f"## Updates From Specification Version {version_number}\n\n{delta_body}"
+        if removed_headings:
+            update_block += "\n\n**Sections removed from the specification:**\n" + "\n".join(f"- {heading}" for heading in removed_headings)
+    
+    if "\n---" in previous_story:
+        story_body, footer = previous_story.split("\n---", 1)
+        return f"{story_body.rstrip()}\n\n{update_block}\n\n---{footer}"
+    return f"{previous_story.rstrip()}\n\n{update_block}"
+
+
 def process_uploaded_spec(
     file_content: Optional[bytes],
     file_type: Optional[str],
     project_settings: Dict[str, Any],
     image_files: Optional[List[Dict[str, Any]]] = None,
-    file_name: Optional[str] = None
+    file_name: Optional[str] = None,
+    project_id: Optional[int] = None
 ) -> str:
     """
-    Main function to process uploaded spec file and return user story
+    Main function to process uploaded spec file and return user story.
+    
+    When project_id is given, each upload is stored as a spec version with section
+    fingerprints; a new version only sends changed/added sections to the AI and
+    merges the result into the previous user story. The stored story is only reused
+    (or merged into) when it was produced with the same analysis settings
+    (languages, testing types, writing style, model, prompt version).
     """
     # Extract text from document file
     normalized_type = _normalize_file_type(file_type, file_name)
-    spec_text = extract_text_from_file(file_content, normalized_type, file_name)
+    spec_text = extract_text_from_file(
+        file_content,
+        normalized_type,
+        file_name,
+        max_chars=MODEL_MAX_TOKENS * APPROX_CHARS_PER_TOKEN * SPEC_CANDIDATE_FACTOR
+    )
     if spec_text == "Unsupported file type":
         st.error("Định dạng tài liệu không được hỗ trợ. Vui lòng chọn các định dạng được liệt kê.")
         spec_text = ""
@@ -335,9 +1072,82 @@ def process_uploaded_spec(
         return "Could not extract content from the uploaded files. Please provide supported documents or clearer screenshots."
     
     combined_content = "\n\n".join(content_sections)
-    combined_content = _truncate_text_for_model(combined_content)
     
-    # Analyze with AI
-    user_story = analyze_spec_with_ai(combined_content, project_settings)
+    if not project_id:
+        # Analyze with AI
+        return analyze_spec_with_ai(select_relevant_content(combined_content, project_settings), project_settings)
+    
+    sections = _split_spec_into_sections(combined_content)
+    fingerprints = [_section_fingerprint(section) for section in sections]
+    
+    previous_versions = load_spec_versions(project_id)
+    previous = previous_versions[-1] if previous_versions else None
+    version_number = (previous.get("version", 0) if previous else 0) + 1
+    settings_fingerprint = analysis_settings_fingerprint(project_settings)
+    
+    user_story = None
+    if previous and previous.get("user_story") and previous.get("analysis_settings") != settings_fingerprint:
+        st.info("ℹ️ Cài đặt phân tích đã thay đổi so với phiên bản trước - phân tích lại toàn bộ đặc tả.")
+    elif previous and previous.get("user_story"):
+        previous_fingerprints = {item["fingerprint"] for item in previous.get("sections", [])}
+        current_fingerprints = set(fingerprints)
+        changed_sections = [
+            section for section, fingerprint in zip(sections, fingerprints)
+            if fingerprint not in previous_fingerprints
+        ]
+        current_headings = {section["heading"] for section in sections}
+        removed_sections = [item for item in previous.get("sections", []) if item["fingerprint"] not in current_fingerprints]
+        removed_headings = []
+        for item in removed_sections:
+            heading = item.get("heading")
+            if heading and heading not in current_headings and heading not in removed_headings:
+                removed_headings.append(heading)
+        
+        if not changed_sections and not removed_sections:
+            st.info("ℹ️ Đặc tả không thay đổi so với phiên bản trước - dùng lại kết quả phân tích đã lưu.")
+            return previous["user_story"]
+        
+        changed_chars = sum(len(section["text"]) for section in changed_sections)
+        total_chars = sum(len(section["text"]) for section in sections) or 1
+        if changed_chars / total_chars <= SPEC_FULL_REANALYSIS_RATIO:
+            st.info(f"ℹ️ Chỉ phân tích lại {len(changed_sections)}/{len(sections)} phần đã thay đổi so với phiên bản trước.")
+            delta_lines = []
+            last_heading = None
+            for section in changed_sections:
+                if section["heading"] and section["heading"] != last_heading:
+                    delta_lines.append(section["heading"])
+                last_heading = section["heading"]
+                delta_lines.append(section["text"])
+            
+            delta_story = ""
+            if delta_lines:
+                delta_story = analyze_spec_with_ai(
+                    select_relevant_content("\n".join(delta_lines), project_settings),
+                    project_settings
+                )
+                if _is_fallback_analysis(delta_story):
+                    return delta_story
+            
+            languages = project_settings.get('languages', [])
+            is_vietnamese = "Vietnamese" in languages or "Tiếng Việt" in languages
+            user_story = _merge_user_story(previous["user_story"], delta_story, removed_headings, version_number, is_vietnamese)
+    
+    if user_story is None:
+        # Analyze with AI
+        user_story = analyze_spec_with_ai(select_relevant_content(combined_content, project_settings), project_settings)
+        if _is_fallback_analysis(user_story):
+            return user_story
+    
+    save_spec_version(project_id, {
+        "version": version_number,
+        "file_name": file_name,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "analysis_settings": settings_fingerprint,
+        "sections": [
+            {"fingerprint": fingerprint, "heading": section["heading"]}
+            for section, fingerprint in zip(sections, fingerprints)
+        ],
+        "user_story": user_story,
+    })
     
     return user_story
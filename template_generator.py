@@ -0,0 +1,506 @@
+# template_generator.py - Sinh template TPL_TestResult cho N environment từ một template gốc (1 environment)
+#
+# Template gốc có đúng một "bản" cho mỗi vùng phụ thuộc environment:
+# - Report: dòng Environment của General statistic, Round 1/2 statistic và Round 1/2 in detail
+# - Module: dòng tổng hợp (dòng 3) và nhóm cột kết quả (env, Tester, Date) của Round 1/2 trong bảng test case
+# Mỗi vùng được nhân thành N bản, các ô phía sau dời xuống / sang phải, và mọi tham chiếu trong công thức,
+# merged cells, data validation, conditional formatting được ánh xạ lại theo cùng layout.
+# Khi test cases có module: sheet Module gốc được nhân thành một sheet cho mỗi module, và dòng chi tiết
+# của Report (Round 1/2 in detail) thành một nhóm N dòng cho mỗi module, trỏ tới sheet của module đó.
+# File sinh ra được cache trên đĩa theo N và danh sách module (sinh lại khi template gốc thay đổi).
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from copy import copy, deepcopy
+
+from openpyxl import load_workbook
+from openpyxl.cell.cell import MergedCell
+from openpyxl.formula.tokenizer import Token, Tokenizer
+from openpyxl.formatting.formatting import ConditionalFormattingList
+from openpyxl.utils import column_index_from_string, get_column_letter, quote_sheetname
+from openpyxl.worksheet.cell_range import MultiCellRange
+
+BASE_TEMPLATE_PATH = "TPL_TestResult_v1.0_1En.xlsm"
+GENERATED_TEMPLATE_DIR = "generated_templates"
+# Tăng khi thay đổi layout / cách sinh để bỏ cache cũ
+TEMPLATE_GENERATOR_VERSION = 2
+
+# Vùng phụ thuộc environment trong template gốc
+# - replicated_rows: dòng nhân N lần; 'columns' = các cột được nhân, 'merge_columns' = các cột chỉ giữ
+#   giá trị ở bản đầu và merge dọc qua N dòng
+# - replicated_column_groups: nhóm cột nhân N lần (chỉ áp dụng từ table_start_row trở xuống)
+# - module_rows: dòng chi tiết theo module, nhân N × số module (mỗi module một nhóm N dòng);
+#   'module_number_column' là cột số thứ tự module (No)
+# - fixed_row_bound: tham chiếu từ dòng này trở xuống là cận "tới cuối bảng" (VD I7:I9999), giữ nguyên
+#   không dời theo các dòng được nhân (giống template làm tay 2En..7En)
+REPORT_SHEET_LAYOUT = {
+    'replicated_rows': [
+        {'row': 4, 'columns': 'C:Q'},
+        {'row': 10, 'columns': 'C:X'},
+        {'row': 16, 'columns': 'C:X'},
+        {'row': 22, 'columns': 'C:X', 'merge_columns': 'A:B'},
+        {'row': 27, 'columns': 'C:X', 'merge_columns': 'A:B'},
+    ],
+    'module_rows': [22, 27],
+    'module_number_column': 'A',
+}
+MODULE_SHEET_LAYOUT = {
+    'replicated_rows': [
+        {'row': 3, 'columns': 'F K:V', 'merge_columns': 'G:J'},
+    ],
+    'table_start_row': 5,
+    'replicated_column_groups': ['I:K', 'M:O'],
+    'fixed_row_bound': 9999,
+}
+
+# Sheet Module: tên module ghi ở B1
+MODULE_NAME_CELL = 'B1'
+# Excel: tên sheet tối đa 31 ký tự, không chứa các ký tự dưới đây
+_SHEET_TITLE_MAX_LENGTH = 31
+_INVALID_SHEET_TITLE_CHARS = re.compile(r"[\[\]:*?/\\]")
+_RESERVED_SHEET_TITLES = ('cover', 'report', 'history')
+# Số template theo danh sách module giữ trong cache trên đĩa (bản cũ nhất bị xóa)
+GENERATED_MODULE_TEMPLATE_LIMIT = 32
+
+_generate_lock = threading.Lock()
+_REFERENCE = re.compile(
+    r"^(?:(?P<sheet>'(?:[^']|'')+'|[^'!:]+)!)?"
+    r"(?P<col1>\$?[A-Z]{1,3})(?P<row1>\$?\d+)"
+    r"(?::(?P<col2>\$?[A-Z]{1,3})(?P<row2>\$?\d+))?$"
+)
+
+
+def _columns(spec):
+    """'F K:V' → {6, 11, 12, ..., 22}"""
+    columns = set()
+    for part in (spec or '').split():
+        first, _, last = part.partition(':')
+        columns.update(range(column_index_from_string(first), column_index_from_string(last or first) + 1))
+    return columns
+
+
+def module_sheet_titles(module_names):
+    """Tên sheet hợp lệ, không trùng (không phân biệt hoa thường) cho từng module, theo thứ tự"""
+    titles = []
+    used = set(_RESERVED_SHEET_TITLES)
+    for name in module_names:
+        base = _INVALID_SHEET_TITLE_CHARS.sub('_', str(name)).strip().strip("'").strip() or 'Module'
+        base = base[:_SHEET_TITLE_MAX_LENGTH]
+        title, number = base, 1
+        while title.lower() in used:
+            number += 1
+            suffix = f" ({number})"
+            title = base[:_SHEET_TITLE_MAX_LENGTH - len(suffix)] + suffix
+        used.add(title.lower())
+        titles.append(title)
+    return titles
+
+
+class _SheetLayout:
+    """
+    Ánh xạ toạ độ template gốc → template N environment, k = chỉ số bản của vùng nhân bản
+    (0..N-1; dòng module_rows: k = module × N + environment)
+    """
+
+    def __init__(self, spec, num_environments, num_modules=1):
+        self.n = num_environments
+        self.num_modules = num_modules
+        self.rows = {
+            item['row']: (_columns(item.get('columns')), _columns(item.get('merge_columns')))
+            for item in spec.get('replicated_rows', [])
+        }
+        self.module_rows = set(spec.get('module_rows', [])) & set(self.rows)
+        self.module_number_column = (
+            column_index_from_string(spec['module_number_column']) if spec.get('module_number_column') else None
+        )
+        self.copies = {row: self.n * (num_modules if row in self.module_rows else 1) for row in self.rows}
+        self.table_start_row = spec.get('table_start_row')
+        self.fixed_row_bound = spec.get('fixed_row_bound')
+        self.groups = []
+        for group in spec.get('replicated_column_groups', []):
+            columns = _columns(group)
+            self.groups.append((min(columns), max(columns)))
+
+    def group(self, row, column):
+        """Vùng nhân bản chứa ô (row, column) của template gốc, None nếu ô chỉ có một bản"""
+        if row in self.rows and column in self.rows[row][0]:
+            return ('row', row)
+        if self.table_start_row and row >= self.table_start_row:
+            for index, (start, end) in enumerate(self.groups):
+                if start <= column <= end:
+                    return ('column', index)
+        return None
+
+    def group_copies(self, group):
+        """Số bản của một vùng nhân bản"""
+        return self.copies[group[1]] if group[0] == 'row' else self.n
+
+    def cell_copies(self, row, column):
+        """Các bản k của ô (row, column): cả vùng nhân bản; ô khác trên dòng module: bản đầu của mỗi module"""
+        group = self.group(row, column)
+        if group:
+            return range(self.group_copies(group))
+        if row in self.module_rows:
+            return range(0, self.copies[row], self.n)
+        return [0]
+
+    def row(self, row, k=0):
+        if self.fixed_row_bound and row >= self.fixed_row_bound:
+            return row
+        shift = sum(self.copies[replicated] - 1 for replicated in self.rows if replicated < row)
+        return row + shift + (k if row in self.rows else 0)
+
+    def column(self, column, row, k=0):
+        if not self.table_start_row or row < self.table_start_row:
+            return column
+        new_column = column
+        for start, end in self.groups:
+            width = end - start + 1
+            if column > end:
+                new_column += (self.n - 1) * width
+            elif column >= start:
+                new_column += k * width
+        return new_column
+
+    def point(self, row, column, k=0):
+        return self.row(row, k), self.column(column, row, k)
+
+    def cell_point(self, row, column, k):
+        """Ô đơn: chỉ ô thuộc vùng nhân bản mới lấy theo k"""
+        return self.point(row, column, (k or 0) if self.group(row, column) else 0)
+
+    def map_range(self, row1, column1, row2, column2, k=None):
+        """
+        Một range → danh sách range mới.
+        - Range nằm trong một vùng nhân bản và "dọc theo" hướng nhân bản (VD C22:C22 với dòng 22 được nhân)
+          → mở rộng qua cả N bản
+        - Range vuông góc với hướng nhân bản (VD cột I7:I999 với nhóm cột I:K) → một range cho mỗi bản
+          (chỉ bản k nếu có k)
+        - Còn lại: đầu range theo bản đầu, cuối range theo bản cuối (range chứa vùng nhân bản sẽ giãn ra)
+        """
+        group1, group2 = self.group(row1, column1), self.group(row2, column2)
+        if group1 and group1 == group2:
+            across = column1 != column2 if group1[0] == 'row' else row1 != row2
+            if not across:
+                return [(self.point(row1, column1, 0), self.point(row2, column2, self.group_copies(group1) - 1))]
+            ks = [k] if k is not None else range(self.group_copies(group1))
+            return [(self.point(row1, column1, kk), self.point(row2, column2, kk)) for kk in ks]
+        start_k = (k or 0) if group1 else 0
+        end_k = (self.group_copies(group2) - 1 if k is None else k) if group2 else 0
+        return [(self.point(row1, column1, start_k), self.point(row2, column2, end_k))]
+
+    def map_merge(self, row1, column1, row2, column2):
+        """Merged range: nằm gọn trong một vùng nhân bản → nhân theo từng bản, ngược lại giãn qua mọi bản"""
+        group1, group2 = self.group(row1, column1), self.group(row2, column2)
+        if group1 and group1 == group2:
+            return [(self.point(row1, column1, k), self.point(row2, column2, k)) for k in range(self.group_copies(group1))]
+        end_k = self.group_copies(group2) - 1 if group2 else self.n - 1
+        return [(self.point(row1, column1, 0), self.point(row2, column2, end_k))]
+
+
+def _map_sqref(layout, cell_range):
+    """Range của data validation / conditional formatting; ô đơn thuộc vùng nhân bản → một ô cho mỗi bản"""
+    group = layout.group(cell_range.min_row, cell_range.min_col)
+    if cell_range.size == {'rows': 1, 'columns': 1} and group:
+        return [(point, point) for point in
+                (layout.point(cell_range.min_row, cell_range.min_col, k) for k in range(layout.group_copies(group)))]
+    return layout.map_range(cell_range.min_row, cell_range.min_col, cell_range.max_row, cell_range.max_col)
+
+
+def _range_string(start, end):
+    first = f"{get_column_letter(start[1])}{start[0]}"
+    last = f"{get_column_letter(end[1])}{end[0]}"
+    return first if first == last else f"{first}:{last}"
+
+
+def _map_reference(reference, sheet_title, layouts, k, sheet_renames=None):
+    match = _REFERENCE.match(reference)
+    if not match:
+        return reference  # Tên (defined name), cả cột/dòng... giữ nguyên
+    sheet = match.group('sheet')
+    target = sheet.strip("'").replace("''", "'") if sheet else sheet_title
+    layout = layouts.get(target)
+    if layout is None:
+        return reference
+    if sheet and sheet_renames and target in sheet_renames:
+        sheet = quote_sheetname(sheet_renames[target])
+
+    def parse(column, row):
+        return int(row.lstrip('$')), column_index_from_string(column.lstrip('$'))
+
+    def render(column_text, row_text, point):
+        column_abs = '$' if column_text.startswith('$') else ''
+        row_abs = '$' if row_text.startswith('$') else ''
+        return f"{column_abs}{get_column_letter(point[1])}{row_abs}{point[0]}"
+
+    prefix = f"{sheet}!" if sheet else ''
+    row1, column1 = parse(match.group('col1'), match.group('row1'))
+    if match.group('col2') is None:
+        point = layout.cell_point(row1, column1, k)
+        return prefix + render(match.group('col1'), match.group('row1'), point)
+    row2, column2 = parse(match.group('col2'), match.group('row2'))
+    # Công thức chỉ chứa được một range: ô không thuộc vùng nhân bản lấy bản đầu
+    start, end = layout.map_range(row1, column1, row2, column2, k)[0]
+    return (prefix + render(match.group('col1'), match.group('row1'), start) + ':' +
+            render(match.group('col2'), match.group('row2'), end))
+
+
+def map_formula(formula, sheet_title, layouts, k=None, sheet_renames=None):
+    """
+    Ánh xạ mọi tham chiếu ô / range trong công thức theo layout của sheet được tham chiếu.
+    sheet_renames: {tên sheet trong template gốc: tên mới} cho tham chiếu sang sheet khác.
+    """
+    tokenizer = Tokenizer(formula)
+    for token in tokenizer.items:
+        if token.type == Token.OPERAND and token.subtype == Token.RANGE:
+            token.value = _map_reference(token.value, sheet_title, layouts, k, sheet_renames)
+    return tokenizer.render()
+
+
+def _copy_style(source, target):
+    """
+    Copy style của ô trong cùng workbook.
+    Dùng cell._style (mảng chỉ số font/fill/border/... vào bảng style của workbook) như
+    openpyxl.worksheet.copier.WorksheetCopy: gán qua cell.font, cell.border... phải copy rồi hash lại
+    từng object style vào bảng style, chậm hơn 5-10 lần với vài nghìn ô của template nhiều module.
+    """
+    target._style = copy(source._style)
+
+
+def _copy_cell(ws, source, row, column, value):
+    target = ws.cell(row=row, column=column, value=value)
+    if source.comment:
+        target.comment = copy(source.comment)
+    _copy_style(source, target)
+    return target
+
+
+def _expand_sheet(ws, layout, layouts, sheet_renames=None, module_sheets=None):
+    """
+    Dựng lại sheet theo layout: cells, merged cells, kích thước dòng/cột, data validation, conditional formatting.
+    module_sheets: tên sheet gốc + tên sheet của từng module; bản của module m trên dòng module_rows
+    trỏ tới sheet module_sheets[1][m] (công thức ánh xạ theo chỉ số environment k % N).
+    """
+    n = layout.n
+    # Ô trống không style thì bỏ qua; MergedCell luôn giữ để lấy lại style khi merge
+    base_cells = [
+        cell for cells in ws.iter_rows() for cell in cells
+        if isinstance(cell, MergedCell) or cell.has_style or cell.value is not None or cell.comment
+    ]
+    base_merges = [(r.min_row, r.min_col, r.max_row, r.max_col) for r in ws.merged_cells.ranges]
+    for merged_range in list(ws.merged_cells.ranges):
+        ws.unmerge_cells(merged_range.coord)
+    ws.delete_rows(1, ws.max_row)
+
+    # Merge trước khi ghi ô: ô đầu range còn trống nên MergedCellRange.format() không phải chép border
+    merges = []
+    for merge in base_merges:
+        merges.extend(layout.map_merge(*merge))
+    for row, (_, merge_columns) in layout.rows.items():
+        for column in (merge_columns if n > 1 else ()):
+            # Dòng module: merge theo nhóm N dòng của từng module
+            for first in range(0, layout.copies[row], n):
+                merges.append((layout.point(row, column, first), layout.point(row, column, first + n - 1)))
+    merge_starts = {}
+    for start, end in merges:
+        ws.merge_cells(_range_string(start, end))
+        for row in range(start[0], end[0] + 1):
+            for column in range(start[1], end[1] + 1):
+                if (row, column) != start:
+                    merge_starts[(row, column)] = start
+
+    written = {}
+    merged_sources = {}
+    for source in base_cells:
+        row, column = source.row, source.column
+        group = layout.group(row, column)
+        for k in layout.cell_copies(row, column):
+            point = layout.point(row, column, k)
+            if point in merge_starts:
+                # MergedCell của template gốc được ưu tiên hơn ô thường rơi vào vùng merge
+                if isinstance(source, MergedCell) or point not in merged_sources:
+                    merged_sources[point] = source
+                continue
+            if isinstance(source, MergedCell):
+                continue
+            value = source.value
+            renames = sheet_renames
+            formula_k = k if group else None
+            if row in layout.module_rows and module_sheets:
+                module = k // n
+                renames = {**(sheet_renames or {}), module_sheets[0]: module_sheets[1][module]}
+                formula_k = k % n if group else None
+                if column == layout.module_number_column and isinstance(value, (int, float)):
+                    value = value + module
+            if isinstance(value, str) and source.data_type == 'f':
+                value = map_formula(value, ws.title, layouts, formula_k, renames)
+            written[point] = _copy_cell(ws, source, *point, value)
+
+    # Ô trong vùng merge giữ style của ô tương ứng trong template gốc;
+    # ô mới (VD G4 khi merge G3:G4) lấy style của ô cùng cột ở dòng đầu
+    for (row, column), start in merge_starts.items():
+        template = merged_sources.get((row, column)) or written.get((start[0], column))
+        if template is not None:
+            _copy_style(template, ws.cell(row=row, column=column))
+
+    base_rows = dict(ws.row_dimensions)
+    ws.row_dimensions.clear()
+    for row, dimension in base_rows.items():
+        for k in (range(layout.copies[row]) if row in layout.rows else [0]):
+            new_dimension = copy(dimension)
+            new_dimension.index = layout.row(row, k)
+            ws.row_dimensions[new_dimension.index] = new_dimension
+
+    if layout.groups:
+        base_columns = list(ws.column_dimensions.values())
+        ws.column_dimensions.clear()
+        for dimension in base_columns:
+            for column in range(dimension.min, dimension.max + 1):
+                group = layout.group(layout.table_start_row, column)
+                for k in (range(n) if group else [0]):
+                    new_column = layout.column(column, layout.table_start_row, k)
+                    new_dimension = copy(dimension)
+                    new_dimension.index = get_column_letter(new_column)
+                    new_dimension.min = new_dimension.max = new_column
+                    ws.column_dimensions[new_dimension.index] = new_dimension
+
+    for validation in ws.data_validations.dataValidation:
+        ranges = []
+        for cell_range in validation.sqref.ranges:
+            for start, end in _map_sqref(layout, cell_range):
+                ranges.append(_range_string(start, end))
+        validation.sqref = MultiCellRange(' '.join(ranges))
+
+    conditional_formatting = ConditionalFormattingList()
+    for formatting in ws.conditional_formatting:
+        for cell_range in formatting.sqref.ranges:
+            old_letter = get_column_letter(cell_range.min_col)
+            for start, end in _map_sqref(layout, cell_range):
+                new_letter = get_column_letter(start[1])
+                for rule in formatting.rules:
+                    new_rule = copy(rule)
+                    # Rule của template dùng INDIRECT("I"&ROW()) - đổi chữ cột theo range mới
+                    new_rule.formula = [
+                        formula.replace(f'"{old_letter}"&', f'"{new_letter}"&') for formula in (rule.formula or [])
+                    ]
+                    conditional_formatting.add(_range_string(start, end), new_rule)
+    ws.conditional_formatting = conditional_formatting
+
+
+def _copy_module_sheet(wb, source, title):
+    """Bản copy của sheet Module gốc (copy_worksheet + data validation, conditional formatting, view)"""
+    target = wb.copy_worksheet(source)
+    target.title = title
+    target.data_validations = deepcopy(source.data_validations)
+    for formatting in source.conditional_formatting:
+        for rule in formatting.rules:
+            target.conditional_formatting.add(str(formatting.sqref), copy(rule))
+    target.views = deepcopy(source.views)
+    target.views.sheetView[0].tabSelected = False
+    target.freeze_panes = source.freeze_panes
+    # codeName phải duy nhất trong project VBA
+    used = {ws.sheet_properties.codeName for ws in wb.worksheets if ws is not target}
+    number = len(wb.worksheets)
+    while f"Sheet{number}" in used:
+        number += 1
+    target.sheet_properties.codeName = f"Sheet{number}"
+    return target
+
+
+def generate_template(base_path, num_environments, output_path, module_names=None):
+    """
+    Sinh template N environment từ template gốc và lưu ra output_path (giữ VBA).
+    module_names: sheet Module gốc được nhân thành một sheet cho mỗi module (tên sheet theo
+    module_sheet_titles, ô B1 = tên module) và Report có một nhóm dòng chi tiết cho mỗi module.
+    """
+    wb = load_workbook(base_path, keep_vba=True)
+    module_names = list(module_names or [])
+    module_titles = module_sheet_titles(module_names)
+    base_module = next((ws for ws in wb.worksheets if ws.title not in ('Cover', 'Report')), None)
+    num_modules = len(module_titles) if module_titles and base_module is not None else 1
+
+    layouts = {}
+    for ws in wb.worksheets:
+        if ws.title == 'Report':
+            layouts[ws.title] = _SheetLayout(REPORT_SHEET_LAYOUT, num_environments, num_modules)
+        elif ws.title != 'Cover':
+            layouts[ws.title] = _SheetLayout(MODULE_SHEET_LAYOUT, num_environments)
+        else:
+            layouts[ws.title] = _SheetLayout({}, num_environments)
+
+    sheet_renames = None
+    module_sheets = None
+    if module_titles and base_module is not None:
+        base_title = base_module.title
+        module_sheets = (base_title, module_titles)
+        sheet_renames = {base_title: module_titles[0]}
+        module_layout = layouts[base_title]
+        for title in module_titles:
+            layouts.setdefault(title, module_layout)
+        position = wb.worksheets.index(base_module)
+        for offset, title in enumerate(module_titles[1:], 1):
+            copied = _copy_module_sheet(wb, base_module, title)
+            wb.move_sheet(copied, position + offset - wb.worksheets.index(copied))
+        base_module.title = module_titles[0]
+        for name, title in zip(module_names, module_titles):
+            wb[title][MODULE_NAME_CELL] = name
+
+    for ws in wb.worksheets:
+        _expand_sheet(ws, layouts[ws.title], layouts, sheet_renames, module_sheets)
+    wb.save(output_path)
+
+
+def _prune_module_templates(cache_dir, keep):
+    """Giữ tối đa keep template theo danh sách module (mới dùng nhất), xóa phần còn lại"""
+    paths = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if re.search(r'_\d+En_[0-9a-f]+\.xlsm$', name)]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def get_generated_template_path(num_environments, base_path=BASE_TEMPLATE_PATH, module_names=None):
+    """
+    Đường dẫn template N environment (và một sheet cho mỗi module trong module_names),
+    sinh từ template gốc nếu chưa có trong cache trên đĩa.
+    Cache: generated_templates/v{version}/<tên template gốc>_{N}En[_<hash module>].xlsm,
+    sinh lại khi template gốc mới hơn.
+    """
+    if not os.path.exists(base_path):
+        raise FileNotFoundError(f"Template file không tồn tại: {base_path}")
+    module_names = list(module_names or [])
+    if num_environments <= 1 and not module_names:
+        return base_path
+
+    cache_dir = os.path.join(GENERATED_TEMPLATE_DIR, f"v{TEMPLATE_GENERATOR_VERSION}")
+    base_name = os.path.splitext(os.path.basename(base_path))[0]
+    base_name = re.sub(r'_\d+En$', '', base_name)
+    file_name = f"{base_name}_{num_environments}En"
+    if module_names:
+        file_name += "_" + hashlib.sha1("\n".join(module_names).encode("utf-8")).hexdigest()[:12]
+    output_path = os.path.join(cache_dir, f"{file_name}.xlsm")
+
+    with _generate_lock:
+        if (not os.path.exists(output_path) or
+                os.path.getmtime(output_path) < os.path.getmtime(base_path)):
+            os.makedirs(cache_dir, exist_ok=True)
+            # Ghi ra file tạm rồi đổi tên: tiến trình khác không bao giờ đọc phải file đang ghi dở
+            fd, temp_path = tempfile.mkstemp(suffix='.xlsm', dir=cache_dir)
+            os.close(fd)
+            try:
+                generate_template(base_path, num_environments, temp_path, module_names)
+                os.chmod(temp_path, 0o644)
+                os.replace(temp_path, output_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            print(f"Đã sinh template {num_environments} environment: {output_path}")
+            if module_names:
+                _prune_module_templates(cache_dir, GENERATED_MODULE_TEMPLATE_LIMIT)
+        elif module_names:
+            os.utime(output_path)
+    return output_path
@@ -1,39 +1,86 @@
 # template_updater.py - Cập nhật template Excel gốc với giá trị mới
 import shutil
+import pickle
+import threading
+import weakref
+import zipfile
 from openpyxl import load_workbook
+from openpyxl.utils import range_boundaries
+from openpyxl.worksheet.cell_range import MultiCellRange
+from template_generator import get_generated_template_path, module_sheet_titles
 from openpyxl.worksheet.worksheet import Worksheet
 from datetime import datetime
 from io import BytesIO
 import os
 
-def update_template_with_values(project_settings, test_cases):
+# Cache template đã parse: path → (mtime, size, bytes gốc, workbook đã pickle)
+_template_cache = {}
+_template_cache_lock = threading.Lock()
+
+def load_template_workbook(template_path):
     """
-    Chọn đúng template theo số lượng Environment (1→7) và cập nhật nội dung.
+    Trả về một bản copy workbook của template, mỗi template chỉ parse (load_workbook) một lần.
 
-    - Template: TPL_TestResult_v1.0_{N}En.xlsm với N = số môi trường đã chọn (giới hạn 1..7)
-    - Cover sheet: giữ nguyên logic hiện tại
-    - Report sheet: chỉ điền tên Environment vào cột C, bắt đầu từ C4; các ô khác giữ nguyên
-    - Các sheet khác: giữ nguyên (không chỉnh sửa)
+    - Cache theo (path, mtime, size): sửa file template trên đĩa sẽ tự parse lại
+    - Mỗi lần gọi trả về bản copy riêng (unpickle, rẻ hơn nhiều so với parse XLSM),
+      vba_archive mở lại từ bytes gốc nên vbaProject.bin vẫn được giữ khi save
     """
-    environments = project_settings.get('environment', ['Chrome'])
-    num_environments = max(1, min(7, len(environments)))
+    stat = os.stat(template_path)
+    cache_key = os.path.abspath(template_path)
 
-    template_path = f"TPL_TestResult_v1.0_{num_environments}En.xlsm"
+    with _template_cache_lock:
+        cached = _template_cache.get(cache_key)
+    if not cached or cached[0] != stat.st_mtime_ns or cached[1] != stat.st_size:
+        with open(template_path, 'rb') as source_file:
+            raw = source_file.read()
+        wb = load_workbook(BytesIO(raw), keep_vba=True)
+        # ZipFile (vba_archive) không pickle được - bỏ ra trước khi pickle
+        wb.vba_archive = None
+        try:
+            pickled = pickle.dumps(wb, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            print(f"Không cache được template {template_path}: {e}")
+            pickled = None
+        cached = (stat.st_mtime_ns, stat.st_size, raw, pickled)
+        with _template_cache_lock:
+            _template_cache[cache_key] = cached
 
-    if not os.path.exists(template_path):
-        raise FileNotFoundError(f"Template file không tồn tại: {template_path}")
+    raw, pickled = cached[2], cached[3]
+    if pickled is None:
+        return load_workbook(BytesIO(raw), keep_vba=True)
+    wb = pickle.loads(pickled)
+    wb.vba_archive = zipfile.ZipFile(BytesIO(raw))
+    return wb
 
-    # Tạo bản copy trong memory
-    buffer = BytesIO()
+def clear_template_cache():
+    """Xóa cache template (VD: sau khi thay file template)"""
+    with _template_cache_lock:
+        _template_cache.clear()
 
-    # Copy file gốc
-    with open(template_path, 'rb') as source_file:
-        buffer.write(source_file.read())
+def get_template_path(project_settings, test_cases=None):
+    """
+    Template theo số lượng Environment (N) và module của test cases:
+    - N = 1, không có module: template gốc TPL_TestResult_v1.0_1En.xlsm
+    - Còn lại: sinh từ template gốc (template_generator), một sheet Module cho mỗi module,
+      cache trên đĩa theo N + danh sách module
+    """
+    environments = project_settings.get('environment', ['Chrome'])
+    return get_generated_template_path(max(1, len(environments)), module_names=get_module_names(test_cases or []))
 
-    buffer.seek(0)
+def update_template_with_values(project_settings, test_cases):
+    """
+    Chọn đúng template theo số lượng Environment (N bất kỳ) và cập nhật nội dung.
 
-    # Load workbook từ buffer
-    wb = load_workbook(buffer, keep_vba=True)
+    - Template: layout N environment (N = số môi trường đã chọn), một sheet Module cho mỗi module,
+      xem get_template_path
+    - Cover sheet: giữ nguyên logic hiện tại
+    - Report sheet: chỉ điền tên Environment vào cột C, bắt đầu từ C4; các ô khác giữ nguyên
+    - Các sheet khác: giữ nguyên (không chỉnh sửa)
+    """
+    template_path = get_template_path(project_settings, test_cases)
+
+    # Lấy bản copy của template đã parse sẵn (cache theo path + mtime)
+    wb = load_template_workbook(template_path)
 
     # Cập nhật các sheet theo yêu cầu
     update_cover_sheet(wb, project_settings)
@@ -47,6 +94,98 @@ def update_template_with_values(project_settings, test_cases):
 
     return output_buffer.read()
 
+# ===== GIÁ TRỊ CELL (dùng chung cho openpyxl và xlsm_patcher) =====
+
+def cover_sheet_values(project_settings):
+    """Các cell cần ghi vào sheet Cover: {coordinate: value}"""
+    today = datetime.now().strftime("%Y-%m-%d")
+    return {
+        'D3': project_settings.get('name', ''),  # Project Name
+        'D4': project_settings.get('phase', ''),  # Phase
+        'G3': "",  # blank
+        # Dòng 8 - Record of Change
+        'B8': today,  # Date
+        'C8': "1.0",  # Version
+        'D8': "Add new",  # Change Description
+        'E8': "A",  # A/M/D
+        'F8': "All sheet",  # Change Item
+    }
+
+def report_sheet_values(project_settings):
+    """Tên môi trường vào cột C của sheet Report, bắt đầu từ C4"""
+    environments = project_settings.get('environment', [])
+    return {f"C{4 + idx}": env for idx, env in enumerate(environments)}
+
+def test_case_to_dict(test_case):
+    """Chuyển test case (pydantic model / object / dict) thành dict"""
+    if hasattr(test_case, 'dict'):
+        return test_case.dict()
+    elif hasattr(test_case, '__dict__'):
+        return test_case.__dict__
+    return test_case
+
+def module_sheet_values(project_settings, test_cases):
+    """
+    Dữ liệu test case cho các sheet Module: cột B–G từ dòng (6+x), x = số environment.
+    Trả về list (row, [B, C, D, E, F, G]) theo thứ tự dòng.
+    """
+    environments = project_settings.get('environment', ['Chrome'])
+    start_row = 6 + len(environments)
+    rows = []
+    for i, test_case in enumerate(test_cases):
+        tc_dict = test_case_to_dict(test_case)
+        rows.append((start_row + i, [
+            tc_dict.get('description', ''),
+            tc_dict.get('preconditions', ''),
+            tc_dict.get('test_steps', ''),
+            tc_dict.get('test_data', ''),
+            tc_dict.get('expected_result', ''),
+            # Cột G: Priority dựa trên test_case_id
+            get_priority_from_test_case(tc_dict),
+        ]))
+    return rows
+
+# Cột được điền trên sheet Module (B..G)
+MODULE_SHEET_COLUMNS = ['B', 'C', 'D', 'E', 'F', 'G']
+MODULE_SHEET_FIRST_COLUMN = 2  # B
+
+def get_module_sheet_names(sheet_names):
+    """Các sheet Module (mọi sheet trừ Cover và Report), theo thứ tự trong workbook"""
+    return [name for name in sheet_names if name not in ["Cover", "Report"]]
+
+def _module_key(test_case):
+    return str(test_case_to_dict(test_case).get('module') or '').strip()
+
+def get_module_names(test_cases):
+    """Các module khác nhau của test cases (không phân biệt hoa thường), theo thứ tự xuất hiện"""
+    names = {}
+    for test_case in test_cases:
+        module = _module_key(test_case)
+        if module:
+            names.setdefault(module.lower(), module)
+    return list(names.values())
+
+def partition_test_cases_by_module(test_cases, module_sheets):
+    """
+    Chia test cases theo sheet Module: {sheet: [test cases]}.
+
+    - Test case có module → sheet sinh cho module đó (module_sheet_titles) hoặc sheet trùng tên
+      (không phân biệt hoa thường)
+    - Không có module / module không có sheet tương ứng → sheet Module đầu tiên
+    """
+    partitions = {sheet_name: [] for sheet_name in module_sheets}
+    if not module_sheets:
+        return partitions
+    sheets_by_name = {sheet_name.strip().lower(): sheet_name for sheet_name in module_sheets}
+    module_names = get_module_names(test_cases)
+    for name, title in zip(module_names, module_sheet_titles(module_names)):
+        if title in partitions:
+            sheets_by_name[name.lower()] = title
+    default_sheet = module_sheets[0]
+    for test_case in test_cases:
+        partitions[sheets_by_name.get(_module_key(test_case).lower(), default_sheet)].append(test_case)
+    return partitions
+
 def update_cover_sheet(wb, project_settings):
     """Cập nhật sheet Cover với thông tin project - giữ nguyên logic hiện tại"""
     try:
@@ -56,23 +195,9 @@ def update_cover_sheet(wb, project_settings):
         ws = wb.create_sheet("Cover")
     
     try:
-        # Cập nhật các cell theo yêu cầu mới
-        # Cell D3 = Project Name
-        ws['D3'] = project_settings.get('name', '')
-        
-        # Cell D4 = Phase
-        ws['D4'] = project_settings.get('phase', '')
-        
-        # Cell G3 = blank
-        ws['G3'] = ""
-        
-        # Dòng 8 - Record of Change
-        today = datetime.now().strftime("%Y-%m-%d")
-        ws['B8'] = today  # Date
-        ws['C8'] = "1.0"  # Version
-        ws['D8'] = "Add new"  # Change Description
-        ws['E8'] = "A"  # A/M/D
-        ws['F8'] = "All sheet"  # Change Item
+        for coordinate, value in cover_sheet_values(project_settings).items():
+            ws[coordinate] = value
+        clear_sheet_index(ws)
             
     except Exception as e:
         print(f"Lỗi khi cập nhật Cover sheet: {e}")
@@ -90,9 +215,9 @@ def update_report_sheet(wb, project_settings, test_cases):
         return
 
     try:
-        environments = project_settings.get('environment', [])
-        for idx, env in enumerate(environments):
-            ws[f"C{4 + idx}"] = env
+        for coordinate, value in report_sheet_values(project_settings).items():
+            ws[coordinate] = value
+        clear_sheet_index(ws)
     except Exception as e:
         print(f"Lỗi khi cập nhật Report sheet: {e}")
 
@@ -102,44 +227,23 @@ def update_module_sheets(wb, project_settings, test_cases):
     - x = số environment đã chọn
     - y = số test case sau khi generate
     - Điền dữ liệu từ dòng (6+x) đến dòng (6+x+y)
+    - Test case được chia theo module: mỗi sheet chỉ nhận test case của module mình
+      (xem partition_test_cases_by_module)
     """
     try:
-        environments = project_settings.get('environment', ['Chrome'])
-        x = len(environments)  # số environment
-        y = len(test_cases)    # số test case
-        
-        # Lấy danh sách các sheet Module (bỏ qua Cover và Report)
-        module_sheets = [name for name in wb.sheetnames if name not in ["Cover", "Report"]]
+        # Lấy danh sách các sheet Module (bỏ qua Cover và Report), mỗi sheet chỉ nhận test case của module đó
+        module_sheets = get_module_sheet_names(wb.sheetnames)
+        partitions = partition_test_cases_by_module(test_cases, module_sheets)
         
         for sheet_name in module_sheets:
             ws = wb[sheet_name]
-            print(f"Cập nhật Module sheet: {sheet_name}")
-            
-            # Điền dữ liệu từ dòng (6+x) đến dòng (6+x+y)
-            start_row = 6 + x
-            end_row = 6 + x + y
+            print(f"Cập nhật Module sheet: {sheet_name} ({len(partitions[sheet_name])} test cases)")
             
-            for i, test_case in enumerate(test_cases):
-                current_row = start_row + i
-                
-                # Chuyển đổi test_case thành dict nếu cần
-                if hasattr(test_case, 'dict'):
-                    tc_dict = test_case.dict()
-                elif hasattr(test_case, '__dict__'):
-                    tc_dict = test_case.__dict__
-                else:
-                    tc_dict = test_case
-                
-                # Điền dữ liệu vào các cột
-                ws[f"B{current_row}"] = tc_dict.get('description', '')
-                ws[f"C{current_row}"] = tc_dict.get('preconditions', '')
-                ws[f"D{current_row}"] = tc_dict.get('test_steps', '')
-                ws[f"E{current_row}"] = tc_dict.get('test_data', '')
-                ws[f"F{current_row}"] = tc_dict.get('expected_result', '')
-                
-                # Cột G: Priority dựa trên test_case_id
-                priority = get_priority_from_test_case(tc_dict)
-                ws[f"G{current_row}"] = priority
+            # Ghi theo dòng bằng ws.cell (không parse tọa độ "B7" cho từng ô)
+            for current_row, values in module_sheet_values(project_settings, partitions[sheet_name]):
+                for column, value in enumerate(values, MODULE_SHEET_FIRST_COLUMN):
+                    ws.cell(row=current_row, column=column, value=value)
+            clear_sheet_index(ws)
             
     except Exception as e:
         print(f"Lỗi khi cập nhật Module sheets: {e}")
@@ -168,14 +272,78 @@ def get_priority_from_test_case(tc_dict):
 
 # ===== HELPER FUNCTIONS FOR VBA CONVERSION =====
 
+# Index theo sheet cho các helper bên dưới: ws → {'text': ..., 'merged': ...}
+# (WeakKeyDictionary: index tự bỏ khi workbook không còn được dùng)
+_sheet_indexes = weakref.WeakKeyDictionary()
+
+def get_sheet_index(ws):
+    """
+    Index text của sheet, build một lần (một lượt ws.iter_rows):
+    - texts: [(row, text viết thường)] các cell có giá trị, theo thứ tự dòng → cột
+    - first_by_text: text viết thường → vị trí đầu tiên trong texts
+    - found: kết quả find_cell_by_text đã tìm
+    Index là ảnh chụp: ghi cell qua set_cell_value (hoặc gọi clear_sheet_index(ws) sau khi ghi trực tiếp).
+    """
+    indexes = _sheet_indexes.setdefault(ws, {})
+    if indexes.get('text') is None:
+        texts = []
+        first_by_text = {}
+        for cells in ws.iter_rows():
+            for cell in cells:
+                if cell.value:
+                    text = str(cell.value).lower()
+                    first_by_text.setdefault(text, len(texts))
+                    texts.append((cell.row, text))
+        indexes['text'] = {'texts': texts, 'first_by_text': first_by_text, 'found': {}}
+    return indexes['text']
+
+def get_merged_index(ws):
+    """
+    Merged range của sheet theo dòng: row → [(min_col, max_col)] của các merged range phủ dòng đó.
+    Build lại khi tập merged range của sheet khác lúc build (merge / unmerge ngoài safe_merge_cells).
+    """
+    indexes = _sheet_indexes.setdefault(ws, {})
+    bounds = {(r.min_row, r.min_col, r.max_row, r.max_col) for r in ws.merged_cells.ranges}
+    cached = indexes.get('merged')
+    if cached is None or cached['bounds'] != bounds:
+        merged_by_row = {}
+        for min_row, min_col, max_row, max_col in bounds:
+            _add_merged_range(merged_by_row, min_row, max_row, min_col, max_col)
+        cached = {'bounds': bounds, 'merged_by_row': merged_by_row}
+        indexes['merged'] = cached
+    return cached
+
+def clear_sheet_index(ws=None):
+    """Bỏ index của một sheet (hoặc tất cả nếu ws=None)"""
+    if ws is None:
+        _sheet_indexes.clear()
+    else:
+        _sheet_indexes.pop(ws, None)
+
+def set_cell_value(ws, row, column, value):
+    """Ghi cell và bỏ index text của sheet (find_cell_by_text luôn thấy giá trị mới)"""
+    ws.cell(row=row, column=column, value=value)
+    _sheet_indexes.get(ws, {}).pop('text', None)
+
+def _add_merged_range(merged_by_row, start_row, end_row, start_col, end_col):
+    for row in range(start_row, end_row + 1):
+        merged_by_row.setdefault(row, []).append((start_col, end_col))
+
 def find_cell_by_text(ws, text):
     """Tìm cell chứa text cụ thể và trả về row number"""
-    for row in range(1, ws.max_row + 1):
-        for col in range(1, ws.max_column + 1):
-            cell_value = ws.cell(row=row, column=col).value
-            if cell_value and text.lower() in str(cell_value).lower():
-                return row
-    return None
+    index = get_sheet_index(ws)
+    needle = text.lower()
+    if needle not in index['found']:
+        texts = index['texts']
+        # Cell trùng khớp hoàn toàn giới hạn phạm vi quét: chỉ cần xét các cell đứng trước nó
+        limit = index['first_by_text'].get(needle, len(texts))
+        row = texts[limit][0] if limit < len(texts) else None
+        for position in range(limit):
+            if needle in texts[position][1]:
+                row = texts[position][0]
+                break
+        index['found'][needle] = row
+    return index['found'][needle]
 
 def column_number_to_letter(column_number):
     """Chuyển đổi số cột thành chữ cái (A, B, C, ...)"""
@@ -186,37 +354,54 @@ def column_number_to_letter(column_number):
         column_number //= 26
     return result
 
+def _has_merge_conflict(merged_by_row, start_row, end_row, start_col, end_col):
+    for row in range(start_row, end_row + 1):
+        for min_col, max_col in merged_by_row.get(row, ()):
+            # Kiểm tra xem có overlap không
+            if min_col <= end_col and max_col >= start_col:
+                return True
+    return False
+
 def check_merge_conflict(ws, start_row, end_row, start_col, end_col):
     """
     Kiểm tra xem có xung đột với merged cells hiện có không
     """
-    for merged_range in ws.merged_cells.ranges:
-        # Kiểm tra xem có overlap không
-        if (merged_range.min_row <= end_row and merged_range.max_row >= start_row and
-            merged_range.min_col <= end_col and merged_range.max_col >= start_col):
-            return True
-    return False
+    return _has_merge_conflict(get_merged_index(ws)['merged_by_row'], start_row, end_row, start_col, end_col)
+
+def _merge_without_scan(ws, merge_range):
+    """
+    ws.merge_cells nhưng không so range mới với mọi merged range đã có (MultiCellRange.add duyệt tuyến tính,
+    merge cả loạt thành O(n²)): merge vào một MultiCellRange rỗng rồi gộp vào tập range của sheet.
+    Chỉ dùng khi đã kiểm tra xung đột.
+    """
+    merged_cells = ws.merged_cells
+    ws.merged_cells = MultiCellRange()
+    try:
+        ws.merge_cells(merge_range)
+        merged_cells.ranges.update(ws.merged_cells.ranges)
+    finally:
+        ws.merged_cells = merged_cells
 
 def safe_merge_cells(ws, merge_ranges):
     """
     Merge nhiều cells một cách an toàn, bỏ qua nếu có xung đột
     """
+    merged_index = get_merged_index(ws)
+    merged_by_row = merged_index['merged_by_row']
     for merge_range in merge_ranges:
         try:
             # Parse range để lấy thông tin
-            start_cell, end_cell = merge_range.split(':')
-            start_col = ord(start_cell[0]) - ord('A') + 1
-            start_row = int(start_cell[1:])
-            end_col = ord(end_cell[0]) - ord('A') + 1
-            end_row = int(end_cell[1:])
+            start_col, start_row, end_col, end_row = range_boundaries(merge_range)
             
             # Kiểm tra xung đột
-            if not check_merge_conflict(ws, start_row, end_row, start_col, end_col):
-                ws.merge_cells(merge_range)
+            if not _has_merge_conflict(merged_by_row, start_row, end_row, start_col, end_col):
+                _merge_without_scan(ws, merge_range)
+                # Cập nhật index tại chỗ thay vì build lại; cell bị merge mất giá trị → bỏ index text
+                merged_index['bounds'].add((start_row, start_col, end_row, end_col))
+                _add_merged_range(merged_by_row, start_row, end_row, start_col, end_col)
+                _sheet_indexes[ws].pop('text', None)
                 print(f"    ✅ Merged {merge_range}")
             else:
                 print(f"    ⚠️ Bỏ qua {merge_range} do xung đột")
         except Exception as e:
             print(f"    ❌ Lỗi merge {merge_range}: {e}")
-
-
@@ -2,11 +2,13 @@
 from typing import TypedDict, List
 from dotenv import load_dotenv
 from langchain_groq import ChatGroq
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 from langgraph.graph import StateGraph
 from pydantic import BaseModel, Field
+from pydantic.json_schema import SkipJsonSchema
 import json
 import re
+import uuid
 
 # System prompt for the test case generator
 GENERATOR_PROMPT = """
@@ -42,6 +44,8 @@ CRITICAL REQUIREMENTS FOR TEST TITLES AND DESCRIPTIONS:
 - STRICT FORMAT: test_title must be exactly the field name only
 - test_steps: Include ALL steps needed to complete the test, not just field-specific steps
 - ERROR MESSAGES: Create separate test cases for error messages of each field/component
+- module: Name of the module / feature / screen the test case belongs to (e.g., "Đăng nhập", "Giỏ hàng").
+  Use exactly the same module name for every test case of the same module; each module gets its own sheet in the Excel report
 - Examples for Vietnamese: 
   * test_title: "Trường Email", description: "Kiểm tra định dạng email hợp lệ"
   * test_title: "Lỗi Trường Email", description: "Kiểm tra thông báo lỗi xác thực email"
@@ -53,6 +57,7 @@ Generate your response as a JSON object with the following structure:
   "test_cases": [
     {
       "test_case_id": 1,
+      "module": "[Tên Module/Chức năng]",
       "test_title": "[Tên Trường/Thành phần]",
       "description": "Mô tả chi tiết trường hợp kiểm thử",
       "preconditions": "Điều kiện tiên quyết",
@@ -75,6 +80,9 @@ class TestCase(BaseModel):
     test_data: str = Field(..., description="Input values required for the test")
     expected_result: str = Field(..., description="The anticipated outcome")
     comments: str = Field(..., description="Additional notes or observations")
+    module: Optional[str] = Field(None, description="Module / feature the test case belongs to (matches a Module sheet of the Excel template)")
+    # Định danh cố định gán khi tạo test case (không nằm trong schema gửi cho model) - khóa đồng bộ Jira
+    case_uid: SkipJsonSchema[Optional[str]] = Field(None, description="Stable identity of the test case, assigned on creation")
 
 # Output schema containing list of test cases
 class OutputSchema(BaseModel):
@@ -739,6 +747,16 @@ def _build_local_fallback_cases(
         )
     return fallback_cases
 
+def assign_case_uids(test_cases: List[Any]) -> List[Any]:
+    """Give every test case without one a new case_uid (test_case_id restarts at 1 on each generation)"""
+    for test_case in test_cases:
+        if isinstance(test_case, dict):
+            if not test_case.get('case_uid'):
+                test_case['case_uid'] = uuid.uuid4().hex
+        elif not getattr(test_case, 'case_uid', None):
+            test_case.case_uid = uuid.uuid4().hex
+    return test_cases
+
 def generate_test_cases(user_input: str, num_cases: int = 10, project_settings: Dict[str, Any] | None = None) -> List[TestCase]:
     """
     Generate test cases from user story input.
@@ -773,10 +791,10 @@ def generate_test_cases(user_input: str, num_cases: int = 10, project_settings:
         
         print(f"✅ Generated {len(improved_cases)} test cases successfully!")
         if improved_cases:
-            return improved_cases
+            return assign_case_uids(improved_cases)
         
         print("⚠️ No test cases returned from AI, using local fallback cases.")
-        return _build_local_fallback_cases(num_cases, project_settings)
+        return assign_case_uids(_build_local_fallback_cases(num_cases, project_settings))
     except Exception as e:
         print(f"Error generating test cases: {e}")
-        return _build_local_fallback_cases(num_cases, project_settings)
+        return assign_case_uids(_build_local_fallback_cases(num_cases, project_settings))
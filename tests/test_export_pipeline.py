@@ -0,0 +1,43 @@
+import csv
+import json
+import os
+from io import BytesIO
+
+import pytest
+from openpyxl import load_workbook
+
+import template_generator
+import template_updater
+from export_pipeline import write_export_files
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CASES = [
+    {'test_case_id': 1, 'description': "Login works", 'preconditions': "User exists",
+     'test_steps': "Open login", 'test_data': '', 'expected_result': "Form shown", 'comments': ''},
+    {'test_case_id': 2, 'description': "Logout works", 'preconditions': '',
+     'test_steps': "Click logout", 'test_data': '', 'expected_result': "Login page shown", 'comments': ''},
+]
+
+
+@pytest.fixture(autouse=True)
+def templates(tmp_path, monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+    monkeypatch.setattr(template_generator, "GENERATED_TEMPLATE_DIR", str(tmp_path / "generated"))
+    template_updater.clear_template_cache()
+
+
+def test_write_export_files_writes_every_format_once(tmp_path):
+    settings = {'name': "Project", 'environment': ["Chrome"]}
+
+    paths = write_export_files(CASES, str(tmp_path), ['csv', 'json', 'csv', 'jsonl', 'xlsm'], settings)
+
+    assert list(paths) == ['csv', 'json', 'jsonl', 'xlsm']
+    with open(paths['csv'], newline='', encoding='utf-8') as file:
+        assert [row['description'] for row in csv.DictReader(file)] == ["Login works", "Logout works"]
+    with open(paths['json'], encoding='utf-8') as file:
+        assert json.load(file) == CASES
+    with open(paths['jsonl'], encoding='utf-8') as file:
+        assert [json.loads(line) for line in file] == CASES
+    with open(paths['xlsm'], 'rb') as file:
+        wb = load_workbook(BytesIO(file.read()))
+    assert [wb['Module 1']['B7'].value, wb['Module 1']['B8'].value] == ["Login works", "Logout works"]
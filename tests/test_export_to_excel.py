@@ -0,0 +1,49 @@
+from io import BytesIO
+
+from openpyxl import load_workbook
+
+import export_to_excel
+from export_pipeline import export_formats
+from export_to_excel import EXPORT_SHEET_NAME, export_to_excel_bytes
+
+
+def _sheet_rows(data):
+    return [list(row) for row in load_workbook(BytesIO(data))[EXPORT_SHEET_NAME].iter_rows(values_only=True)]
+
+
+def test_columns_are_the_union_of_all_rows():
+    rows = _sheet_rows(export_to_excel_bytes([
+        {'test_case_id': 1, 'description': "First"},
+        {'test_case_id': 2, 'description': "Second", 'module': "Login"},
+    ]))
+
+    assert rows == [
+        ['test_case_id', 'description', 'module'],
+        [1, "First", None],
+        [2, "Second", "Login"],
+    ]
+
+
+def test_pipeline_xlsx_matches_export_to_excel():
+    cases = [
+        {'test_case_id': 1, 'description': "First", 'test_steps': "Open\nClick"},
+        {'test_case_id': 2, 'module': "Login", 'tags': ["smoke"]},
+    ]
+
+    assert _sheet_rows(export_formats(cases, ['xlsx'])['xlsx']) == _sheet_rows(export_to_excel_bytes(cases))
+
+
+def test_models_stream_in_testcase_field_order(monkeypatch):
+    from tester_agent import TestCase
+
+    def read_all_rows(rows):
+        raise AssertionError("rows of Pydantic test cases must stream, not be collected for a column union")
+
+    monkeypatch.setattr(export_to_excel, "export_columns", read_all_rows)
+    cases = (TestCase(test_case_id=i, test_title="T", description=f"Case {i}", preconditions='', test_steps="Open",
+                      test_data='', expected_result="Shown", comments='') for i in (1, 2))
+
+    rows = _sheet_rows(export_to_excel.export_to_excel_bytes(cases))
+
+    assert rows[0] == list(TestCase.model_fields)
+    assert [row[2] for row in rows[1:]] == ["Case 1", "Case 2"]
@@ -0,0 +1,286 @@
+import sqlite3
+import subprocess
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+
+import jira_sync
+import jira_sync_store
+import tester_agent
+from fake_jira_server import FakeJiraServer
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(jira_sync_store, "SYNC_STORE_FILE", str(tmp_path / "jira_sync.db"))
+    jira_sync.clear_jira_caches()
+    with FakeJiraServer() as fake:
+        yield fake
+    jira_sync.clear_jira_caches()
+
+
+def _client(server):
+    return jira_sync.get_jira_client(server.url, "test", "test")
+
+
+def _test_fields(count, project_key="TEST"):
+    return [
+        {
+            'project': {'key': project_key},
+            'summary': f"Case {i}",
+            'issuetype': {'name': 'Test'},
+            'labels': ['automated-sync', jira_sync_store.get_idempotency_label(project_key, f"case-{i}")],
+        }
+        for i in range(count)
+    ]
+
+
+class _TimeoutAfterCommit:
+    """Client mà request create được server thực hiện xong rồi mới báo timeout"""
+
+    def __init__(self, jira_instance, failures=1):
+        self._jira = jira_instance
+        self.failures = failures
+
+    def __getattr__(self, name):
+        return getattr(self._jira, name)
+
+    def _fail(self, result):
+        if self.failures:
+            self.failures -= 1
+            raise requests.exceptions.Timeout("read timed out")
+        return result
+
+    def create_issues(self, field_list, prefetch=True):
+        return self._fail(self._jira.create_issues(field_list=field_list, prefetch=prefetch))
+
+    def create_issue(self, fields, prefetch=True):
+        return self._fail(self._jira.create_issue(fields=fields, prefetch=prefetch))
+
+
+def test_bulk_timeout_after_commit_does_not_duplicate(server):
+    client = _TimeoutAfterCommit(_client(server))
+
+    results = jira_sync.create_issues_in_batches(client, _test_fields(5), batch_size=5)
+
+    assert all(result['key'] for result in results)
+    assert len(server.issues) == 5
+    assert sorted(result['key'] for result in results) == sorted(server.issues)
+
+
+def test_retried_create_after_timeout_does_not_duplicate(server, monkeypatch):
+    monkeypatch.setattr(jira_sync, "_retry_delay_seconds", lambda error, attempt: 0)
+    client = _TimeoutAfterCommit(_client(server), failures=2)
+
+    results = jira_sync.create_issues_concurrently(client, _test_fields(2), max_workers=1)
+
+    assert all(result['key'] for result in results)
+    assert len(server.issues) == 2
+
+
+def _settings(server):
+    return {'jira_server': server.url, 'jira_username': 'test', 'jira_password': 'test'}
+
+
+def _cases(count, prefix="Case"):
+    cases = [
+        {
+            'test_case_id': i,
+            'test_title': f"{prefix} {i}",
+            'description': f"{prefix} {i}",
+            'preconditions': '',
+            'test_steps': "Open the page",
+            'test_data': '',
+            'expected_result': "Page is shown",
+            'comments': '',
+        }
+        for i in range(1, count + 1)
+    ]
+    return tester_agent.assign_case_uids(cases)
+
+
+def test_regenerated_cases_do_not_overwrite_synced_issues(server):
+    first = jira_sync.sync_test_cases_to_jira(_cases(3, "First"), "TEST", _settings(server), project_id=1)
+    # Bộ test case sinh lại (test_case_id lại bắt đầu từ 1) và một project khác dùng chung Jira project
+    second = jira_sync.sync_test_cases_to_jira(_cases(3, "Second"), "TEST", _settings(server), project_id=1)
+    other = jira_sync.sync_test_cases_to_jira(_cases(3, "Other"), "TEST", _settings(server), project_id=2)
+
+    assert [len(result['created_issues']) for result in (first, second, other)] == [3, 3, 3]
+    assert all(not result['updated_issues'] for result in (first, second, other))
+    summaries = sorted(issue['fields']['summary'] for issue in server.issues.values())
+    assert summaries == sorted(f"{prefix} {i}" for prefix in ("First", "Second", "Other") for i in (1, 2, 3))
+
+
+def test_legacy_cases_keep_their_mapping(server):
+    cases = _cases(2)
+    for case in cases:
+        del case['case_uid']
+    jira_sync.sync_test_cases_to_jira(cases, "TEST", _settings(server), project_id=1)
+
+    plan = jira_sync_store.plan_sync(cases, jira_sync.get_jira_credentials(_settings(server))['server'], "TEST", project_id=1)
+
+    assert [item['action'] for item in plan] == ['skip', 'skip']
+
+
+def test_duplicate_case_keys_do_not_abort_the_sync(server):
+    cases = _cases(3)
+    cases[2]['case_uid'] = cases[0]['case_uid']
+
+    result = jira_sync.sync_test_cases_to_jira(cases, "TEST", _settings(server), project_id=1)
+
+    assert result['success'], result['message']
+    assert len(result['created_issues']) == 2
+    assert [item['action'] for item in result['plan']] == ['create', 'create', 'duplicate']
+    assert len(server.issues) == 2
+
+
+def test_update_keeps_labels_added_in_jira(server):
+    cases = _cases(1)
+    created = jira_sync.sync_test_cases_to_jira(cases, "TEST", _settings(server), project_id=1)
+    jira_key = created['created_issues'][0]['key']
+    server._update_issue(jira_key, {}, {'labels': [{'add': 'needs-review'}]})
+    cases[0]['description'] = "Edited locally"
+
+    result = jira_sync.sync_test_cases_to_jira(cases, "TEST", _settings(server), project_id=1)
+
+    fields = server.issues[jira_key]['fields']
+    assert [issue['key'] for issue in result['updated_issues']] == [jira_key]
+    assert fields['summary'] == "Edited locally"
+    assert 'needs-review' in fields['labels'] and 'automated-sync' in fields['labels']
+
+
+def _start_run(server, cases, **owner):
+    """Lần sync bị ngắt sau khi đã tạo issue trên Jira nhưng chưa ghi kết quả"""
+    server_url = server.url
+    plan = jira_sync_store.plan_sync(cases, server_url, "TEST", project_id=1)
+    run_id = jira_sync_store.start_sync_run(server_url, "TEST", plan)
+    for item in plan:
+        fields = _test_fields(1)[0]
+        fields['labels'] = [jira_sync_store.get_idempotency_label("TEST", item['case_key'])]
+        server._create_issue(fields)
+    if owner:
+        connection = sqlite3.connect(jira_sync_store.SYNC_STORE_FILE)
+        with connection:
+            connection.execute(
+                f"UPDATE sync_run SET {', '.join(f'{column} = ?' for column in owner)} WHERE run_id = ?",
+                (*owner.values(), run_id)
+            )
+        connection.close()
+    return run_id
+
+
+def test_live_sync_run_is_not_recovered(server):
+    cases = _cases(2)
+    _start_run(server, cases)
+
+    recovery = jira_sync.recover_interrupted_syncs(_client(server), server.url, "TEST")
+    result = jira_sync.sync_test_cases_to_jira(cases, "TEST", _settings(server), project_id=1)
+
+    assert recovery['runs'] == 0
+    assert not result['success']
+    assert len(server.issues) == 2
+
+
+@pytest.mark.parametrize("owner", [
+    {'heartbeat_at': (datetime.now() - timedelta(seconds=jira_sync_store.SYNC_RUN_STALE_SECONDS + 60)).isoformat()},
+    {'owner_pid': 'dead'},
+])
+def test_abandoned_sync_run_is_recovered(server, owner):
+    if owner.get('owner_pid') == 'dead':
+        process = subprocess.Popen([sys.executable, "-c", "pass"])
+        process.wait()
+        owner['owner_pid'] = process.pid
+    cases = _cases(2)
+    _start_run(server, cases, **owner)
+
+    result = jira_sync.sync_test_cases_to_jira(cases, "TEST", _settings(server), project_id=1)
+
+    assert result['success'], result['message']
+    assert [item['action'] for item in result['plan']] == ['skip', 'skip']
+    assert len(server.issues) == 2
+
+
+class _StopRun(BaseException):
+    """Như RerunException / StopException của Streamlit: không phải Exception"""
+
+
+def test_sync_interrupted_by_base_exception_can_resume(server):
+    cases = _cases(3)
+
+    def stop(completed, total, result):
+        raise _StopRun()
+
+    with pytest.raises(_StopRun):
+        jira_sync.sync_test_cases_to_jira(cases, "TEST", _settings(server), project_id=1, progress_callback=stop)
+    runs = jira_sync_store.load_sync_runs(jira_sync.get_jira_credentials(_settings(server))['server'], "TEST")
+    result = jira_sync.sync_test_cases_to_jira(cases, "TEST", _settings(server), project_id=1)
+
+    assert [run['status'] for run in runs] == [jira_sync_store.RUN_INTERRUPTED]
+    assert result['success'], result['message']
+    assert len(server.issues) == 3
+
+
+def test_sync_run_columns_are_added_to_an_old_store(tmp_path):
+    db_path = str(tmp_path / "old.db")
+    connection = sqlite3.connect(db_path)
+    connection.execute(
+        "CREATE TABLE sync_run (run_id INTEGER PRIMARY KEY AUTOINCREMENT, server TEXT NOT NULL, "
+        "project_key TEXT NOT NULL, status TEXT NOT NULL, started_at TEXT NOT NULL, finished_at TEXT)"
+    )
+    connection.execute("INSERT INTO sync_run (server, project_key, status, started_at) VALUES ('s', 'TEST', 'running', '2020-01-01T00:00:00')")
+    connection.commit()
+    connection.close()
+
+    runs = jira_sync_store.load_abandoned_sync_runs('s', 'TEST', db_path)
+
+    assert [run['run_id'] for run in runs] == [1]
+    assert runs[0]['heartbeat_at'] is None
+
+
+def _edit_remote(server, jira_key, summary):
+    server._update_issue(jira_key, {'summary': summary})
+
+
+def test_pull_cursor_follows_jira_clock(tmp_path, monkeypatch):
+    # Jira chạy ở múi giờ lùi 10 tiếng so với máy local: cursor phải lấy từ updated của Jira
+    monkeypatch.setattr(jira_sync_store, "SYNC_STORE_FILE", str(tmp_path / "jira_sync.db"))
+    jira_sync.clear_jira_caches()
+    local_offset = datetime.now().astimezone().utcoffset()
+    with FakeJiraServer(timezone=timezone(local_offset - timedelta(hours=10))) as server:
+        cases = _cases(1)
+        created = jira_sync.sync_test_cases_to_jira(cases, "TEST", _settings(server), project_id=1)
+        jira_key = created['created_issues'][0]['key']
+        jira_sync.pull_test_case_changes_from_jira(cases, "TEST", _settings(server), project_id=1)
+
+        _edit_remote(server, jira_key, "Edited in Jira")
+        result = jira_sync.pull_test_case_changes_from_jira(cases, "TEST", _settings(server), project_id=1)
+    jira_sync.clear_jira_caches()
+
+    assert result['success'], result['message']
+    assert [change['jira_key'] for change in result['changes']] == [jira_key]
+    assert result['test_cases'][0]['description'] == "Edited in Jira"
+
+
+def test_pull_conflict_is_offered_until_resolved(server):
+    cases = _cases(1)
+    created = jira_sync.sync_test_cases_to_jira(cases, "TEST", _settings(server), project_id=1)
+    jira_key = created['created_issues'][0]['key']
+    _edit_remote(server, jira_key, "Edited in Jira")
+    cases[0]['description'] = "Edited locally"
+
+    first = jira_sync.pull_test_case_changes_from_jira(cases, "TEST", _settings(server), project_id=1)
+    # Cursor đã vượt qua lần sửa trên Jira: conflict vẫn phải được báo lại
+    server_url = jira_sync.get_jira_credentials(_settings(server))['server']
+    jira_sync_store.set_last_pull_time(server_url, "TEST", datetime.now().astimezone() + timedelta(days=1))
+    second = jira_sync.pull_test_case_changes_from_jira(cases, "TEST", _settings(server), project_id=1)
+    # Giải quyết: bỏ sửa local → lần pull sau nhận bản Jira rồi không còn conflict
+    cases[0]['description'] = "Case 1"
+    third = jira_sync.pull_test_case_changes_from_jira(cases, "TEST", _settings(server), project_id=1)
+    fourth = jira_sync.pull_test_case_changes_from_jira(third['test_cases'], "TEST", _settings(server), project_id=1)
+
+    assert [conflict['jira_key'] for conflict in first['conflicts']] == [jira_key]
+    assert [conflict['jira_key'] for conflict in second['conflicts']] == [jira_key]
+    assert third['conflicts'] == [] and third['test_cases'][0]['description'] == "Edited in Jira"
+    assert fourth['conflicts'] == [] and fourth['changes'] == []
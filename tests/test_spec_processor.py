@@ -0,0 +1,81 @@
+import glob
+import os
+
+import pytest
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+import spec_processor
+
+
+SETTINGS = {'languages': ['English'], 'testing_types': ['Functional', 'UI'], 'writing_style': 'Concise'}
+DESIGN_IMAGES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'design-images', '*.png')))
+SPEC = "# Login\nUsers log in with email and password.\n\n# Logout\nUsers can log out from any page."
+
+
+def test_analysis_cache_key_keeps_list_order():
+    reordered = {**SETTINGS, 'testing_types': ['UI', 'Functional']}
+    assert spec_processor._analysis_cache_key("spec", SETTINGS) != spec_processor._analysis_cache_key("spec", reordered)
+    assert spec_processor._analysis_cache_key("spec", SETTINGS) == spec_processor._analysis_cache_key("spec", dict(SETTINGS))
+
+
+def test_unchanged_spec_is_reanalyzed_when_settings_change(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_analyze(text, project_settings):
+        calls.append(project_settings['languages'])
+        return f"# Story\n\nanalysis {len(calls)}\n\n---\nfooter"
+
+    monkeypatch.setattr(spec_processor, 'SPEC_VERSIONS_FILE', str(tmp_path / 'spec_versions.json'))
+    monkeypatch.setattr(spec_processor, 'extract_text_from_file', lambda *args, **kwargs: SPEC)
+    monkeypatch.setattr(spec_processor, 'analyze_spec_with_ai', fake_analyze)
+
+    def process(settings):
+        return spec_processor.process_uploaded_spec(b"x", "text/plain", settings, file_name="spec.txt", project_id=1)
+
+    first = process(SETTINGS)
+    assert process(SETTINGS) == first
+    assert len(calls) == 1
+
+    vietnamese = {**SETTINGS, 'languages': ['Vietnamese']}
+    assert process(vietnamese) != first
+    assert calls == [['English'], ['Vietnamese']]
+
+
+def _document_image():
+    image = Image.new("RGB", (1240, 1754), "white")
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=22)
+    for y in range(120, 1650, 36):
+        draw.text((120, y), "the system shall allow users to log in with email and password", fill="black", font=font)
+    return image
+
+
+def _photo_image():
+    gradient = Image.linear_gradient("L").resize((800, 600))
+    image = Image.merge("RGB", (gradient, gradient.rotate(90), Image.effect_noise((800, 600), 40)))
+    return image.filter(ImageFilter.GaussianBlur(1))
+
+
+@pytest.mark.parametrize("path", DESIGN_IMAGES)
+def test_design_images_are_screenshots(path):
+    with Image.open(path) as image:
+        assert spec_processor._classify_image(image) == "screenshot"
+
+
+def test_classify_document_and_photo():
+    assert spec_processor._classify_image(_document_image()) == "document"
+    assert spec_processor._classify_image(_photo_image()) == "photo"
+
+
+def test_preprocess_drops_borders_and_crops_to_text():
+    image = Image.new("RGB", (900, 600), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((20, 20, 880, 580), outline="black", width=2)
+    draw.line((20, 300, 880, 300), fill="black", width=2)
+    draw.text((300, 200), "Login with email", fill="black", font=ImageFont.load_default(size=24))
+
+    processed, _ = spec_processor._preprocess_image_for_ocr(image)
+
+    # Chỉ còn dòng chữ: khung và đường kẻ ngang bị bỏ, ảnh được cắt sát vùng chữ
+    assert processed.width < 300 and processed.height < 60
+    assert processed.getextrema() == (0, 255)
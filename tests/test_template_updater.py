@@ -0,0 +1,128 @@
+import os
+from io import BytesIO
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+import template_generator
+import template_updater
+import xlsm_patcher
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SETTINGS = {'name': "Project", 'phase': "UAT", 'environment': ["Chrome", "Firefox"]}
+
+
+@pytest.fixture(autouse=True)
+def generated_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+    monkeypatch.setattr(template_generator, "GENERATED_TEMPLATE_DIR", str(tmp_path))
+    template_updater.clear_template_cache()
+    yield
+    template_updater.clear_template_cache()
+
+
+def _cases(*modules):
+    return [
+        {'test_case_id': i, 'module': module, 'description': f"Case {i}", 'preconditions': '',
+         'test_steps': "Open", 'test_data': '', 'expected_result': "Shown", 'comments': ''}
+        for i, module in enumerate(modules, 1)
+    ]
+
+
+def test_module_sheet_titles_are_valid_and_unique():
+    titles = template_generator.module_sheet_titles(["Login", "Cart: checkout", "Report", "x" * 40])
+
+    assert titles == ["Login", "Cart_ checkout", "Report (2)", "x" * 31]
+
+
+def test_partition_follows_module_names():
+    cases = _cases("Login", "Cart", "login", None)
+
+    partitions = template_updater.partition_test_cases_by_module(cases, ["Login", "Cart"])
+
+    assert template_updater.get_module_names(cases) == ["Login", "Cart"]
+    assert [case['test_case_id'] for case in partitions["Login"]] == [1, 3, 4]
+    assert [case['test_case_id'] for case in partitions["Cart"]] == [2]
+
+
+@pytest.mark.parametrize("update", [
+    template_updater.update_template_with_values,
+    xlsm_patcher.update_template_with_values_patched,
+])
+def test_one_module_sheet_per_module(update):
+    wb = load_workbook(BytesIO(update(SETTINGS, _cases("Login", "Cart", "Login"))))
+    report = wb['Report']
+    # Dòng chi tiết Round 1: một nhóm 2 dòng (Chrome, Firefox) cho mỗi module
+    detail = [row for row in range(1, report.max_row + 1) if report.cell(row, 1).value == "Round 1 in detail"][0]
+    first, second = detail + 3, detail + 5
+
+    assert wb.sheetnames == ['Cover', 'Report', 'Login', 'Cart']
+    assert [wb['Login']['B1'].value, wb['Cart']['B1'].value] == ["Login", "Cart"]
+    assert [wb['Login']['B8'].value, wb['Login']['B9'].value, wb['Cart']['B8'].value] == ["Case 1", "Case 3", "Case 2"]
+    assert [report.cell(first, 1).value, report.cell(second, 1).value] == [1, 2]
+    assert report.cell(first, 2).value == "='Login'!B1"
+    assert report.cell(second, 2).value == "='Cart'!B1"
+    assert "'Cart'!" in report.cell(second + 1, 4).value and "'Login'!" not in report.cell(second + 1, 4).value
+
+
+def test_cases_without_module_keep_the_base_template():
+    assert template_updater.get_template_path({'environment': ["Chrome"]}, _cases(None, "")) == template_generator.BASE_TEMPLATE_PATH
+
+
+def test_find_cell_by_text_sees_later_writes():
+    ws = Workbook().active
+    ws['C5'] = "Hello"
+    ws['B9'] = "Target"
+    ws['A12'] = "Total"
+
+    assert template_updater.find_cell_by_text(ws, "target") == 9
+    assert template_updater.find_cell_by_text(ws, "total") == 12
+    template_updater.set_cell_value(ws, 10, 2, "Total")
+    assert template_updater.find_cell_by_text(ws, "total") == 10
+    ws['D7'] = "Grand total"
+    template_updater.clear_sheet_index(ws)
+    assert template_updater.find_cell_by_text(ws, "total") == 7
+
+
+def test_safe_merge_cells_skips_conflicts():
+    ws = Workbook().active
+    ws.merge_cells("A1:B2")
+
+    template_updater.safe_merge_cells(ws, ["B2:C3", "C1:D1"])
+    ws.merge_cells("A5:B5")
+    template_updater.safe_merge_cells(ws, ["B5:C5"])
+
+    assert sorted(str(merged) for merged in ws.merged_cells.ranges) == ["A1:B2", "A5:B5", "C1:D1"]
+    assert ws['D1'].value is None and type(ws['D1']).__name__ == 'MergedCell'
+
+
+def test_merge_index_follows_unmerge_and_merge():
+    ws = Workbook().active
+    ws.merge_cells("A1:B1")
+    assert template_updater.check_merge_conflict(ws, 1, 1, 2, 2)
+
+    # Cùng số merged range nhưng khác vị trí
+    ws.unmerge_cells("A1:B1")
+    ws.merge_cells("A3:B3")
+
+    assert not template_updater.check_merge_conflict(ws, 1, 1, 2, 2)
+    template_updater.safe_merge_cells(ws, ["B1:C1", "B3:C3"])
+    assert sorted(str(merged) for merged in ws.merged_cells.ranges) == ["A3:B3", "B1:C1"]
+
+
+def test_generated_template_keeps_fixed_row_bound(tmp_path):
+    output = str(tmp_path / "generated_3En.xlsm")
+    template_generator.generate_template(template_generator.BASE_TEMPLATE_PATH, 3, output)
+    generated = load_workbook(output)
+    handmade = load_workbook(os.path.join(REPO_ROOT, "TPL_TestResult_v1.0_3En.xlsm"))
+
+    # I7:I9999 → I9:I9999 như template làm tay, chỉ dòng đầu range dời theo dòng được nhân
+    for cell in ("D28", "D29", "D30", "E35"):
+        assert generated['Report'][cell].value == handmade['Report'][cell].value
+    assert "9999" in generated['Report']['D28'].value
+    assert generated['Module 1']['G3'].value == handmade['Module 1']['G3'].value
+    for title in generated.sheetnames:
+        assert ({str(merged) for merged in generated[title].merged_cells.ranges} ==
+                {str(merged) for merged in handmade[title].merged_cells.ranges})
+    assert type(generated['Module 1']['G4']).__name__ == 'MergedCell'
+    assert generated['Module 1']['G4'].border.left.style == handmade['Module 1']['G4'].border.left.style
@@ -0,0 +1,59 @@
+import csv
+import io
+import json
+import zipfile
+
+import jira_sync
+import jira_sync_store
+import xray_import
+from fake_jira_server import FakeJiraServer
+
+CASES = [
+    {'test_case_id': 1, 'description': "Login works", 'preconditions': "User exists",
+     'test_steps': "Open login", 'test_data': '', 'expected_result': "Form shown"},
+    {'test_case_id': 2, 'description': "Logout works", 'preconditions': "User is logged in",
+     'test_steps': "Click logout", 'test_data': '', 'expected_result': "Login page shown"},
+]
+
+
+def _json_bundle(precondition_keys=None):
+    with zipfile.ZipFile(io.BytesIO(xray_import.export_xray_import_bundle(CASES, "TEST", 'json', precondition_keys))) as archive:
+        return json.loads(archive.read('xray_tests.json')), json.loads(archive.read('xray_preconditions.json'))
+
+
+def test_json_bundle_without_jira_keys_inlines_preconditions():
+    tests, preconditions = _json_bundle()
+
+    # xray_tests.json là body của /import/test/bulk: một mảng test, không bọc trong object
+    assert isinstance(tests, list) and len(tests) == 2
+    assert all('xray_preconditions' not in test for test in tests)
+    assert "User exists" in tests[0]['fields']['description']
+    assert [entry['ref'] for entry in preconditions] == [None, None]
+
+
+def test_bundles_reference_existing_preconditions_by_key():
+    keys = {jira_sync.normalize_precondition_summary("User exists"): "TEST-7"}
+
+    tests, _ = _json_bundle(keys)
+    with zipfile.ZipFile(io.BytesIO(xray_import.export_xray_import_bundle(CASES, "TEST", 'csv', keys))) as archive:
+        rows = list(csv.DictReader(io.TextIOWrapper(archive.open('xray_tests.csv'), encoding='utf-8-sig')))
+
+    assert tests[0]['xray_preconditions'] == ["TEST-7"]
+    assert 'description' not in tests[0]['fields']
+    assert 'xray_preconditions' not in tests[1]
+    assert [row['Pre-Condition'] for row in rows] == ["TEST-7", ""]
+    assert "User is logged in" in rows[1]['Description']
+
+
+def test_resolve_precondition_keys_reads_jira(tmp_path, monkeypatch):
+    monkeypatch.setattr(jira_sync_store, "SYNC_STORE_FILE", str(tmp_path / "jira_sync.db"))
+    jira_sync.clear_jira_caches()
+    with FakeJiraServer() as server:
+        key = server._create_issue({'project': {'key': 'TEST'}, 'summary': "User exists", 'issuetype': {'name': 'Pre-Condition'}})['key']
+        settings = {'jira_server': server.url, 'jira_username': 'test', 'jira_password': 'test'}
+
+        keys = xray_import.resolve_precondition_keys("TEST", settings)
+    jira_sync.clear_jira_caches()
+
+    assert keys == {"user exists": key}
+    assert xray_import.resolve_precondition_keys("TEST", {}) is None
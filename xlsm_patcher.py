@@ -0,0 +1,299 @@
+# xlsm_patcher.py - Điền template XLSM bằng cách sửa trực tiếp XML trong file zip (không dùng openpyxl)
+#
+# Chỉ các part bị sửa được ghi lại: XML của sheet có cell thay đổi, sharedStrings
+# (thêm chuỗi mới vào cuối) và - nếu ghi đè cell có công thức - calcChain bị bỏ để Excel tự tính lại.
+# Mọi part khác (vbaProject.bin, styles, drawings, customXml...) được copy nguyên byte.
+import posixpath
+import re
+import zipfile
+from io import BytesIO
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from template_updater import (
+    MODULE_SHEET_COLUMNS,
+    cover_sheet_values,
+    get_module_sheet_names,
+    get_template_path,
+    module_sheet_values,
+    partition_test_cases_by_module,
+    report_sheet_values,
+)
+
+SPREADSHEET_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+RELATIONSHIP_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PACKAGE_RELATIONSHIP_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+_ROW_PATTERN = re.compile(r'<row\b[^>]*?(?:/>|>.*?</row>)', re.DOTALL)
+_CELL_PATTERN = re.compile(r'<c\b[^>]*?(?:/>|>.*?</c>)', re.DOTALL)
+_ROW_NUMBER = re.compile(r'\br="(\d+)"')
+_CELL_REF = re.compile(r'\br="([A-Z]+)(\d+)"')
+_CELL_STYLE = re.compile(r'\bs="(\d+)"')
+_SPANS_ATTR = re.compile(r'\sspans="[^"]*"')
+_DIMENSION = re.compile(r'<dimension ref="([^"]*)"\s*/>')
+_COORDINATE = re.compile(r'^([A-Z]+)(\d+)$')
+_ILLEGAL_XML_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_SST_COUNTS = re.compile(r'\s(count|uniqueCount)="\d+"')
+
+
+def column_index(letters: str) -> int:
+    """'A' → 1, 'AA' → 27"""
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - 64
+    return index
+
+
+def column_letters(index: int) -> str:
+    """1 → 'A', 27 → 'AA'"""
+    letters = ""
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+class _SharedStrings:
+    """Chuỗi mới được thêm vào cuối sharedStrings.xml (chuỗi cũ giữ nguyên index)"""
+
+    def __init__(self, xml: Optional[str]):
+        self.xml = xml
+        self.existing = len(re.findall(r'<si[\s>/]', xml)) if xml else 0
+        self.added: Dict[str, int] = {}
+        self.references = 0
+
+    def index(self, text: str) -> int:
+        self.references += 1
+        if text not in self.added:
+            self.added[text] = self.existing + len(self.added)
+        return self.added[text]
+
+    def render(self) -> str:
+        items = []
+        for text in self.added:
+            space = ' xml:space="preserve"' if text != text.strip() or '\n' in text else ''
+            items.append(f'<si><t{space}>{escape(text)}</t></si>')
+        xml = self.xml
+        head, separator, tail = xml.rpartition('</sst>')
+        total = self.existing + len(self.added)
+        # count = số lần tham chiếu; không đếm lại các sheet không sửa nên chỉ cộng thêm phần mới
+        count_match = re.search(r'\scount="(\d+)"', head)
+        count = (int(count_match.group(1)) if count_match else self.existing) + self.references
+        head = _SST_COUNTS.sub('', head, count=2)
+        head = head.replace('<sst ', f'<sst count="{count}" uniqueCount="{total}" ', 1)
+        return head + ''.join(items) + separator + tail
+
+
+def _cell_xml(reference: str, style: Optional[str], value: Any, shared_strings: _SharedStrings) -> str:
+    """XML của một cell, giữ style (s) của cell cũ"""
+    style_attr = f' s="{style}"' if style is not None else ''
+    if value is None or value == "":
+        return f'<c r="{reference}"{style_attr}/>'
+    if isinstance(value, bool):
+        return f'<c r="{reference}"{style_attr} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c r="{reference}"{style_attr}><v>{value!r}</v></c>'
+    text = _ILLEGAL_XML_CHARS.sub('', str(value))
+    if text.startswith('=') and len(text) > 1:
+        # Giống openpyxl: chuỗi bắt đầu bằng '=' được ghi thành công thức
+        return f'<c r="{reference}"{style_attr}><f>{escape(text[1:])}</f><v></v></c>'
+    if shared_strings.xml is None:
+        space = ' xml:space="preserve"' if text != text.strip() or '\n' in text else ''
+        return f'<c r="{reference}"{style_attr} t="inlineStr"><is><t{space}>{escape(text)}</t></is></c>'
+    return f'<c r="{reference}"{style_attr} t="s"><v>{shared_strings.index(text)}</v></c>'
+
+
+def _patch_row(row_xml: str, row_number: int, edits: Dict[int, Any], shared_strings: _SharedStrings) -> Tuple[str, bool]:
+    """Ghi các cell của một dòng có sẵn; trả về (xml mới, có ghi đè công thức không)"""
+    cells: List[Tuple[int, str]] = []
+    overwrote_formula = False
+    pending = dict(edits)
+    for match in _CELL_PATTERN.finditer(row_xml):
+        cell_xml = match.group(0)
+        ref = _CELL_REF.search(cell_xml)
+        column = column_index(ref.group(1)) if ref else len(cells) + 1
+        if column in pending:
+            style = _CELL_STYLE.search(cell_xml)
+            overwrote_formula = overwrote_formula or '<f' in cell_xml
+            cell_xml = _cell_xml(f"{column_letters(column)}{row_number}", style.group(1) if style else None,
+                                 pending.pop(column), shared_strings)
+        cells.append((column, cell_xml))
+    for column, value in pending.items():
+        cells.append((column, _cell_xml(f"{column_letters(column)}{row_number}", None, value, shared_strings)))
+    cells.sort(key=lambda cell: cell[0])
+
+    open_tag = row_xml[:row_xml.index('>') + 1]
+    if open_tag.endswith('/>'):
+        open_tag = open_tag[:-2].rstrip() + '>'
+    # spans chỉ là gợi ý tối ưu của Excel - bỏ đi vì dòng có thể có thêm cell
+    open_tag = _SPANS_ATTR.sub('', open_tag)
+    return open_tag + ''.join(cell for _, cell in cells) + '</row>', overwrote_formula
+
+
+def _iter_patched_sheet(sheet_xml: str, edits: Dict[int, Dict[int, Any]], shared_strings: _SharedStrings,
+                        state: Dict[str, bool]) -> Iterator[str]:
+    """Stream XML của sheet: các phần không bị sửa giữ nguyên, dòng sửa / dòng mới được chèn theo thứ tự"""
+    if '<sheetData/>' in sheet_xml:
+        sheet_xml = sheet_xml.replace('<sheetData/>', '<sheetData></sheetData>', 1)
+    data_start = sheet_xml.index('<sheetData>') + len('<sheetData>')
+    data_end = sheet_xml.index('</sheetData>')
+
+    max_row = max(edits) if edits else 0
+    max_column = max((max(columns) for columns in edits.values() if columns), default=0)
+    prefix = sheet_xml[:data_start]
+    dimension = _DIMENSION.search(prefix)
+    if dimension and edits:
+        first, _, last = dimension.group(1).partition(':')
+        last_match = _COORDINATE.match(last or first)
+        if last_match:
+            new_last = (column_letters(max(column_index(last_match.group(1)), max_column)) +
+                        str(max(int(last_match.group(2)), max_row)))
+            prefix = prefix[:dimension.start()] + f'<dimension ref="{first}:{new_last}"/>' + prefix[dimension.end():]
+    yield prefix
+
+    pending_rows = sorted(edits)
+    position = 0
+
+    def new_rows_before(limit: Optional[int]) -> Iterator[str]:
+        nonlocal position
+        while position < len(pending_rows) and (limit is None or pending_rows[position] < limit):
+            row_number = pending_rows[position]
+            cells = ''.join(
+                _cell_xml(f"{column_letters(column)}{row_number}", None, value, shared_strings)
+                for column, value in sorted(edits[row_number].items())
+            )
+            yield f'<row r="{row_number}">{cells}</row>'
+            position += 1
+
+    data = sheet_xml[data_start:data_end]
+    last_end = 0
+    for match in _ROW_PATTERN.finditer(data):
+        row_number = int(_ROW_NUMBER.search(match.group(0)[:match.group(0).index('>') + 1]).group(1))
+        yield data[last_end:match.start()]
+        yield from new_rows_before(row_number)
+        if position < len(pending_rows) and pending_rows[position] == row_number:
+            row_xml, overwrote_formula = _patch_row(match.group(0), row_number, edits[row_number], shared_strings)
+            state['overwrote_formula'] = state['overwrote_formula'] or overwrote_formula
+            position += 1
+            yield row_xml
+        else:
+            yield match.group(0)
+        last_end = match.end()
+    yield data[last_end:]
+    yield from new_rows_before(None)
+    yield sheet_xml[data_end:]
+
+
+def _resolve_target(base_part: str, target: str) -> str:
+    if target.startswith('/'):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base_part), target))
+
+
+def _read_relationships(zin: zipfile.ZipFile, part: str) -> List[Dict[str, str]]:
+    rels_part = posixpath.join(posixpath.dirname(part), '_rels', posixpath.basename(part) + '.rels')
+    root = ElementTree.fromstring(zin.read(rels_part))
+    return [
+        {'id': rel.get('Id'), 'type': rel.get('Type'), 'target': _resolve_target(part, rel.get('Target')), 'rels_part': rels_part}
+        for rel in root.iter(f'{{{PACKAGE_RELATIONSHIP_NS}}}Relationship')
+    ]
+
+
+def _group_edits(cell_values: Dict[str, Any]) -> Dict[int, Dict[int, Any]]:
+    """{'B7': v} → {7: {2: v}}"""
+    edits: Dict[int, Dict[int, Any]] = {}
+    for coordinate, value in cell_values.items():
+        match = _COORDINATE.match(coordinate)
+        if not match:
+            raise ValueError(f"Invalid cell coordinate: {coordinate}")
+        edits.setdefault(int(match.group(2)), {})[column_index(match.group(1))] = value
+    return edits
+
+
+def patch_xlsm(template_path: str, sheet_values: Dict[str, Dict[str, Any]]) -> bytes:
+    """
+    Ghi giá trị cell vào template XLSM bằng cách sửa trực tiếp XML trong zip.
+
+    sheet_values: {tên sheet: {coordinate: value}}; sheet không có trong template bị bỏ qua.
+    Trả về bytes của file XLSM mới.
+    """
+    with zipfile.ZipFile(template_path) as zin:
+        workbook_part = 'xl/workbook.xml'
+        workbook_root = ElementTree.fromstring(zin.read(workbook_part))
+        relationships = _read_relationships(zin, workbook_part)
+        targets = {rel['id']: rel['target'] for rel in relationships}
+        sheet_parts = {
+            sheet.get('name'): targets[sheet.get(f'{{{RELATIONSHIP_NS}}}id')]
+            for sheet in workbook_root.iter(f'{{{SPREADSHEET_NS}}}sheet')
+        }
+        shared_strings_part = next((rel['target'] for rel in relationships if rel['type'].endswith('/sharedStrings')), None)
+        calc_chain = next((rel for rel in relationships if rel['type'].endswith('/calcChain')), None)
+
+        shared_strings = _SharedStrings(zin.read(shared_strings_part).decode('utf-8') if shared_strings_part else None)
+        state = {'overwrote_formula': False}
+        patched_parts: Dict[str, bytes] = {}
+        for sheet_name, cell_values in sheet_values.items():
+            part = sheet_parts.get(sheet_name)
+            if not part or not cell_values:
+                continue
+            sheet_xml = zin.read(part).decode('utf-8')
+            patched_parts[part] = ''.join(
+                _iter_patched_sheet(sheet_xml, _group_edits(cell_values), shared_strings, state)
+            ).encode('utf-8')
+        if shared_strings_part and shared_strings.added:
+            patched_parts[shared_strings_part] = shared_strings.render().encode('utf-8')
+
+        dropped_parts = set()
+        if calc_chain and state['overwrote_formula']:
+            # calcChain trỏ tới cell công thức đã bị ghi đè → bỏ để Excel tự dựng lại
+            dropped_parts.add(calc_chain['target'])
+            rels_xml = zin.read(calc_chain['rels_part']).decode('utf-8')
+            patched_parts[calc_chain['rels_part']] = re.sub(
+                rf'<Relationship\b[^>]*\bId="{re.escape(calc_chain["id"])}"[^>]*/>', '', rels_xml
+            ).encode('utf-8')
+            content_types = zin.read('[Content_Types].xml').decode('utf-8')
+            patched_parts['[Content_Types].xml'] = re.sub(
+                rf'<Override\b[^>]*PartName="/{re.escape(calc_chain["target"])}"[^>]*/>', '', content_types
+            ).encode('utf-8')
+
+        output = BytesIO()
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zout:
+            for info in zin.infolist():
+                if info.filename in dropped_parts:
+                    continue
+                data = patched_parts.get(info.filename)
+                if data is None:
+                    data = zin.read(info.filename)
+                zout.writestr(info, data)
+    return output.getvalue()
+
+
+def template_sheet_values(project_settings, test_cases, sheet_names) -> Dict[str, Dict[str, Any]]:
+    """Cùng giá trị cell với update_cover_sheet / update_report_sheet / update_module_sheets"""
+    sheet_values = {
+        'Cover': cover_sheet_values(project_settings),
+        'Report': report_sheet_values(project_settings),
+    }
+    module_sheets = get_module_sheet_names(sheet_names)
+    for sheet_name, module_cases in partition_test_cases_by_module(test_cases, module_sheets).items():
+        module_values = {}
+        for row, values in module_sheet_values(project_settings, module_cases):
+            for column, value in zip(MODULE_SHEET_COLUMNS, values):
+                module_values[f"{column}{row}"] = value
+        sheet_values[sheet_name] = module_values
+    return sheet_values
+
+
+def list_sheet_names(template_path: str) -> List[str]:
+    """Tên các sheet theo thứ tự trong workbook.xml"""
+    with zipfile.ZipFile(template_path) as zin:
+        root = ElementTree.fromstring(zin.read('xl/workbook.xml'))
+    return [sheet.get('name') for sheet in root.iter(f'{{{SPREADSHEET_NS}}}sheet')]
+
+
+def update_template_with_values_patched(project_settings, test_cases) -> bytes:
+    """Thay thế update_template_with_values: cùng template, cùng giá trị, ghi bằng patch XML"""
+    template_path = get_template_path(project_settings, test_cases)
+    sheet_values = template_sheet_values(project_settings, test_cases, list_sheet_names(template_path))
+    return patch_xlsm(template_path, sheet_values)
@@ -0,0 +1,196 @@
+# xray_import.py - Export test cases thành bundle import hàng loạt của Xray (JSON / CSV)
+#
+# Thay cho việc tạo từng issue qua API: admin import bundle bằng một job phía server
+# (JSON: POST /rest/raven/1.0/import/test/bulk, CSV: Xray Test Case Importer).
+import csv
+import io
+import json
+import zipfile
+from typing import Any, Dict, Iterable, IO, Iterator, List, Optional
+
+from jira_sync import (
+    build_precondition_index,
+    format_test_steps_with_expected_result_and_data_for_xray,
+    get_jira_client,
+    get_jira_credentials,
+    get_jira_priority,
+    normalize_precondition_summary,
+)
+
+XRAY_IMPORT_LABELS = ['test-case', 'automated-sync', 'xray']
+XRAY_CSV_TEST_COLUMNS = ['Test ID', 'Summary', 'Priority', 'Labels', 'Pre-Condition', 'Description', 'Action', 'Data', 'Expected Result']
+XRAY_CSV_PRECONDITION_COLUMNS = ['Pre-Condition', 'Summary', 'Test IDs']
+
+
+def resolve_precondition_keys(project_key: str, project_settings: dict = None) -> Optional[Dict[str, str]]:
+    """
+    Existing Pre-Condition keys of the Jira project (normalized summary → key), or None when
+    Jira is not configured or cannot be reached (the bundle then carries Pre-Conditions as text).
+    """
+    credentials = get_jira_credentials(project_settings)
+    if not all([credentials.get('server'), credentials.get('username'), credentials.get('password')]):
+        return None
+    try:
+        jira = get_jira_client(credentials['server'], credentials['username'], credentials['password'])
+        return build_precondition_index(jira, project_key)
+    except Exception as e:
+        print(f"Không đọc được Pre-Conditions từ Jira, export Pre-Condition dạng text: {e}")
+        return None
+
+
+def _precondition_description(summary: str) -> str:
+    """Pre-Condition chưa có trên Jira: ghi thành text trong description của Test"""
+    return f"*Pre-Condition:*\n{summary}"
+
+
+class _PreconditionRegistry:
+    """Dedupe Pre-Conditions theo summary đã chuẩn hóa; trả về Jira key có sẵn (None nếu Pre-Condition chưa có trên Jira)"""
+
+    def __init__(self, known_keys: Optional[Dict[str, str]] = None):
+        self.known_keys = known_keys or {}
+        self.entries: Dict[str, Dict[str, Any]] = {}
+
+    def reference(self, summary: str, test_id: str) -> Optional[str]:
+        normalized = normalize_precondition_summary(summary)
+        if not normalized:
+            return None
+        entry = self.entries.get(normalized)
+        if entry is None:
+            entry = {'ref': self.known_keys.get(normalized), 'summary': summary.strip(), 'tests': [], 'existing': normalized in self.known_keys}
+            self.entries[normalized] = entry
+        entry['tests'].append(test_id)
+        return entry['ref']
+
+
+def _iter_import_tests(test_cases: Iterable[Dict[str, Any]], registry: _PreconditionRegistry) -> Iterator[Dict[str, Any]]:
+    """Một pass qua test cases: test_id, summary, priority, steps và precondition ref của từng case"""
+    for index, test_case in enumerate(test_cases, 1):
+        test_id = str(test_case.get('test_case_id') or f"#{index}")
+        formatted = format_test_steps_with_expected_result_and_data_for_xray(
+            test_case.get('test_steps', '') or '',
+            test_case.get('expected_result', '') or '',
+            test_case.get('test_data', '') or ''
+        )
+        preconditions = (test_case.get('preconditions', '') or '').strip()
+        precondition = registry.reference(preconditions, test_id)
+        yield {
+            'test_id': test_id,
+            'summary': test_case.get('description') or f"Test Case {index}",
+            'priority': get_jira_priority(test_case),
+            'steps': [
+                {
+                    'index': step['index'],
+                    'action': step['fields']['Action'],
+                    'data': step['fields']['Data'],
+                    'result': step['fields']['Expected Result'],
+                }
+                for step in formatted.get('steps', [])
+            ],
+            'precondition': precondition,
+            # Không có key Jira → import Pre-Condition dạng text, không dùng key giả
+            'description': _precondition_description(preconditions) if preconditions and not precondition else '',
+        }
+
+
+def write_xray_json_bundle(
+    test_cases: Iterable[Dict[str, Any]],
+    project_key: str,
+    output: IO[bytes],
+    precondition_keys: Optional[Dict[str, str]] = None
+) -> Dict[str, int]:
+    """
+    Stream a ZIP bundle to a binary file object in one pass over test_cases:
+    - xray_tests.json: JSON array of Xray bulk-import test objects (testtype / fields / steps /
+      xray_preconditions), the request body for POST /rest/raven/1.0/import/test/bulk as is
+    - xray_preconditions.json: each distinct Pre-Condition once ({ref, summary, tests, existing}),
+      for review only - not part of the import request
+    A test references its Pre-Condition by Jira key (xray_preconditions) when precondition_keys
+    (normalized summary → key, see resolve_precondition_keys) knows it; otherwise the Pre-Condition
+    text goes into the test description and its 'ref' is null.
+    """
+    registry = _PreconditionRegistry(precondition_keys)
+    count = 0
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        with bundle.open('xray_tests.json', 'w') as raw, io.TextIOWrapper(raw, encoding='utf-8') as text:
+            text.write('[')
+            for test in _iter_import_tests(test_cases, registry):
+                test_object = {
+                    'testtype': 'Manual',
+                    'fields': {
+                        'summary': test['summary'],
+                        'project': {'key': project_key},
+                        'priority': {'name': test['priority']},
+                        'labels': XRAY_IMPORT_LABELS,
+                    },
+                    'steps': test['steps'],
+                }
+                if test['precondition']:
+                    test_object['xray_preconditions'] = [test['precondition']]
+                elif test['description']:
+                    test_object['fields']['description'] = test['description']
+                text.write((',\n' if count else '\n') + json.dumps(test_object, ensure_ascii=False))
+                count += 1
+            text.write('\n]\n')
+
+        with bundle.open('xray_preconditions.json', 'w') as raw, io.TextIOWrapper(raw, encoding='utf-8') as text:
+            json.dump(list(registry.entries.values()), text, ensure_ascii=False, indent=2)
+    return {'tests': count, 'preconditions': len(registry.entries)}
+
+
+def write_xray_csv_bundle(
+    test_cases: Iterable[Dict[str, Any]],
+    output: IO[bytes],
+    precondition_keys: Optional[Dict[str, str]] = None
+) -> Dict[str, int]:
+    """
+    Stream a ZIP bundle to a binary file object in one pass over test_cases:
+    - xray_tests.csv: Xray Test Case Importer layout, one row per step
+      (Test ID, Summary, Priority, Labels, Pre-Condition, Description only on the first row of a test;
+      Pre-Condition holds existing Jira keys only, other Pre-Conditions go into Description as text)
+    - xray_preconditions.csv: each distinct Pre-Condition once (key if it exists in Jira), with the tests using it
+    The target project is chosen in the importer, so it is not part of the CSV.
+    """
+    registry = _PreconditionRegistry(precondition_keys)
+    count = 0
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        with bundle.open('xray_tests.csv', 'w') as raw, io.TextIOWrapper(raw, encoding='utf-8-sig', newline='') as text:
+            writer = csv.writer(text)
+            writer.writerow(XRAY_CSV_TEST_COLUMNS)
+            for test in _iter_import_tests(test_cases, registry):
+                steps = test['steps'] or [{'action': '', 'data': '', 'result': ''}]
+                for step_number, step in enumerate(steps):
+                    first = step_number == 0
+                    writer.writerow([
+                        test['test_id'],
+                        test['summary'] if first else '',
+                        test['priority'] if first else '',
+                        ' '.join(XRAY_IMPORT_LABELS) if first else '',
+                        (test['precondition'] or '') if first else '',
+                        test['description'] if first else '',
+                        step['action'],
+                        step['data'],
+                        step['result'],
+                    ])
+                count += 1
+
+        with bundle.open('xray_preconditions.csv', 'w') as raw, io.TextIOWrapper(raw, encoding='utf-8-sig', newline='') as text:
+            writer = csv.writer(text)
+            writer.writerow(XRAY_CSV_PRECONDITION_COLUMNS)
+            for entry in registry.entries.values():
+                writer.writerow([entry['ref'] or '', entry['summary'], ' '.join(entry['tests'])])
+    return {'tests': count, 'preconditions': len(registry.entries)}
+
+
+def export_xray_import_bundle(
+    test_cases: List[Dict[str, Any]],
+    project_key: str,
+    fmt: str = 'json',
+    precondition_keys: Optional[Dict[str, str]] = None
+) -> bytes:
+    """In-memory bundle for download buttons: fmt 'json' (ZIP of two JSON files) or 'csv' (ZIP of two CSV files)"""
+    buffer = io.BytesIO()
+    if fmt == 'csv':
+        write_xray_csv_bundle(test_cases, buffer, precondition_keys)
+    else:
+        write_xray_json_bundle(test_cases, project_key, buffer, precondition_keys)
+    return buffer.getvalue()